@@ -5,10 +5,16 @@ python -m meticulous
 """
 from __future__ import absolute_import, division, print_function
 
+import io
+import json
+
 import click
 
+from meticulous._benchmark import BENCHMARK_DSN, BENCHMARK_SIZES, run_benchmarks
+from meticulous._fakegithub import FAKE_RATE_LIMIT, run_fake_github
 from meticulous._github import is_archived
 from meticulous._process import run_invocation
+from meticulous._spelling import BENCHMARK_PROCESSES, bench_processes
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
@@ -46,5 +52,55 @@ def test():
     print(is_archived("kennethreitz/clint"))
 
 
+@main.command()
+@click.option("--size", "sizes", type=int, multiple=True)
+@click.option("--dsn", default=BENCHMARK_DSN)
+@click.option("--output", nargs=1)
+def benchmark(sizes, dsn, output):
+    """
+    Storage benchmark handler
+    """
+    results = run_benchmarks(sizes or BENCHMARK_SIZES, dsn=dsn)
+    if output is None:
+        print(json.dumps(results, indent=2))
+        return
+    with io.open(output, "w", encoding="utf-8") as fobj:
+        json.dump(results, fobj, indent=2)
+
+
+@main.command()
+@click.option("--path", nargs=1, required=True)
+@click.option("--processes", type=int, multiple=True)
+def spellbench(path, processes):
+    """
+    Spelling process scaling benchmark handler
+    """
+    results = bench_processes(path, processes or BENCHMARK_PROCESSES)
+    print(json.dumps(results, indent=2))
+
+
+@main.command()
+@click.option("--root", nargs=1)
+@click.option("--port", type=int, default=8765)
+@click.option("--repos", type=int, default=20)
+@click.option("--latency", type=float, default=0.0)
+@click.option("--fork-delay", type=float, default=2.0)
+@click.option("--rate-limit", type=int, default=FAKE_RATE_LIMIT)
+def fakegithub(
+    root, port, repos, latency, fork_delay, rate_limit
+):  # pylint: disable=too-many-arguments
+    """
+    Offline GitHub stand in handler
+    """
+    run_fake_github(
+        root=root,
+        port=port,
+        repos=repos,
+        latency=latency,
+        fork_delay=fork_delay,
+        limit=rate_limit,
+    )
+
+
 if __name__ == "__main__":
     main()  # pylint: disable=no-value-for-parameter
@@ -4,30 +4,36 @@ Manage process of adding repositories
 
 import io
 import json
+import logging
 import random
-import subprocess  # noqa=S404 # nosec
-import sys
 import threading
+import time
 
 import unanimous
 from github import GithubException
 
-from meticulous._github import (
-    check_forked,
-    checkout,
-    fork,
-    get_true_orgrepo,
-    is_archived,
-    issues_allowed,
-)
+from meticulous._github import checkout, fork, is_fork_ready, issues_allowed
 from meticulous._nonword import is_local_non_word
 from meticulous._progress import add_progress, clear_progress
-from meticulous._sources import obtain_sources
-from meticulous._storage import get_json_value, set_json_value
+from meticulous._spelling import SPELLING
+from meticulous._storage import (
+    CANDIDATE_FORKED,
+    CANDIDATE_REJECTED,
+    add_pending_fork,
+    add_repository_forked,
+    batch,
+    get_suggestions,
+    remove_pending_fork,
+    set_candidate_status,
+    set_repository_dir,
+)
 from meticulous._summary import display_repo_intro
+from meticulous._vetting import VETTER
 from meticulous._websearch import get_suggestion
 
-LOCK = threading.Lock()
+FORK_WAIT_DELAY = 2
+FORK_WAIT_MAX_DELAY = 60
+FORK_WAIT_ATTEMPTS = 15
 
 
 def addrepo_handlers():
@@ -36,6 +42,7 @@ def addrepo_handlers():
     """
     return {
         "repository_load": repository_load,
+        "repository_fork_wait": repository_fork_wait,
         "repository_checkout": repository_checkout,
         "repository_summary": repository_summary,
         "repository_end": repository_end,
@@ -48,12 +55,40 @@ def repository_load(context):
     """
 
     def handler():
-        reponame = non_interactive_pickrepo()
-        if reponame is None:
+        candidate = VETTER.take()
+        if candidate is None:
             context.controller.add(
                 {"name": "repository_end", "interactive": True, "priority": 65}
             )
+            return
+        reponame = fork_candidate(candidate)
+        if reponame is None:
+            context.controller.add(
+                {"name": "repository_load", "interactive": False, "priority": 5}
+            )
         else:
+            context.controller.add(
+                {
+                    "name": "repository_fork_wait",
+                    "interactive": False,
+                    "reponame": reponame,
+                }
+            )
+
+    return handler
+
+
+def repository_fork_wait(context):
+    """
+    Task to wait for a new fork to be ready before cloning, polling again
+    with backoff so other repositories keep moving in the meantime
+    """
+
+    def handler():
+        reponame = context.taskjson["reponame"]
+        attempt = context.taskjson.get("attempt", 0)
+        if is_fork_ready(reponame):
+            remove_pending_fork(reponame)
             context.controller.add(
                 {
                     "name": "repository_checkout",
@@ -61,10 +96,59 @@ def repository_load(context):
                     "reponame": reponame,
                 }
             )
+            return
+        if attempt + 1 >= FORK_WAIT_ATTEMPTS:
+            print(f"- Fork of {reponame} not ready, giving up")
+            remove_pending_fork(reponame)
+            context.controller.add(
+                {"name": "repository_load", "interactive": False, "priority": 5}
+            )
+            return
+        task = dict(context.taskjson, attempt=attempt + 1)
+        add_later(context.controller, task, get_fork_wait_delay(attempt))
 
     return handler
 
 
+def get_fork_wait_delay(attempt):
+    """
+    Obtain the seconds to wait before polling a fork again
+    """
+    return min(FORK_WAIT_DELAY * 2**attempt, FORK_WAIT_MAX_DELAY)
+
+
+def add_later(controller, task, delay):
+    """
+    Add a task to the controller after a delay without holding a worker,
+    a task that can no longer be added is restored from the pending forks
+    on the next run
+    """
+
+    def run():
+        try:
+            controller.add(task)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Unable to add delayed task %r", task)
+
+    timer = threading.Timer(delay, run)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def wait_for_fork(reponame):
+    """
+    Block until a new fork is ready to clone
+    """
+    for attempt in range(FORK_WAIT_ATTEMPTS):
+        if is_fork_ready(reponame):
+            remove_pending_fork(reponame)
+            return True
+        time.sleep(get_fork_wait_delay(attempt))
+    remove_pending_fork(reponame)
+    return False
+
+
 def repository_checkout(context):
     """
     Task to pull a repository
@@ -108,9 +192,7 @@ def repository_summary(context):
         target = context.controller.target
         reponame = context.taskjson["reponame"]
         repodir = target / reponame
-        repository_map = get_json_value("repository_map", {})
-        repository_map[reponame] = str(repodir)
-        set_json_value("repository_map", repository_map)
+        set_repository_dir(reponame, str(repodir))
         display_repo_intro(repodir)
         context.controller.add(
             {
@@ -133,6 +215,8 @@ def interactive_add_one_new_repo(target):
     repo = non_interactive_pickrepo()
     if repo is None:
         return None
+    if not wait_for_fork(repo):
+        raise Exception(f"Fork of {repo} not ready")
     noninteractive_checkout(target, repo)
     repodir = target / repo
     display_repo_intro(repodir)
@@ -144,7 +228,7 @@ def noninteractive_checkout(target, repo):
     Handle obtaining and spell checking repo
     """
     print(f"Checkout {repo}")
-    checkout(repo, target)
+    checkout(repo, target, partial=True)
     print(f"Checking {repo}")
     spelling_check(repo, target)
     print(f"Completed checking {repo}")
@@ -155,56 +239,36 @@ def non_interactive_pickrepo():
     """
     Select next free repo
     """
-    return_orgrepo = None
-    return_repo = None
-    return_origrepo = None
-    with LOCK:
-        repository_forked = get_json_value("repository_forked", {})
-        for orgrepo in obtain_sources():
-            _, origrepo = orgrepo.split("/", 1)
-            if origrepo in repository_forked:
-                continue
-            try:
-                orgrepo = get_true_orgrepo(orgrepo)
-            except GithubException:
-                continue
-            _, repo = orgrepo.split("/", 1)
-            if repo in repository_forked:
-                continue
-            if check_forked(orgrepo):
-                print(f"Already forked (github) {orgrepo}")
-                repository_forked[origrepo] = True
-                repository_forked[repo] = True
-                set_json_value("repository_forked", repository_forked)
-                continue
-            if is_archived(orgrepo):
-                print(f"Skip archived fork (github) {orgrepo}")
-                repository_forked[origrepo] = True
-                repository_forked[repo] = True
-                set_json_value("repository_forked", repository_forked)
-                continue
-            return_orgrepo = orgrepo
-            return_origrepo = origrepo
-            return_repo = repo
-            break
+    while True:
+        candidate = VETTER.take()
+        if candidate is None:
+            return None
+        reponame = fork_candidate(candidate)
+        if reponame is not None:
+            return reponame
+
+
+def fork_candidate(candidate):
+    """
+    Fork a vetted candidate returning the repository name or None if the
+    fork failed
+    """
+    print(f"- Forking {candidate.orgrepo}")
     success = True
-    if return_orgrepo is not None:
-        print(f"- Forking {return_orgrepo}")
-        try:
-            fork(return_orgrepo)
-        except GithubException:
-            print(f"- Unable to fork {return_orgrepo}")
-            success = False
-        else:
-            if not check_forked(return_orgrepo):
-                raise Exception(f"Failed to fork {return_orgrepo}")
-        with LOCK:
-            repository_forked[return_origrepo] = True
-            repository_forked[return_repo] = True
-            set_json_value("repository_forked", repository_forked)
+    try:
+        fork(candidate.orgrepo)
+    except GithubException:
+        print(f"- Unable to fork {candidate.orgrepo}")
+        success = False
+    with batch():
+        if success:
+            add_pending_fork(candidate.repo, candidate.orgrepo)
+        add_repository_forked([candidate.origrepo, candidate.repo])
+        status = CANDIDATE_FORKED if success else CANDIDATE_REJECTED
+        set_candidate_status({candidate.source: status})
     if success:
-        return return_repo
-    return non_interactive_pickrepo()
+        return candidate.repo
+    return None
 
 
 def spelling_check(repo, target):
@@ -213,27 +277,7 @@ def spelling_check(repo, target):
     """
     repodir = target / repo
     jsonpath = repodir / "spelling.json"
-    with subprocess.Popen(  # noqa=S603 # nosec
-        [
-            sys.executable,
-            "-m",
-            "spelling",
-            "--no-display-context",
-            "--no-display-summary",
-            "--working-path",
-            str(repodir),
-            "--json-path",
-            str(jsonpath),
-        ],
-        stdout=subprocess.PIPE,
-        stdin=None,
-        stderr=subprocess.PIPE,
-    ) as procobj:
-        stdout, stderr = procobj.communicate()
-        if procobj.returncode not in (0, 1):
-            raise Exception(f"Error checking spelling:\n{stderr}\n{stdout}")
-    with io.open(jsonpath, "r", encoding="utf-8") as fobj:
-        jsonobj = json.load(fobj)
+    jsonobj = SPELLING.check(repodir)
     jsonobj = update_json_results(repo, jsonobj)
     with io.open(jsonpath, "w", encoding="utf-8") as fobj:
         json.dump(jsonobj, fobj)
@@ -253,6 +297,7 @@ def update_json_results(repo, words):
     random.SystemRandom().shuffle(items)
     count = 0
     max_suggestions = 50
+    saved = get_suggestions(words.keys())
     for index, (word, details) in enumerate(items):
         add_progress(key, f"Processing {index + 1} of {len(items)} for {repo}")
         if unanimous.util.is_nonword(word):
@@ -262,7 +307,7 @@ def update_json_results(repo, words):
             details["nonword"] = True
             continue
         if count < max_suggestions:
-            suggestion = get_suggestion(word)
+            suggestion = get_suggestion(word, saved=saved)
             count += 1
             if suggestion is not None:
                 details["suggestion"] = suggestion.save()
@@ -0,0 +1,203 @@
+"""
+Measure storage throughput
+"""
+
+import contextlib
+import json
+import os
+import pathlib
+import random
+import shutil
+import tempfile
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from meticulous._storage import (
+    ConnectionManager,
+    add_multi_repo,
+    batch,
+    clear_cache,
+    get_json_value,
+    get_multi_repo,
+    get_value,
+    prepare,
+    set_json_value,
+    set_value,
+    use_manager,
+)
+
+BATCH_SIZE = 100
+BENCHMARK_DSN = "dbname=meticulous_benchmark"
+BENCHMARK_SIZES = (1000, 10000, 100000)
+BENCHMARK_OPERATIONS = 1000
+REPO_FIXES = 10
+
+
+def bench_writes(count, wal, batched):
+    """
+    Time writing count keys to a fresh sqlite database and return the number of
+    writes per second
+    """
+    tmpdir = pathlib.Path(tempfile.mkdtemp())
+    try:
+        manager = ConnectionManager(dsn=None, sqlite_path=tmpdir / "sqlite.db", wal=wal)
+        with use_manager(manager):
+            prepare()
+            start = time.perf_counter()
+            if batched:
+                for offset in range(0, count, BATCH_SIZE):
+                    with batch():
+                        for index in range(offset, min(offset + BATCH_SIZE, count)):
+                            set_value(f"key{index}", "value")
+            else:
+                for index in range(count):
+                    set_value(f"key{index}", "value")
+            elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return count / elapsed
+
+
+def bench_write_modes(count=1000):
+    """
+    Compare writes per second before and after WAL mode and batching
+    """
+    return {
+        "rollback_journal": bench_writes(count, wal=False, batched=False),
+        "wal": bench_writes(count, wal=True, batched=False),
+        "wal_batch": bench_writes(count, wal=True, batched=True),
+    }
+
+
+def populate(size):
+    """
+    Fill the store with size keys, json keys and repository fixes
+    """
+    for offset in range(0, size, BATCH_SIZE):
+        with batch():
+            for index in range(offset, min(offset + BATCH_SIZE, size)):
+                set_value(f"key{index}", "value")
+                set_json_value(f"json{index}", {"index": index, "items": [1, 2, 3]})
+                if index % REPO_FIXES == 0:
+                    reponame = f"repo{index // REPO_FIXES}"
+                    for fix in range(REPO_FIXES):
+                        add_multi_repo(reponame, {"reponame": reponame, "fix": fix})
+
+
+def time_operations(operation, args):
+    """
+    Call the operation once per argument and return operations per second
+    """
+    start = time.perf_counter()
+    for arg in args:
+        operation(arg)
+    elapsed = time.perf_counter() - start
+    return len(args) / elapsed
+
+
+def bench_size(size, operations=BENCHMARK_OPERATIONS):
+    """
+    Time each storage call against a store holding size keys
+    """
+    rand = random.Random(size)  # nosec
+    populate(size)
+    keys = [rand.randrange(size) for _ in range(operations)]
+    cold = rand.sample(range(size), min(size, operations))
+    repos = [rand.randrange(size // REPO_FIXES) for _ in range(operations)]
+    results = {}
+    results["get_value"] = time_operations(get_value, [f"key{key}" for key in keys])
+    results["set_value"] = time_operations(
+        lambda key: set_value(key, "updated"), [f"key{key}" for key in keys]
+    )
+    # distinct keys after clearing the cache so no lookup is a cache hit
+    clear_cache()
+    results["get_json_value"] = time_operations(
+        get_json_value, [f"json{key}" for key in cold]
+    )
+    results["get_json_value_cached"] = time_operations(
+        get_json_value, [f"json{keys[0]}"] * operations
+    )
+    results["get_multi_repo"] = time_operations(
+        get_multi_repo, [f"repo{repo}" for repo in repos]
+    )
+    return [
+        {"size": size, "operation": name, "ops_per_second": round(value, 1)}
+        for name, value in results.items()
+    ]
+
+
+@contextlib.contextmanager
+def scratch_schema(dsn, name):
+    """
+    Create a postgres schema holding the tables of one benchmark run,
+    dropping it afterwards, yielding a dsn that uses it
+    """
+    con = psycopg2.connect(dsn)
+    try:
+        with con:
+            with con.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {name} CASCADE")
+                cur.execute(f"CREATE SCHEMA {name}")
+        yield psycopg2.extensions.make_dsn(dsn, options=f"-c search_path={name}")
+    finally:
+        with con:
+            with con.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {name} CASCADE")
+        con.close()
+
+
+def bench_sqlite(sizes):
+    """
+    Run the benchmark against a temporary sqlite database per size
+    """
+    results = []
+    for size in sizes:
+        tmpdir = pathlib.Path(tempfile.mkdtemp())
+        try:
+            manager = ConnectionManager(dsn=None, sqlite_path=tmpdir / "sqlite.db")
+            with use_manager(manager):
+                prepare()
+                results.extend(bench_size(size))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return results
+
+
+def bench_postgres(sizes, dsn=BENCHMARK_DSN):
+    """
+    Run the benchmark against a local postgres database, each size in a
+    scratch schema dropped afterwards so existing tables are untouched.
+    Returns None if postgres is unavailable.
+    """
+    try:
+        psycopg2.connect(dsn).close()
+    except psycopg2.OperationalError:
+        return None
+    results = []
+    for size in sizes:
+        name = f"meticulous_benchmark_{os.getpid()}_{size}"
+        with scratch_schema(dsn, name) as scratch_dsn:
+            with use_manager(ConnectionManager(dsn=scratch_dsn)):
+                prepare()
+                results.extend(bench_size(size))
+    return results
+
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, dsn=BENCHMARK_DSN):
+    """
+    Benchmark each available backend returning comparable json results
+    """
+    return {
+        "operations": BENCHMARK_OPERATIONS,
+        "backends": {
+            "sqlite": bench_sqlite(sizes),
+            "postgres": bench_postgres(sizes, dsn=dsn),
+        },
+        "write_modes": bench_write_modes(),
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run_benchmarks(), indent=2))
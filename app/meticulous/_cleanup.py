@@ -6,20 +6,40 @@ import os
 import shutil
 
 from meticulous._input import make_simple_choice
-from meticulous._storage import get_json_value, set_json_value
+from meticulous._storage import (
+    batch,
+    get_json_value,
+    remove_repository_dir,
+    set_json_value,
+)
 
 
 def remove_repo_for(repo, repodir, confirm=True):
     """
     Remove specified repo
     """
-    for name in ("repository_map", "repository_saves"):
-        repository_map = get_json_value(name, {})
+    forget_repo(repo)
+    remove_repo_dir(repodir, confirm=confirm)
+
+
+def forget_repo(repo):
+    """
+    Remove the stored details of the repo
+    """
+    with batch():
+        remove_repository_dir(repo)
+        repository_saves = get_json_value("repository_saves", {})
         try:
-            del repository_map[repo]
-            set_json_value(name, repository_map)
+            del repository_saves[repo]
+            set_json_value("repository_saves", repository_saves)
         except (KeyError, TypeError):
-            continue
+            pass
+
+
+def remove_repo_dir(repodir, confirm=True):
+    """
+    Delete the checkout directory of a repo
+    """
     if confirm:
         option = make_simple_choice(["Yes", "No"], "Delete the directory?")
     else:
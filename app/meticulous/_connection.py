@@ -0,0 +1,225 @@
+"""
+Per-thread database connections to postgres or sqlite
+"""
+
+import collections
+import contextlib
+import pathlib
+import sqlite3
+import threading
+import weakref
+
+import psycopg2
+import psycopg2.pool
+
+from meticulous._exceptions import PoolExhausted
+from meticulous._jsoncache import JsonCache
+
+POSTGRES_DSN = "dbname=meticulous"
+POSTGRES_POOL_SIZE = 20
+POSTGRES_POOL_TIMEOUT = 60
+SQLITE_TIMEOUT = 30
+
+
+def get_store_dir():
+    """
+    Locate the storage directory of this project
+    """
+    apppath = pathlib.Path.home() / ".meticulous"
+    if not apppath.is_dir():
+        apppath.mkdir()
+    return apppath
+
+
+class PostgresPool:
+    """
+    Bounded pool of postgres connections, taking a connection waits for one
+    to be returned once all are in use
+    """
+
+    backend = "postgres"
+
+    def __init__(self, dsn, size):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(0, size, dsn)
+        self.slots = threading.BoundedSemaphore(size)
+
+    def getconn(self):
+        """
+        Take a connection from the pool
+        """
+        if not self.slots.acquire(  # pylint: disable=consider-using-with
+            timeout=POSTGRES_POOL_TIMEOUT
+        ):
+            raise PoolExhausted(
+                f"No postgres connection was free after {POSTGRES_POOL_TIMEOUT}"
+                " seconds, every connection is held by a running thread"
+            )
+        try:
+            con = self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+        # Reads should not leave an idle transaction open on a reused
+        # connection, writes explicitly use a transaction block.
+        con.autocommit = True
+        return con
+
+    def putconn(self, con):
+        """
+        Return a connection to the pool
+        """
+        with contextlib.suppress(Exception):
+            self.pool.putconn(con)
+        self.slots.release()
+
+    def closeall(self):
+        """
+        Close every pooled connection
+        """
+        with contextlib.suppress(Exception):
+            self.pool.closeall()
+
+
+class SqlitePool:
+    """
+    Open sqlite connections on demand and close them when returned
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path, wal):
+        self.path = path
+        self.wal = wal
+
+    def getconn(self):
+        """
+        Open a new connection
+        """
+        dbpath = self.path
+        if dbpath is None:
+            dbpath = get_store_dir() / "sqlite.db"
+        # The connection is only used by its thread but is closed from
+        # whichever thread collects the finished thread.
+        con = sqlite3.connect(
+            str(dbpath), timeout=SQLITE_TIMEOUT, check_same_thread=False
+        )
+        if self.wal:
+            # Readers are not blocked by a writer and commits only need to
+            # sync the write ahead log rather than the whole database.
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    @staticmethod
+    def putconn(con):
+        """
+        Close a returned connection
+        """
+        with contextlib.suppress(Exception):
+            con.close()
+
+    def closeall(self):
+        """
+        Nothing is kept open once returned
+        """
+
+
+class ConnectionManager:
+    """
+    Detect the database backend once and keep one connection per thread so
+    that repeated key lookups reuse an open connection. Postgres connections
+    come from a bounded pool, a thread waits for a free connection once the
+    pool is exhausted, and each connection is returned or closed when the
+    thread that owns it exits.
+    """
+
+    def __init__(
+        self, dsn=POSTGRES_DSN, sqlite_path=None, wal=True, pool_size=POSTGRES_POOL_SIZE
+    ):
+        self.settings = {
+            "dsn": dsn,
+            "sqlite_path": sqlite_path,
+            "wal": wal,
+            "pool_size": pool_size,
+        }
+        self.cache = JsonCache()
+        self.pool = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.connections = set()
+        self.counts = collections.Counter()
+
+    def get(self):
+        """
+        Obtain the connection for the current thread opening one if required
+        """
+        con = getattr(self.local, "con", None)
+        if con is not None:
+            with self.lock:
+                self.counts["reused"] += 1
+            return con
+        with self.lock:
+            if self.pool is None:
+                self.pool = self.open_pool()
+            pool = self.pool
+        con = pool.getconn()
+        with self.lock:
+            self.connections.add(con)
+            self.counts["opened"] += 1
+        self.local.con = con
+        weakref.finalize(threading.current_thread(), self.release, con)
+        return con
+
+    def open_pool(self):
+        """
+        Work out once which backend is available, preferring postgres
+        """
+        dsn = self.settings["dsn"]
+        if dsn is not None:
+            try:
+                psycopg2.connect(dsn).close()
+            except psycopg2.OperationalError:
+                pass
+            else:
+                return PostgresPool(dsn, self.settings["pool_size"])
+        return SqlitePool(self.settings["sqlite_path"], self.settings["wal"])
+
+    def release(self, con):
+        """
+        Return the connection of a finished thread to the pool or close it
+        """
+        with self.lock:
+            if con not in self.connections:
+                return
+            self.connections.discard(con)
+            self.counts["released"] += 1
+            pool = self.pool
+        pool.putconn(con)
+
+    def stats(self):
+        """
+        Report how many connections were opened versus reused and how many
+        remain open
+        """
+        with self.lock:
+            return {
+                "backend": None if self.pool is None else self.pool.backend,
+                "opened": self.counts["opened"],
+                "reused": self.counts["reused"],
+                "released": self.counts["released"],
+                "open": len(self.connections),
+            }
+
+    def close(self):
+        """
+        Close all connections and forget the detected backend
+        """
+        with self.lock:
+            if self.pool is not None:
+                for con in self.connections:
+                    self.pool.putconn(con)
+                self.pool.closeall()
+            self.pool = None
+            self.connections = set()
+            self.cache.clear()
+            self.local = threading.local()
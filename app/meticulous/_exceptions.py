@@ -13,3 +13,9 @@ class NoRepoException(ProcessingFailed):
     """
     Raised if no repositories are available/selected
     """
+
+
+class PoolExhausted(Exception):
+    """
+    Raised if no pooled database connection became free in time
+    """
@@ -0,0 +1,606 @@
+"""
+Offline stand in for the GitHub API and git remotes
+
+Serves the REST and GraphQL calls meticulous makes from in memory state,
+keeping a bare git repository per repository under a root directory so
+clones and pushes work over file:// remotes. Select it by setting
+METICULOUS_GITHUB_URL, METICULOUS_GIT_URL and METICULOUS_SOURCE_URLS to the
+values printed by the fakegithub command.
+"""
+
+import collections
+import dataclasses
+import datetime
+import hashlib
+import http.server
+import itertools
+import json
+import pathlib
+import re
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from plumbum import local
+
+FAKE_LOGIN = "fakeuser"
+FAKE_RATE_LIMIT = 5000
+FAKE_RATE_WINDOW = 60 * 60
+FAKE_PAGE_SIZE = 30
+FAKE_BRANCH = "main"
+FAKE_ORGS = ("fakeorg", "sampleorg", "demoorg")
+FAKE_TEXT = """# {name}
+
+This projcet is used to recieve changes from the meticulous pipeline.
+It is seperate from any real repository and occured only for testing.
+"""
+ROUTES = [
+    ("GET", r"/user", "get_user", "core"),
+    ("GET", r"/user/repos", "list_user_repos", "core"),
+    ("GET", r"/repos/([^/]+/[^/]+)", "get_repo", "core"),
+    ("GET", r"/repos/([^/]+/[^/]+)/commits", "list_commits", "core"),
+    ("POST", r"/repos/([^/]+/[^/]+)/forks", "create_fork", "core"),
+    ("POST", r"/repos/([^/]+/[^/]+)/issues", "create_issue", "core"),
+    ("POST", r"/repos/([^/]+/[^/]+)/pulls", "create_pull", "core"),
+    ("POST", r"/graphql", "graphql", "graphql"),
+    ("GET", r"/rate_limit", "rate_limit", None),
+    ("GET", r"/sources.md", "sources", None),
+]
+GRAPHQL_LOOKUP = r'([ru]\d+): repository\(owner: "([^"]*)", name: "([^"]*)"\)'
+
+
+@dataclasses.dataclass
+class FakeOptions:
+    """
+    Behaviour of the stand in, the login it authenticates as, the delay
+    before each response and before a fork is ready and the rate limit
+    """
+
+    login: str = FAKE_LOGIN
+    latency: float = 0.0
+    limit: int = FAKE_RATE_LIMIT
+    fork_delay: float = 0.0
+
+
+@dataclasses.dataclass
+class FakeRecords:
+    """
+    Repositories, renames, issues and pull requests held by the stand in
+    """
+
+    repos: dict = dataclasses.field(default_factory=dict)
+    moved: dict = dataclasses.field(default_factory=dict)
+    issues: list = dataclasses.field(default_factory=list)
+    pulls: list = dataclasses.field(default_factory=list)
+    created: itertools.count = dataclasses.field(default_factory=itertools.count)
+
+
+@dataclasses.dataclass
+class FakeQuota:
+    """
+    Requests remaining in the current rate limit window by resource and the
+    count of requests served by route
+    """
+
+    remaining: dict = dataclasses.field(default_factory=dict)
+    reset: int = 0
+    served: collections.Counter = dataclasses.field(default_factory=collections.Counter)
+
+
+class FakeRoutesMixin:
+    """
+    Handlers of the REST and GraphQL routes of the stand in
+    """
+
+    def get_user(self, request):  # pylint: disable=unused-argument
+        """
+        Respond with the authenticated user
+        """
+        return 200, {
+            "login": self.options.login,
+            "type": "User",
+            "url": f"{self.base_url}/users/{self.options.login}",
+        }
+
+    def list_user_repos(self, request):
+        """
+        Respond with a page of the user's repositories newest first
+        """
+        query = request["query"]
+        page = int(query.get("page", "1"))
+        per_page = int(query.get("per_page", str(FAKE_PAGE_SIZE)))
+        with self.lock:
+            names = [
+                name
+                for name, repo in self.records.repos.items()
+                if repo["owner"] == self.options.login
+            ]
+            names.sort(
+                key=lambda name: self.records.repos[name]["created_at"], reverse=True
+            )
+            start = (page - 1) * per_page
+            end = start + per_page
+            return 200, [self.repo_json(name) for name in names[start:end]]
+
+    def get_repo(self, request, full_name):
+        """
+        Respond with a repository honouring If-None-Match
+        """
+        with self.lock:
+            full_name = self.lookup(full_name)
+            if full_name is None:
+                return 404, {"message": "Not Found"}
+            data = self.repo_json(full_name)
+        text = json.dumps(data, sort_keys=True).encode("utf-8")
+        etag = f'"{hashlib.sha1(text).hexdigest()}"'  # nosec
+        if request["headers"].get("If-None-Match") == etag:
+            return 304, None, {"ETag": etag}
+        return 200, data, {"ETag": etag}
+
+    def list_commits(self, request, full_name):  # pylint: disable=unused-argument
+        """
+        Respond with the latest commit once a new fork is ready
+        """
+        with self.lock:
+            full_name = self.lookup(full_name)
+            if full_name is None:
+                return 404, {"message": "Not Found"}
+            if time.time() < self.records.repos[full_name]["ready_at"]:
+                return 409, {"message": "Git Repository is empty."}
+        git = local["git"]
+        sha = git("--git-dir", str(self.git_dir(full_name)), "rev-parse", "HEAD")
+        return 200, [{"sha": sha.strip()}]
+
+    def create_fork(self, request, full_name):  # pylint: disable=unused-argument
+        """
+        Fork a repository to the user, ready after the fork delay
+        """
+        with self.lock:
+            full_name = self.lookup(full_name)
+            if full_name is None:
+                return 404, {"message": "Not Found"}
+            fork_name = f"{self.options.login}/{self.records.repos[full_name]['name']}"
+            if fork_name not in self.records.repos:
+                self.add_repo(fork_name, parent=full_name)
+            return 202, self.repo_json(fork_name)
+
+    def create_issue(self, request, full_name):
+        """
+        Open an issue
+        """
+        with self.lock:
+            full_name = self.lookup(full_name)
+            if full_name is None:
+                return 404, {"message": "Not Found"}
+            if not self.records.repos[full_name]["has_issues"]:
+                return 410, {"message": "Issues are disabled for this repo"}
+            number = len(self.records.issues) + len(self.records.pulls) + 1
+            issue = dict(request["body"], number=number, repository=full_name)
+            self.records.issues.append(issue)
+        return 201, self.item_json(full_name, "issues", issue)
+
+    def create_pull(self, request, full_name):
+        """
+        Open a pull request from a branch that has been pushed to a fork
+        """
+        body = request["body"]
+        owner, branch = body["head"].split(":", 1)
+        with self.lock:
+            full_name = self.lookup(full_name)
+            if full_name is None:
+                return 404, {"message": "Not Found"}
+            head_repo = f"{owner}/{self.records.repos[full_name]['name']}"
+            if head_repo not in self.records.repos:
+                return 422, {"message": "Validation Failed"}
+        git = local["git"]
+        code, _, _ = git.run(
+            ["--git-dir", str(self.git_dir(head_repo)), "rev-parse", branch],
+            retcode=None,
+        )
+        if code != 0:
+            return 422, {"message": "Validation Failed"}
+        with self.lock:
+            number = len(self.records.issues) + len(self.records.pulls) + 1
+            pull = dict(body, number=number, repository=full_name)
+            self.records.pulls.append(pull)
+        return 201, self.item_json(full_name, "pulls", pull)
+
+    def graphql(self, request):
+        """
+        Answer the aliased repository lookups issued by resolve_repos
+        """
+        data = {}
+        with self.lock:
+            for alias, owner, name in re.findall(
+                GRAPHQL_LOOKUP, request["body"]["query"]
+            ):
+                data[alias] = self.graphql_node(self.lookup(f"{owner}/{name}"))
+        return 200, {"data": data}
+
+    def rate_limit(self, request):  # pylint: disable=unused-argument
+        """
+        Report the remaining rate limit without counting against it
+        """
+        limit = self.options.limit
+        with self.lock:
+            resources = {}
+            for resource in ("core", "graphql"):
+                remaining = self.quota.remaining.get(resource, limit)
+                resources[resource] = {
+                    "limit": limit,
+                    "remaining": remaining,
+                    "reset": self.quota.reset,
+                    "used": limit - remaining,
+                }
+        return 200, {"resources": resources, "rate": resources["core"]}
+
+    def sources(self, request):  # pylint: disable=unused-argument
+        """
+        Serve a markdown source list linking every repository not owned by
+        the user
+        """
+        with self.lock:
+            names = sorted(
+                name
+                for name, repo in self.records.repos.items()
+                if repo["owner"] != self.options.login
+            )
+        lines = [f"- [{name}](https://github.com/{name})" for name in names]
+        return 200, "\n".join(["# Fake sources", ""] + lines) + "\n"
+
+
+class FakeGithub(FakeRoutesMixin):
+    """
+    Repositories, forks, issues and pull requests of the stand in along with
+    the rate limit it reports
+    """
+
+    def __init__(self, root, options=None):
+        self.root = pathlib.Path(root)
+        self.options = options or FakeOptions()
+        self.lock = threading.RLock()
+        self.records = FakeRecords()
+        self.quota = FakeQuota()
+        self.base_url = None
+
+    def git_url(self):
+        """
+        Obtain the base of the file:// git remotes
+        """
+        return self.root.resolve().as_uri()
+
+    def git_dir(self, full_name):
+        """
+        Obtain the bare git repository of a repository
+        """
+        return self.root / full_name
+
+    def add_repo(self, full_name, files=None, parent=None, **flags):
+        """
+        Create a repository with a bare git repository holding the files,
+        the archived and has_issues flags default to an active repository
+        """
+        flags = dict({"archived": False, "has_issues": True}, **flags)
+        owner, name = full_name.split("/", 1)
+        if files is None:
+            files = {"README.md": FAKE_TEXT.format(name=name)}
+        git_dir = self.git_dir(full_name)
+        git_dir.parent.mkdir(parents=True, exist_ok=True)
+        git = local["git"]
+        if parent is None:
+            workdir = pathlib.Path(tempfile.mkdtemp())
+            try:
+                for path, text in files.items():
+                    (workdir / path).parent.mkdir(parents=True, exist_ok=True)
+                    (workdir / path).write_text(text, encoding="utf-8")
+                with local.cwd(str(workdir)):
+                    git("init", "-q")
+                    git("add", "-A")
+                    git(
+                        "-c",
+                        "user.name=meticulous",
+                        "-c",
+                        "user.email=meticulous@localhost",
+                        "commit",
+                        "-q",
+                        "-m",
+                        "Initial commit",
+                    )
+                    git("branch", "-M", FAKE_BRANCH)
+                git("clone", "-q", "--bare", str(workdir), str(git_dir))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            git("clone", "-q", "--bare", str(self.git_dir(parent)), str(git_dir))
+        # serve partial clones as GitHub does
+        git("--git-dir", str(git_dir), "config", "uploadpack.allowFilter", "true")
+        with self.lock:
+            created_at = datetime.datetime(2020, 1, 1) + datetime.timedelta(
+                minutes=next(self.records.created)
+            )
+            self.records.repos[full_name] = {
+                "owner": owner,
+                "name": name,
+                "archived": flags["archived"],
+                "has_issues": flags["has_issues"],
+                "parent": parent,
+                "created_at": created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "ready_at": time.time() + (self.options.fork_delay if parent else 0),
+            }
+        return full_name
+
+    def move_repo(self, old_name, new_name):
+        """
+        Record a repository as renamed so the old name resolves to the new
+        """
+        with self.lock:
+            self.records.moved[old_name] = new_name
+
+    def seed(self, count):
+        """
+        Create count sample repositories spread across a few organizations
+        """
+        names = []
+        for index in range(count):
+            org = FAKE_ORGS[index % len(FAKE_ORGS)]
+            names.append(self.add_repo(f"{org}/project{index}"))
+        return names
+
+    def lookup(self, full_name):
+        """
+        Resolve a possibly moved repository name
+        """
+        full_name = self.records.moved.get(full_name, full_name)
+        if full_name not in self.records.repos:
+            return None
+        return full_name
+
+    def repo_json(self, full_name, nested=False):
+        """
+        Build the REST representation of a repository, repositories nested
+        as a parent or source omit their own parent as GitHub does
+        """
+        repo = self.records.repos[full_name]
+        url = f"{self.base_url}/repos/{full_name}"
+        result = {
+            "id": abs(hash(full_name)) % 10000000,
+            "name": repo["name"],
+            "full_name": full_name,
+            "owner": {"login": repo["owner"], "type": "User"},
+            "archived": repo["archived"],
+            "has_issues": repo["has_issues"],
+            "fork": repo["parent"] is not None,
+            "created_at": repo["created_at"],
+            "default_branch": FAKE_BRANCH,
+            "url": url,
+            "html_url": f"https://github.com/{full_name}",
+            "clone_url": f"{self.git_url()}/{full_name}",
+        }
+        if not nested and repo["parent"] is not None:
+            result["parent"] = self.repo_json(repo["parent"], nested=True)
+            source = repo["parent"]
+            while self.records.repos[source]["parent"] is not None:
+                source = self.records.repos[source]["parent"]
+            result["source"] = self.repo_json(source, nested=True)
+        return result
+
+    def graphql_node(self, full_name):
+        """
+        Build the GraphQL representation of a repository and its parents
+        """
+        if full_name is None:
+            return None
+        repo = self.records.repos[full_name]
+        forks = [
+            name
+            for name, fork in self.records.repos.items()
+            if fork["parent"] == full_name and fork["owner"] == self.options.login
+        ]
+        return {
+            "nameWithOwner": full_name,
+            "isArchived": repo["archived"],
+            "hasIssuesEnabled": repo["has_issues"],
+            "isFork": repo["parent"] is not None,
+            "forks": {"totalCount": len(forks)},
+            "parent": self.graphql_node(repo["parent"]),
+        }
+
+    def consume(self, resource):
+        """
+        Count a request against the rate limit, returning the headers to
+        report and whether the limit was exceeded
+        """
+        with self.lock:
+            now = time.time()
+            if now >= self.quota.reset:
+                self.quota.reset = int(now) + FAKE_RATE_WINDOW
+                self.quota.remaining = {}
+            remaining = self.quota.remaining.get(resource, self.options.limit)
+            exceeded = remaining <= 0
+            if not exceeded:
+                remaining -= 1
+                self.quota.remaining[resource] = remaining
+            headers = {
+                "X-RateLimit-Limit": str(self.options.limit),
+                "X-RateLimit-Remaining": str(remaining),
+                "X-RateLimit-Reset": str(self.quota.reset),
+                "X-RateLimit-Used": str(self.options.limit - remaining),
+                "X-RateLimit-Resource": resource,
+            }
+            return headers, exceeded
+
+    def refund(self, resource):
+        """
+        Return a request to the rate limit, not modified responses are free
+        """
+        with self.lock:
+            self.quota.remaining[resource] = self.quota.remaining[resource] + 1
+
+    def item_json(self, full_name, kind, item):
+        """
+        Build the REST representation of an issue or pull request
+        """
+        number = item["number"]
+        html_kind = "pull" if kind == "pulls" else "issues"
+        return {
+            "id": number,
+            "number": number,
+            "title": item.get("title"),
+            "body": item.get("body"),
+            "state": "open",
+            "url": f"{self.base_url}/repos/{full_name}/{kind}/{number}",
+            "html_url": f"https://github.com/{full_name}/{html_kind}/{number}",
+        }
+
+    def route(self, method, path):
+        """
+        Find the handler of a request returning its name, the rate limit
+        resource it counts against and the arguments taken from the path
+        """
+        for route_method, pattern, name, resource in ROUTES:
+            mobj = re.fullmatch(pattern, path)
+            if route_method == method and mobj is not None:
+                return name, resource, mobj.groups()
+        return None, None, ()
+
+    def handle(self, method, path, headers, body):
+        """
+        Route a request returning the status, body and headers to send
+        """
+        if self.options.latency:
+            time.sleep(self.options.latency)
+        parsed = urllib.parse.urlsplit(path)
+        name, resource, args = self.route(method, parsed.path)
+        if name is None:
+            return 404, {"message": "Not Found"}, {}
+        response_headers = {}
+        if resource is not None:
+            response_headers, exceeded = self.consume(resource)
+            if exceeded:
+                return 403, {"message": "API rate limit exceeded"}, response_headers
+        with self.lock:
+            self.quota.served[name] += 1
+        request = {
+            "query": dict(urllib.parse.parse_qsl(parsed.query)),
+            "headers": headers,
+            "body": body,
+        }
+        result = getattr(self, name)(request, *args)
+        if len(result) > 2:
+            response_headers.update(result[2])
+        if result[0] == 304:
+            self.refund(resource)
+        return result[0], result[1], response_headers
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Serve each request on its own thread
+    """
+
+    daemon_threads = True
+
+
+def make_handler(state):
+    """
+    Build a request handler class serving the stand in state
+    """
+
+    class FakeGithubHandler(http.server.BaseHTTPRequestHandler):
+        """
+        Translate HTTP requests to calls on the stand in state
+        """
+
+        protocol_version = "HTTP/1.1"
+
+        def respond(self, method):
+            """
+            Handle a request of any method
+            """
+            length = int(self.headers.get("Content-Length") or 0)
+            body = None
+            if length:
+                body = json.loads(self.rfile.read(length))
+            status, data, headers = state.handle(method, self.path, self.headers, body)
+            if data is None:
+                payload = b""
+            elif isinstance(data, str):
+                payload = data.encode("utf-8")
+                headers.setdefault("Content-Type", "text/markdown")
+            else:
+                payload = json.dumps(data).encode("utf-8")
+                headers.setdefault("Content-Type", "application/json")
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """
+            Handle a GET request
+            """
+            self.respond("GET")
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """
+            Handle a POST request
+            """
+            self.respond("POST")
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            """
+            Keep output quiet
+            """
+
+    return FakeGithubHandler
+
+
+def start_server(state, host="127.0.0.1", port=0):
+    """
+    Serve the stand in from a background thread returning the server
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    state.base_url = f"http://{host}:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def get_environment(state):
+    """
+    Obtain the environment settings that select the stand in
+    """
+    return {
+        "METICULOUS_GITHUB_URL": state.base_url,
+        "METICULOUS_GIT_URL": state.git_url(),
+        "METICULOUS_SOURCE_URLS": f"{state.base_url}/sources.md",
+        "GITHUB_ACCESS_TOKEN": "fake",
+    }
+
+
+def run_fake_github(root=None, port=0, repos=20, **kwargs):
+    """
+    Seed sample repositories and serve the stand in with the given options
+    until interrupted, printing the environment settings that select it
+    """
+    if root is None:
+        root = tempfile.mkdtemp()
+    state = FakeGithub(root, FakeOptions(**kwargs))
+    state.seed(repos)
+    server = start_server(state, port=port)
+    for key, value in get_environment(state).items():
+        print(f"export {key}={value}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
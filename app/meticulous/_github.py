@@ -2,22 +2,423 @@
 Handlers for checking existing forks and creating new ones.
 """
 
+import collections
+import contextlib
+import io
+import json
 import logging
 import os
 import pathlib
+import threading
+import time
 
 import github
+import requests
 from plumbum import local
 
+from meticulous._ratelimit import (
+    GRAPHQL_SCHEDULER,
+    PRIORITY_FORK,
+    PRIORITY_SUBMIT,
+    SCHEDULER,
+    prioritise,
+)
+from meticulous._reference import (
+    collect_references,
+    fill_reference,
+    get_reference_limit,
+    use_reference,
+)
 from meticulous._secrets import load_api_key
-from meticulous._storage import get_value, set_value
+from meticulous._storage import (
+    add_user_repositories,
+    batch,
+    delete_value,
+    get_json_value,
+    get_user_repository_latest,
+    get_value,
+    has_user_repository,
+    set_json_value,
+    set_value,
+)
+
+FORK_CACHE_TTL = 30 * 24 * 60 * 60
+REPO_METADATA_TTL = 7 * 24 * 60 * 60
+REPO_ETAG_TTL = 90 * 24 * 60 * 60
+FORK_INDEX_KEY = "user_repositories_refreshed"
+FORK_INDEX_TTL = 60 * 60
+FORK_INDEX_FULL_KEY = "user_repositories_full"
+FORK_INDEX_FULL_TTL = 7 * 24 * 60 * 60
+FORK_INDEX_LOCK = threading.Lock()
+GITHUB_PAGE_SIZE = 100
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_GIT_URL = "ssh://git@github.com"
+CLONE_DEPTH = 3
+CLONE_FILTER = "blob:none"
+CLONE_SPARSE_PATTERNS = (
+    "*.md",
+    "*.rst",
+    "*.txt",
+    "*.py",
+    "*.js",
+    "*.c",
+    "*.h",
+    "*.cpp",
+    "*.hpp",
+    "README*",
+    "CONTRIBUTING*",
+)
+GRAPHQL_BATCH = 100
+GRAPHQL_PARENT_DEPTH = 3
+GRAPHQL_FRAGMENT = """
+fragment fields on Repository {
+  nameWithOwner
+  isArchived
+  hasIssuesEnabled
+  isFork
+  forks(affiliations: OWNER, first: 1) { totalCount }
+}
+"""
+
+
+class GithubClient:
+    """
+    Process wide API object created on first use along with the login of the
+    authenticated user, counting the token loads and user requests avoided.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.api = None
+        self.token = None
+        self.login = None
+        self.avoided = collections.Counter()
+
+    def get_api(self):
+        """
+        Load the API Token from the secrets once and return the API object
+        """
+        with self.lock:
+            if self.api is None:
+                self.token = load_api_key()
+                self.api = github.Github(
+                    self.token, base_url=get_github_url(), per_page=GITHUB_PAGE_SIZE
+                )
+            else:
+                self.avoided["api"] += 1
+            return self.api
+
+    def get_token(self):
+        """
+        Obtain the API Token loaded alongside the API object
+        """
+        self.get_api()
+        return self.token
+
+    def get_login(self):
+        """
+        Obtain the login of the authenticated user
+        """
+        api = self.get_api()
+        with self.lock:
+            if self.login is not None:
+                self.avoided["login"] += 1
+                return self.login
+        login = github_call(lambda: api.get_user().login)
+        with self.lock:
+            self.login = login
+        return login
+
+    def stats(self):
+        """
+        Report how many token loads and user requests were avoided
+        """
+        with self.lock:
+            return dict(self.avoided)
+
+
+CLIENT = GithubClient()
+
+
+def get_github_url():
+    """
+    Allow a different GitHub API such as the offline stand in via the
+    environment variable METICULOUS_GITHUB_URL
+    """
+    return os.environ.get("METICULOUS_GITHUB_URL", GITHUB_API_URL)
+
+
+def get_git_url():
+    """
+    Allow different git remotes such as the file:// remotes of the offline
+    stand in via the environment variable METICULOUS_GIT_URL
+    """
+    return os.environ.get("METICULOUS_GIT_URL", GITHUB_GIT_URL)
+
+
+def get_clone_filter():
+    """
+    Allow a different partial clone filter such as blob:limit=1m via the
+    environment variable METICULOUS_CLONE_FILTER, empty for a full clone
+    """
+    return os.environ.get("METICULOUS_CLONE_FILTER", CLONE_FILTER)
 
 
 def get_api():
     """
     Load the API Token from the secrets and return the API object
     """
-    return github.Github(load_api_key())
+    return CLIENT.get_api()
+
+
+def get_login():
+    """
+    Obtain the login of the authenticated user
+    """
+    return CLIENT.get_login()
+
+
+def get_api_stats():
+    """
+    Report how many API calls were avoided by reusing the client
+    """
+    return CLIENT.stats()
+
+
+def github_call(func, *args, **kwargs):
+    """
+    Make a call through the API object once the shared rate limit allows it
+    at the priority of the current thread, recording the quota reported
+    """
+    with SCHEDULER.slot():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if CLIENT.api is not None:
+                requester = CLIENT.api.requester
+                remaining, limit = requester.rate_limiting
+                if limit >= 0:
+                    SCHEDULER.update(remaining, requester.rate_limiting_resettime)
+
+
+def repo_fields(data):
+    """
+    Keep the repository fields used for metadata from a REST response
+    """
+    return {
+        "full_name": data["full_name"],
+        "archived": data["archived"],
+        "has_issues": data["has_issues"],
+        "fork": data["fork"],
+    }
+
+
+def get_repo_json(orgrepo):
+    """
+    Fetch a repository from the REST API revalidating any stored copy with
+    its ETag, since a not modified response does not count against the quota
+    """
+    key = f"repo_etag|{orgrepo}"
+    saved = get_json_value(key)
+    headers = {} if saved is None else {"If-None-Match": saved["etag"]}
+    requester = get_api().requester
+    response_headers, data = github_call(
+        requester.requestJsonAndCheck, "GET", f"/repos/{orgrepo}", headers=headers
+    )
+    if data is None and saved is not None:
+        SCHEDULER.count("not_modified")
+        return saved["data"]
+    result = repo_fields(data)
+    parent = data.get("parent")
+    result["parent"] = None if parent is None else repo_fields(parent)
+    source = data.get("source")
+    result["source"] = None if source is None else repo_fields(source)
+    etag = response_headers.get("etag")
+    if etag is not None:
+        set_json_value(key, {"etag": etag, "data": result}, ttl=REPO_ETAG_TTL)
+    return result
+
+
+def get_repo_metadata(orgrepo):
+    """
+    Obtain the full name, archived and issues flags, fork status and the
+    chain of non-archived ancestors for a repository, fetched from the API
+    once and stored under both the requested and true names.
+    """
+    key = f"repo_metadata|{orgrepo}"
+    metadata = get_json_value(key)
+    if metadata is not None:
+        return metadata
+    data = get_repo_json(orgrepo)
+    metadata = repo_fields(data)
+    metadata["parents"] = []
+    root = data["source"]["full_name"] if data["source"] else None
+    parent = data["parent"]
+    while parent and not parent["archived"]:
+        metadata["parents"].append(
+            {"full_name": parent["full_name"], "has_issues": parent["has_issues"]}
+        )
+        if parent["full_name"] == root:
+            break
+        parent = get_repo_json(parent["full_name"])["parent"]
+    set_json_value(key, metadata, ttl=REPO_METADATA_TTL)
+    if metadata["full_name"] != orgrepo:
+        key = f"repo_metadata|{metadata['full_name']}"
+        set_json_value(key, metadata, ttl=REPO_METADATA_TTL)
+    return metadata
+
+
+def get_ancestor(metadata):
+    """
+    Get the furthest ancestor that is not archived from repository metadata
+    """
+    if metadata["parents"]:
+        return metadata["parents"][-1]
+    return metadata
+
+
+def graphql_repo_query(orgrepos, user_org):
+    """
+    Build one query aliasing a repository lookup with its parent chain for
+    each org/repo name, along with a lookup of the user's repository of the
+    same name
+    """
+    selection = "...fields"
+    for _ in range(GRAPHQL_PARENT_DEPTH):
+        selection = f"...fields parent {{ {selection} }}"
+    lookups = []
+    for index, orgrepo in enumerate(orgrepos):
+        owner, name = orgrepo.split("/", 1)
+        lookups.append(
+            f"r{index}: repository(owner: {json.dumps(owner)},"
+            f" name: {json.dumps(name)}) {{ {selection} }}"
+        )
+        lookups.append(
+            f"u{index}: repository(owner: {json.dumps(user_org)},"
+            f" name: {json.dumps(name)}) {{ nameWithOwner }}"
+        )
+    return "query {\n" + "\n".join(lookups) + "\n}\n" + GRAPHQL_FRAGMENT
+
+
+def graphql_metadata(node):
+    """
+    Convert a GraphQL repository node into a repository metadata record,
+    noting whether the viewer owns a fork of it or a non-archived ancestor
+    """
+    metadata = {
+        "full_name": node["nameWithOwner"],
+        "archived": node["isArchived"],
+        "has_issues": node["hasIssuesEnabled"],
+        "fork": node["isFork"],
+        "parents": [],
+    }
+    forked = node["forks"]["totalCount"] > 0
+    parent = node.get("parent")
+    while parent and not parent["isArchived"]:
+        metadata["parents"].append(
+            {
+                "full_name": parent["nameWithOwner"],
+                "has_issues": parent["hasIssuesEnabled"],
+            }
+        )
+        forked = forked or parent["forks"]["totalCount"] > 0
+        parent = parent.get("parent")
+    metadata["forked"] = forked
+    return metadata
+
+
+def resolve_repos(orgrepos, url=None):
+    """
+    Resolve up to GRAPHQL_BATCH org/repo names with one GraphQL query,
+    storing the repository metadata found and returning it by requested
+    name with None for repositories that do not exist. A repository is
+    forked if the user owns a fork of it or its ancestors, or already has
+    a repository of the same name.
+    """
+    orgrepos = list(orgrepos)
+    if len(orgrepos) > GRAPHQL_BATCH:
+        raise Exception(f"Unable to resolve more than {GRAPHQL_BATCH} repositories")
+    if not orgrepos:
+        return {}
+    if url is None:
+        url = f"{get_github_url()}/graphql"
+    token = CLIENT.get_token()
+    query = graphql_repo_query(orgrepos, get_login())
+    with GRAPHQL_SCHEDULER.slot():
+        response = requests.post(
+            url,
+            json={"query": query},
+            headers={"Authorization": f"bearer {token}"},
+            timeout=120,
+        )
+    GRAPHQL_SCHEDULER.update_from_headers(response.headers)
+    response.raise_for_status()
+    data = response.json().get("data")
+    if data is None:
+        raise Exception(f"GraphQL query failed: {response.text}")
+    results = {}
+    for index, orgrepo in enumerate(orgrepos):
+        node = data.get(f"r{index}")
+        if node is None:
+            results[orgrepo] = None
+            continue
+        metadata = graphql_metadata(node)
+        if data.get(f"u{index}") is not None:
+            metadata["forked"] = True
+        for name in sorted({orgrepo, metadata["full_name"]}):
+            set_json_value(f"repo_metadata|{name}", metadata, ttl=REPO_METADATA_TTL)
+        if metadata["forked"]:
+            repository = metadata["full_name"].split("/", 1)[-1]
+            set_value(f"forked|{repository}", "Y", ttl=FORK_CACHE_TTL)
+        results[orgrepo] = metadata
+    return results
+
+
+def refresh_fork_index():
+    """
+    Bring the local index of the user's repositories up to date, fetching
+    newest first and stopping at the newest repository already indexed
+    unless a full refresh is due. The pages are fetched without holding the
+    lock so fork checks are not blocked on the network.
+    """
+    with FORK_INDEX_LOCK:
+        if get_value(FORK_INDEX_KEY) is not None:
+            return
+        full = get_value(FORK_INDEX_FULL_KEY) is None
+        latest = None if full else get_user_repository_latest()
+    rows = get_user_repository_rows(latest)
+    now = str(time.time())
+    with FORK_INDEX_LOCK:
+        with batch():
+            add_user_repositories(rows, replace=full)
+            set_value(FORK_INDEX_KEY, now, ttl=FORK_INDEX_TTL)
+            if full:
+                set_value(FORK_INDEX_FULL_KEY, now, ttl=FORK_INDEX_FULL_TTL)
+
+
+def get_user_repository_rows(latest):
+    """
+    Fetch the name and creation time of the user's repositories created
+    after the latest one indexed, newest first
+    """
+    repos = (
+        get_api().get_user().get_repos(type="owner", sort="created", direction="desc")
+    )
+    rows = []
+    page = 0
+    while True:
+        items = github_call(repos.get_page, page)
+        for repo in items:
+            created_at = repo.created_at.isoformat()
+            if latest is not None and created_at <= latest:
+                break
+            rows.append((repo.name, created_at))
+        else:
+            if len(items) == GITHUB_PAGE_SIZE:
+                page += 1
+                continue
+        break
+    return rows
 
 
 def check_forked(orgrepo):
@@ -27,11 +428,11 @@ def check_forked(orgrepo):
     repository = orgrepo.split("/", 1)[-1]
     key = f"forked|{repository}"
     value = get_value(key)
-    if value == "Y":
-        return True
+    if value is not None:
+        return value == "Y"
     result = _check_forked(orgrepo)
     value = "Y" if result else "N"
-    set_value(key, value)
+    set_value(key, value, ttl=FORK_CACHE_TTL)
     return value == "Y"
 
 
@@ -42,12 +443,9 @@ def _check_forked(orgrepo):
     repository = orgrepo.split("/", 1)[-1]
     if _check_forked_direct(repository):
         return True
-    api = get_api()
-    repo = api.get_repo(orgrepo)
-    while repo.parent and not repo.parent.archived:
-        repo = repo.parent
-        orgrepo = repo.full_name
-        repository = orgrepo.split("/", 1)[-1]
+    metadata = get_repo_metadata(orgrepo)
+    for parent in metadata["parents"]:
+        repository = parent["full_name"].split("/", 1)[-1]
         if _check_forked_direct(repository):
             return True
     return False
@@ -55,24 +453,38 @@ def _check_forked(orgrepo):
 
 def _check_forked_direct(repository):
     """
-    Use the API to check for an existing fork
+    Use the local index of the user's repositories to check for an existing
+    fork
     """
-    api = get_api()
-    user_org = api.get_user().login
-    try:
-        api.get_repo(f"{user_org}/{repository}")
-        return True
-    except github.GithubException:
-        return False
+    refresh_fork_index()
+    return has_user_repository(repository)
+
+
+def is_fork_ready(reponame):
+    """
+    Check if the git objects of a fork of the user can be fetched, GitHub
+    creates forks asynchronously
+    """
+    requester = get_api().requester
+    user_org = get_login()
+    with prioritise(PRIORITY_FORK):
+        try:
+            github_call(
+                requester.requestJsonAndCheck,
+                "GET",
+                f"/repos/{user_org}/{reponame}/commits",
+                parameters={"per_page": 1},
+            )
+        except github.GithubException:
+            return False
+    return True
 
 
 def is_archived(orgrepo):
     """
     Check if a repository is archived
     """
-    api = get_api()
-    repo = api.get_repo(orgrepo)
-    return repo.archived
+    return get_repo_metadata(orgrepo)["archived"]
 
 
 def fork(orgrepo):
@@ -80,41 +492,102 @@ def fork(orgrepo):
     Use the API to fork a repository
     """
     api = get_api()
-    repo = api.get_repo(orgrepo)
-    repo.create_fork()
+    repo = api.get_repo(orgrepo, lazy=True)
+    with prioritise(PRIORITY_FORK):
+        github_call(repo.create_fork)
     repository = orgrepo.split("/", 1)[-1]
     key = f"forked|{repository}"
-    set_value(key, "Y")
+    with batch():
+        set_value(key, "Y", ttl=FORK_CACHE_TTL)
+        set_value(
+            f"reference_family|{repository}",
+            get_reference_family(orgrepo),
+            ttl=FORK_CACHE_TTL,
+        )
+        add_user_repositories([(repository, None)])
+        delete_value(FORK_INDEX_KEY)
 
 
-def checkout(repo, target):
+def checkout(repo, target, partial=False):
     """
     Clone a repository to under the target path
-    if it does not already exist.
+    if it does not already exist. A partial clone only fetches the files the
+    spelling check reads.
     """
-    api = get_api()
-    user_org = api.get_user().login
+    user_org = get_login()
     clone_target = target / repo
     if clone_target.exists():
         return
     git = local["/usr/bin/git"]
-    # plumbum bug workaround
-    os.chdir(pathlib.Path.home())
-    with local.cwd(str(target)):
-        git(
-            "clone",
-            "--depth=3",
-            f"ssh://git@github.com/{user_org}/{repo}",
-            str(clone_target),
-        )
+    url = f"{get_git_url()}/{user_org}/{repo}"
+    clone_filter = get_clone_filter() if partial else ""
+    limit = get_reference_limit()
+    args = ["clone"]
+    if not limit:
+        # references must not be shallow so only shallow clone without one
+        args.append(f"--depth={CLONE_DEPTH}")
+    if clone_filter:
+        args.extend([f"--filter={clone_filter}", "--single-branch", "--no-checkout"])
+    with contextlib.ExitStack() as stack:
+        if limit:
+            family = get_value(f"reference_family|{repo}", f"{user_org}/{repo}")
+            reference = stack.enter_context(use_reference(target, family))
+            args.extend(["--reference-if-able", str(reference)])
+        # plumbum bug workaround
+        os.chdir(pathlib.Path.home())
+        with local.cwd(str(target)):
+            git(*args, url, str(clone_target))
+        if clone_filter:
+            sparse_checkout(clone_target)
+        if limit:
+            fill_reference(reference, f"{user_org}/{repo}", clone_target)
+    if limit:
+        collect_references(target, limit)
+
+
+def get_reference_family(orgrepo):
+    """
+    Name the family of forks a repository belongs to from its stored
+    metadata without calling the API, or the repository itself if unknown
+    """
+    metadata = get_json_value(f"repo_metadata|{orgrepo}")
+    if metadata is None:
+        return orgrepo
+    return get_ancestor(metadata)["full_name"]
+
+
+def ignore_case(pattern):
+    """
+    Match the letters of a sparse checkout pattern in either case
+    """
+    return "".join(
+        f"[{char.lower()}{char.upper()}]" if char.isalpha() else char
+        for char in pattern
+    )
+
+
+def sparse_checkout(clone_target, patterns=CLONE_SPARSE_PATTERNS):
+    """
+    Check out only the files matching the patterns in any case so a partial
+    clone only fetches the blobs the spelling check and summary read
+    """
+    git = local["/usr/bin/git"]
+    git("-C", str(clone_target), "config", "core.sparseCheckout", "true")
+    sparse_path = pathlib.Path(clone_target) / ".git" / "info" / "sparse-checkout"
+    sparse_path.parent.mkdir(parents=True, exist_ok=True)
+    with io.open(sparse_path, "w", encoding="utf-8") as fobj:
+        for pattern in patterns:
+            print(ignore_case(pattern), file=fobj)
+    git("-C", str(clone_target), "checkout", "-q")
 
 
 def issues_allowed(reponame):
     """
     Check if issues disabled on the parent repository
     """
-    repo = get_parent_repo(reponame)
-    return repo.has_issues
+    user_org = get_login()
+    metadata = get_repo_metadata(f"{user_org}/{reponame}")
+    return get_ancestor(metadata)["has_issues"]
 
 
 def get_parent_repo(reponame):
@@ -123,38 +596,37 @@ def get_parent_repo(reponame):
     archived.
     """
     api = get_api()
-    user_org = api.get_user().login
+    user_org = get_login()
     orgrepo = f"{user_org}/{reponame}"
     try:
-        repo = api.get_repo(orgrepo)
+        metadata = get_repo_metadata(orgrepo)
     except github.GithubException:
         logging.exception("Failed to lookup %s", orgrepo)
         raise
-    while repo.parent and not repo.parent.archived:
-        repo = repo.parent
-    return repo
+    return api.get_repo(get_ancestor(metadata)["full_name"], lazy=True)
 
 
 def get_true_orgrepo(orgrepo):
     """
     Check if an organization repository has been moved
     """
-    api = get_api()
-    repo = api.get_repo(orgrepo)
-    return repo.full_name
+    return get_repo_metadata(orgrepo)["full_name"]
 
 
 def create_pr(reponame, title, body, from_branch, to_branch):
     """
     Use API to create a pull request
     """
-    api = get_api()
-    repo = get_parent_repo(reponame)
-    user_org = api.get_user().login
-    repo = get_parent_repo(reponame)
-    pullreq = repo.create_pull(
-        title=title, body=body, base=to_branch, head=f"{user_org}:{from_branch}"
-    )
+    with prioritise(PRIORITY_SUBMIT):
+        repo = get_parent_repo(reponame)
+        user_org = get_login()
+        pullreq = github_call(
+            repo.create_pull,
+            title=title,
+            body=body,
+            base=to_branch,
+            head=f"{user_org}:{from_branch}",
+        )
     return pullreq
 
 
@@ -0,0 +1,79 @@
+"""
+Versioned in-process cache of decoded json values
+"""
+
+import threading
+import time
+
+
+def is_expired(expires_at):
+    """
+    Check if an expiry time has passed
+    """
+    return expires_at is not None and expires_at <= time.time()
+
+
+class JsonCache:
+    """
+    Thread safe cache of decoded json values, each key has a version counter
+    that is bumped when the key is written so that a read racing with a write
+    never stores a stale value.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.versions = {}
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Lookup a cached value returning the version to use when storing a miss
+        """
+        with self.lock:
+            version = (self.generation, self.versions.get(key, 0))
+            try:
+                cached_version, value, expires_at = self.values[key]
+            except KeyError:
+                pass
+            else:
+                if cached_version == version and not is_expired(expires_at):
+                    self.hits += 1
+                    return True, value, version
+            self.misses += 1
+            return False, None, version
+
+    def put(self, key, version, value, expires_at):
+        """
+        Store a value read from the database if the key is unchanged since
+        """
+        with self.lock:
+            if (self.generation, self.versions.get(key, 0)) == version:
+                self.values[key] = (version, value, expires_at)
+
+    def invalidate(self, keys):
+        """
+        Bump the version of written keys
+        """
+        with self.lock:
+            for key in keys:
+                self.versions[key] = self.versions.get(key, 0) + 1
+                self.values.pop(key, None)
+
+    def clear(self):
+        """
+        Invalidate every cached key
+        """
+        with self.lock:
+            self.generation += 1
+            self.versions.clear()
+            self.values.clear()
+
+    def stats(self):
+        """
+        Report cache hits and misses
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
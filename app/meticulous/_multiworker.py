@@ -6,11 +6,18 @@ import pprint
 
 from meticulous import _input
 from meticulous._addrepo import addrepo_handlers
-from meticulous._cleanup import remove_repo_for
+from meticulous._cleanup import forget_repo, remove_repo_dir
 from meticulous._controller import Controller
 from meticulous._input_queue import get_input_queue
 from meticulous._processrepo import add_repo_save, processrepo_handlers
-from meticulous._storage import get_json_value, set_json_value, set_multi_repo
+from meticulous._storage import (
+    batch,
+    get_json_value,
+    get_pending_forks,
+    get_repository_dir,
+    remove_multi_repo,
+    set_json_value,
+)
 from meticulous._submit import submit_handlers
 from meticulous._threadpool import get_pool
 
@@ -24,11 +31,25 @@ def update_workload(workload):
     print("Initial workload:")
     pprint.pprint(workload)
     result = list(workload)
+    queued = {
+        elem.get("reponame")
+        for elem in workload
+        if elem["name"] in {"repository_fork_wait", "repository_checkout"}
+    }
+    for reponame in get_pending_forks():
+        if reponame not in queued:
+            result.append(
+                {
+                    "interactive": False,
+                    "name": "repository_fork_wait",
+                    "reponame": reponame,
+                }
+            )
     actions = {"cleanup"}
     actions.update(addrepo_handlers().keys())
     actions.update(processrepo_handlers().keys())
     actions.update(submit_handlers().keys())
-    load_count = count_names(workload, actions)
+    load_count = count_names(result, actions)
     print(f"Load Count: {load_count}")
     for _ in range(MAX_BUFFER_REPOS - load_count):
         result.append({"interactive": False, "name": "repository_load", "priority": 5})
@@ -75,11 +96,12 @@ def cleanup(context):
 
     def handler():
         reponame = context.taskjson["reponame"]
-        set_multi_repo(reponame, [])
-        repository_map = get_json_value("repository_map", {})
-        if reponame in repository_map:
-            reposave = repository_map[reponame]
-            remove_repo_for(reponame, reposave, confirm=False)
+        with batch():
+            remove_multi_repo(reponame)
+            reposave = get_repository_dir(reponame)
+            forget_repo(reponame)
+        if reposave is not None:
+            remove_repo_dir(reposave, confirm=False)
         context.controller.add(
             {"name": "prompt_quit", "interactive": True, "priority": 10}
         )
@@ -30,7 +30,15 @@ from meticulous._multiworker import main as multiworker_main
 from meticulous._multiworker import show_work_queue
 from meticulous._nonword import load_recent_non_words
 from meticulous._processrepo import interactive_task_collect_nonwords
-from meticulous._storage import get_json_value, prepare, set_json_value
+from meticulous._reference import REFERENCE_DIR
+from meticulous._sources import start_source_refresh
+from meticulous._storage import (
+    get_json_value,
+    get_repository_map,
+    prepare,
+    set_repository_dir,
+    start_compaction,
+)
 from meticulous._submit import (
     add_change_for_repo,
     fast_prepare_a_pr_or_issue_for,
@@ -63,6 +71,8 @@ def run_invocation(target, start):
         sys.exit(1)
     init()
     prepare()
+    start_compaction()
+    start_source_refresh()
     load_recent_non_words(target)
     validate_versions()
     try:
@@ -174,21 +184,20 @@ def pick_repo_save():
     """
     Select a saved repository
     """
-    return pick_repo_common("repository_saves")
+    return pick_repo_common(get_json_value("repository_saves", {}))
 
 
 def pick_repo():
     """
     Select an available repository
     """
-    return pick_repo_common("repository_map")
+    return pick_repo_common(get_repository_map())
 
 
-def pick_repo_common(key):
+def pick_repo_common(repository_list):
     """
     Select an available repository
     """
-    repository_list = get_json_value(key, {})
     if not repository_list:
         print("No repositories available.", file=sys.stderr)
         raise NoRepoException()
@@ -215,13 +224,11 @@ def manually_add_new_repo(target):
     """
     Allow entry of a new repository manually
     """
-    choices = sorted(os.listdir(target))
+    choices = sorted(name for name in os.listdir(target) if name != REFERENCE_DIR)
     option = make_simple_choice(choices, "Which Directory?")
     if option is None:
         raise NoRepoException()
-    repository_map = get_json_value("repository_map", {})
-    repository_map[option] = str(Path(target) / option)
-    set_json_value("repository_map", repository_map)
+    set_repository_dir(option, str(Path(target) / option))
 
 
 def add_new_repo(target):
@@ -261,8 +268,7 @@ def task_add_repo(obj, eng):  # pylint: disable=unused-argument
     """
     Ensures a repo has been forked.
     """
-    key = "repository_map"
-    repository_list = get_json_value(key, {})
+    repository_list = get_repository_map()
     if not repository_list:
         interactive_add_one_new_repo(obj.target)
 
@@ -271,8 +277,7 @@ def task_collect_nonwords(obj, eng):  # pylint: disable=unused-argument
     """
     Saves nonwords until a typo is found
     """
-    key = "repository_map"
-    repository_list = get_json_value(key, {})
+    repository_list = get_repository_map()
     count = len(repository_list)
     if count < 1:
         print(f"Unexpected number of repostories - {count}")
@@ -300,8 +305,7 @@ def task_cleanup(obj, eng):  # pylint: disable=unused-argument
     """
     Submits the typo
     """
-    key = "repository_map"
-    repository_map = get_json_value(key, {})
+    repository_map = get_repository_map()
     count = len(repository_map)
     if count < 1:
         print(f"Unexpected number of repostories - {count}")
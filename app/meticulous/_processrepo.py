@@ -24,7 +24,7 @@ from meticulous._nonword import (
     is_local_non_word,
     update_nonwords,
 )
-from meticulous._storage import get_json_value, get_multi_repo, set_multi_repo
+from meticulous._storage import add_multi_repo, get_repository_dir
 from meticulous._websearch import Suggestion
 
 
@@ -61,7 +61,7 @@ def collect_nonwords(context):
     def handler():
         target = context.controller.target
         reponame = context.taskjson["reponame"]
-        if reponame in get_json_value("repository_map", {}):
+        if get_repository_dir(reponame) is not None:
             interactive_task_collect_nonwords(
                 context.interaction,
                 reponame,
@@ -124,9 +124,10 @@ def interactive_task_collect_nonwords(  # pylint: disable=unused-argument
     """
     if nonword_delegate is None:
         nonword_delegate = interactive_nonword_delegate(interaction, target)
-    key = "repository_map"
-    repository_map = get_json_value(key, {})
-    repodir = repository_map[reponame]
+    repodir = get_repository_dir(reponame)
+    if repodir is None:
+        interaction.send(f"Unable to locate repository {reponame}")
+        return
     repodirpath = Path(repodir)
     jsonpath = repodirpath / "spelling.json"
     if not jsonpath.is_file():
@@ -612,14 +613,13 @@ def add_repo_save(repodir, add_word, del_word, file_paths):
     Record a typo correction
     """
     reponame = Path(repodir).name
-    saves = get_multi_repo(reponame)
-    saves.append(
+    add_multi_repo(
+        reponame,
         {
             "reponame": reponame,
             "add_word": add_word,
             "del_word": del_word,
             "file_paths": file_paths,
             "repodir": repodir,
-        }
+        },
     )
-    set_multi_repo(reponame, saves)
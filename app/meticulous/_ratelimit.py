@@ -0,0 +1,136 @@
+"""
+Share the GitHub rate limit between workers
+"""
+
+import collections
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+PRIORITY_SUBMIT = 0
+PRIORITY_FORK = 1
+PRIORITY_VET = 2
+RATE_LIMIT_RESERVE = {PRIORITY_SUBMIT: 0, PRIORITY_FORK: 50, PRIORITY_VET: 200}
+
+PRIORITY = threading.local()
+
+
+@contextlib.contextmanager
+def prioritise(priority):
+    """
+    Run the GitHub calls made within the block at the given priority
+    """
+    previous = get_priority()
+    PRIORITY.value = priority
+    try:
+        yield
+    finally:
+        PRIORITY.value = previous
+
+
+def get_priority():
+    """
+    Obtain the priority for GitHub calls made by this thread
+    """
+    return getattr(PRIORITY, "value", PRIORITY_VET)
+
+
+class RateLimitScheduler:
+    """
+    Track the remaining quota and reset time reported by GitHub, admitting
+    the highest priority caller first and holding lower priorities back
+    once the quota falls to their reserve until it resets.
+    """
+
+    def __init__(self, clock=time.time):
+        self.cond = threading.Condition()
+        self.clock = clock
+        self.remaining = None
+        self.reset = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.counts = collections.Counter()
+
+    def admissible(self, priority, now):
+        """
+        Check if the quota allows a call at the priority
+        """
+        if self.remaining is None or now >= self.reset:
+            return True
+        return self.remaining > RATE_LIMIT_RESERVE[priority]
+
+    @contextlib.contextmanager
+    def slot(self, priority=None):
+        """
+        Wait until a call at the priority may be made
+        """
+        if priority is None:
+            priority = get_priority()
+        ticket = (priority, next(self.sequence))
+        with self.cond:
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    now = self.clock()
+                    if self.waiting[0][0] == priority and self.admissible(
+                        priority, now
+                    ):
+                        break
+                    self.counts["waits"] += 1
+                    timeout = None
+                    if not self.admissible(priority, now):
+                        timeout = self.reset - now
+                    self.cond.wait(timeout=timeout)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.cond.notify_all()
+            if self.remaining is not None:
+                self.remaining -= 1
+            self.counts[f"priority{priority}"] += 1
+        yield
+
+    def update(self, remaining, reset):
+        """
+        Record the quota reported by the latest response
+        """
+        with self.cond:
+            self.remaining = remaining
+            self.reset = reset
+            self.cond.notify_all()
+
+    def update_from_headers(self, headers):
+        """
+        Record the quota from X-RateLimit response headers if present
+        """
+        headers = {key.lower(): value for key, value in headers.items()}
+        try:
+            remaining = int(headers["x-ratelimit-remaining"])
+            reset = int(headers["x-ratelimit-reset"])
+        except (KeyError, ValueError):
+            return
+        self.update(remaining, reset)
+
+    def count(self, name):
+        """
+        Count a request avoided or deferred
+        """
+        with self.cond:
+            self.counts[name] += 1
+
+    def stats(self):
+        """
+        Report the known quota and call counts
+        """
+        with self.cond:
+            return {
+                "remaining": self.remaining,
+                "reset": self.reset,
+                "counts": dict(self.counts),
+            }
+
+
+SCHEDULER = RateLimitScheduler()
+GRAPHQL_SCHEDULER = RateLimitScheduler()
@@ -0,0 +1,123 @@
+"""
+Share git objects between clones of related repositories
+"""
+
+import contextlib
+import os
+import pathlib
+import shutil
+import threading
+
+from plumbum import local
+
+REFERENCE_DIR = ".meticulous_reference"
+
+REFERENCE_LOCKS = {}
+REFERENCE_LOCKS_LOCK = threading.Lock()
+
+
+def get_reference_limit():
+    """
+    Opt in to sharing objects between clones with a reference cache size in
+    bytes via the environment variable METICULOUS_REFERENCE_BYTES
+    """
+    return int(os.environ.get("METICULOUS_REFERENCE_BYTES", "0"))
+
+
+def get_reference_path(target, family):
+    """
+    Obtain the bare repository holding the objects of a family of forks
+    named after the repository they were all forked from
+    """
+    owner, name = family.split("/", 1)
+    return pathlib.Path(target) / REFERENCE_DIR / owner / f"{name}.git"
+
+
+def get_reference_lock(path):
+    """
+    Obtain the lock held while a reference repository is in use
+    """
+    with REFERENCE_LOCKS_LOCK:
+        return REFERENCE_LOCKS.setdefault(str(path), threading.Lock())
+
+
+@contextlib.contextmanager
+def use_reference(target, family):
+    """
+    Yield the reference of a family to clone with while it cannot be
+    collected, creating it empty if needed
+    """
+    path = get_reference_path(target, family)
+    with get_reference_lock(path):
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            local["/usr/bin/git"]("init", "-q", "--bare", str(path))
+        os.utime(path)
+        yield path
+
+
+def fill_reference(path, name, clone_target):
+    """
+    Copy the packs a clone fetched beyond what it borrowed from the
+    reference into the reference, then copy the borrowed objects into the
+    clone and detach it as git clone --dissociate would. A partial clone
+    only borrows, its promisor packs lack blobs a full clone would then
+    inherit as missing.
+    """
+    git = local["/usr/bin/git"]
+    source = pathlib.Path(clone_target) / ".git" / "objects" / "pack"
+    destination = path / "objects" / "pack"
+    if not any(source.glob("pack-*.promisor")):
+        # the index is copied last so the pack is complete once it is visible
+        for suffix in (".pack", ".rev", ".idx"):
+            for pack in source.glob(f"pack-*{suffix}"):
+                if not (destination / pack.name).exists():
+                    shutil.copyfile(pack, destination / pack.name)
+        head = git("-C", str(clone_target), "rev-parse", "HEAD").strip()
+        git("--git-dir", str(path), "update-ref", f"refs/remotes/{name}/HEAD", head)
+    git("-C", str(clone_target), "repack", "-q", "-a", "-d")
+    alternates = pathlib.Path(clone_target) / ".git" / "objects" / "info"
+    with contextlib.suppress(FileNotFoundError):
+        (alternates / "alternates").unlink()
+
+
+def get_size(path):
+    """
+    Total the size of the files under a path
+    """
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            with contextlib.suppress(OSError):
+                total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+def collect_references(target, limit):
+    """
+    Remove the least recently used references until the rest fit in the
+    limit, skipping any in use
+    """
+    root = pathlib.Path(target) / REFERENCE_DIR
+    if not root.is_dir():
+        return []
+    paths = sorted(
+        root.glob("*/*.git"), key=lambda path: path.stat().st_mtime, reverse=True
+    )
+    total = 0
+    removed = []
+    for path in paths:
+        size = get_size(path)
+        total += size
+        if total <= limit:
+            continue
+        lock = get_reference_lock(path)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            shutil.rmtree(path, ignore_errors=True)
+        finally:
+            lock.release()
+        total -= size
+        removed.append(path)
+    return removed
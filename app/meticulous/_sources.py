@@ -3,15 +3,28 @@ Obtain a list of repositories to check
 """
 from __future__ import absolute_import, division, print_function
 
-import datetime
+import concurrent.futures
+import logging
+import os
 import re
+import threading
+import time
 
 import requests
 
-from meticulous._storage import get_value, set_value
+from meticulous._storage import (
+    add_candidates,
+    batch,
+    get_json_value,
+    get_value,
+    set_json_value,
+    set_value,
+)
 
-TIME_FMT = "%Y-%m-%d %H:%M:%S"
 CACHE_TIME_DAYS = 7
+SOURCE_FETCH_WORKERS = 8
+SOURCE_TIMEOUT = 120
+SOURCE_REFRESH_INTERVAL = 60 * 60
 
 SOURCE_MARKDOWN_URLS = [
     "https://raw.githubusercontent.com/timgates42/repository_list/main/README.md",
@@ -40,39 +53,148 @@ def obtain_sources():
     """
     Scan source list and return organizations/repositories
     """
-    for url in SOURCE_MARKDOWN_URLS:
+    urls = download_missing_sources()
+    for url in urls:
         for orgrepo in check_url(url):
-            orguser = orgrepo.split("/", 1)[0]
-            if orguser in BLACKLISTED_ORGUSERS:
+            if is_blacklisted(orgrepo):
                 continue
             yield orgrepo
 
 
+def download_missing_sources():
+    """
+    Download together any source lists never downloaded before, returning
+    the source list URLs
+    """
+    urls = get_source_urls()
+    missing = [url for url in urls if get_value(f"github_links|{url}") is None]
+    if missing:
+        refresh_sources(missing, force=True)
+    return urls
+
+
+def is_blacklisted(orgrepo):
+    """
+    Check if the owner of a repository asked to be excluded
+    """
+    return orgrepo.split("/", 1)[0] in BLACKLISTED_ORGUSERS
+
+
+def get_source_urls():
+    """
+    Allow replacing the source lists such as with the offline stand in via
+    the space separated environment variable METICULOUS_SOURCE_URLS
+    """
+    urls = os.environ.get("METICULOUS_SOURCE_URLS")
+    if urls is None:
+        return SOURCE_MARKDOWN_URLS
+    return urls.split()
+
+
 def check_url(url):
     """
-    Download and process the
+    Obtain the repositories linked from a source list, only downloading it
+    if it has never been downloaded as stale lists are refreshed in the
+    background
     """
-    now = datetime.datetime.now()
-    results = None
-    dkey = f"github_links_datetxt|{url}"
     key = f"github_links|{url}"
-    datetxt = get_value(dkey)
-    if datetxt is not None:
-        dobj = datetime.datetime.strptime(datetxt, TIME_FMT)
-        if dobj + datetime.timedelta(days=CACHE_TIME_DAYS) > now:
-            results = get_value(key)
+    results = get_value(key)
     if results is None:
-        results = "\n".join(get_all_markdown_github_links(url))
-        set_value(key, results)
-        set_value(dkey, now.strftime(TIME_FMT))
+        refresh_sources([url], force=True)
+        results = get_value(key, "")
     return results.splitlines()
 
 
-def get_all_markdown_github_links(url):
+def is_stale(url):
+    """
+    Check if a source list is due to be downloaded again
+    """
+    state = get_json_value(f"github_links_state|{url}")
+    if state is None:
+        return True
+    return time.time() - state["fetched_at"] > CACHE_TIME_DAYS * 24 * 60 * 60
+
+
+def fetch_source(session, url):
+    """
+    Download a source list with a conditional request so an unchanged list
+    costs a not modified response, merging the links of a changed list
+    into the candidate queue and returning if the list changed
+    """
+    key = f"github_links|{url}"
+    state_key = f"github_links_state|{url}"
+    state = get_json_value(state_key)
+    headers = {}
+    if state is not None and get_value(key) is not None:
+        if state["etag"] is not None:
+            headers["If-None-Match"] = state["etag"]
+        if state["last_modified"] is not None:
+            headers["If-Modified-Since"] = state["last_modified"]
+    response = session.get(url, headers=headers, timeout=SOURCE_TIMEOUT)
+    if response.status_code == 304:
+        set_json_value(state_key, dict(state, fetched_at=time.time()))
+        return False
+    response.raise_for_status()
+    state = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }
+    links = list(get_markdown_github_links(response.text))
+    with batch():
+        set_value(key, "\n".join(links))
+        set_json_value(state_key, state)
+        add_candidates(orgrepo for orgrepo in links if not is_blacklisted(orgrepo))
+    return True
+
+
+def refresh_sources(urls=None, force=False):
+    """
+    Concurrently download the stale source lists sharing one session,
+    returning which lists changed
+    """
+    if urls is None:
+        urls = get_source_urls()
+    if not force:
+        urls = [url for url in urls if is_stale(url)]
+    results = {}
+    with requests.Session() as session:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=SOURCE_FETCH_WORKERS
+        ) as executor:
+            futures = {executor.submit(fetch_source, session, url): url for url in urls}
+            for future in concurrent.futures.as_completed(futures):
+                url = futures[future]
+                try:
+                    results[url] = future.result()
+                except requests.RequestException:
+                    logging.exception("Failed to download %s", url)
+    return results
+
+
+def start_source_refresh(interval=SOURCE_REFRESH_INTERVAL):
+    """
+    Periodically refresh stale source lists in a background thread
+    """
+
+    def run():
+        while True:
+            try:
+                refresh_sources()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to refresh sources")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="sourcerefresh", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_markdown_github_links(data):
     """
     Obtain and filter markdown links to repositories.
     """
-    links = get_all_markdown_links(url)
+    links = get_markdown_links(data)
     for link in links:
         mobj = re.match(
             "https://github.com/([A-Za-z0-9_.-]+/[A-Za-z0-9_.-]+)(?:/|$)", link
@@ -81,21 +203,13 @@ def get_all_markdown_github_links(url):
             yield mobj.group(1)
 
 
-def get_all_markdown_links(url):
+def get_markdown_links(data):
     """
-    Obtain all the markdown links in the URL
+    Obtain all the markdown links in the markdown text
     """
-    data = download_url(url)
     matches = re.findall("[(]([^)]+)[)]", data)
     return matches
 
 
-def download_url(url):
-    """
-    Obtain the URL content
-    """
-    return requests.get(url, timeout=120).text
-
-
 if __name__ == "__main__":
     print(list(obtain_sources()))
@@ -0,0 +1,504 @@
+"""
+Spell check repositories in-process reusing the loaded dictionaries
+"""
+
+import concurrent.futures
+import copy
+import dataclasses
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+
+import pyspelling
+from plumbum import ProcessExecutionError, local
+from spelling.check import results_to_json
+from spelling.config import ConfigContext
+from spelling.dependencies import ensure_dependencies
+from unanimous.store import MemoryCache, get_cached_sha, get_current_non_words
+from wcmatch import glob
+
+from meticulous._storage import add_spelling_findings, batch, get_spelling_findings
+
+SPELLING_CHECKER = "aspell"
+SPELLING_ENCODING = "utf-8"
+WORDLIST_FLAGS = glob.N | glob.B | glob.G | glob.S | glob.O
+SHARD_SIZE = 50
+SHARD_MIN_FILES = 200
+BENCHMARK_PROCESSES = (1, 2, 4, 8)
+BLOB_MODES = {"100644", "100755"}
+WORKER = {}
+
+
+def get_custom_wordlists(wordlists, workingpath):
+    """
+    Scan the working path for existing custom wordlists
+    """
+    found = []
+    for wordlist in wordlists:
+        pattern = wordlist.replace("${DIR}", str(workingpath))
+        found.extend(glob.iglob(pattern, flags=WORDLIST_FLAGS))
+    return found
+
+
+def list_sources(task):
+    """
+    Find the files matched by the task sources
+    """
+    flags = glob.S | glob.O
+    for flag in task.get("glob_flags", "N|B|G").split("|"):
+        flags |= pyspelling.SpellingTask.GLOB_FLAG_MAP.get(flag.strip().upper(), 0)
+    limit = task.get("glob_pattern_limit", 1000)
+    files = []
+    for target in task.get("sources", []):
+        files.extend(glob.iglob(target, flags=flags, limit=limit))
+    return files
+
+
+def get_blobs(workingpath):
+    """
+    Map the files git tracks unmodified in the working path to their blob SHA
+    """
+    git = local["/usr/bin/git"]
+    try:
+        staged = git("-C", str(workingpath), "ls-files", "-s", "-z")
+        modified = git("-C", str(workingpath), "ls-files", "-m", "-z")
+    except ProcessExecutionError:
+        return {}
+    modified = set(modified.split("\0"))
+    blobs = {}
+    for entry in staged.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", 1)
+        mode, blob, stage = info.split()
+        if mode not in BLOB_MODES or stage != "0" or path in modified:
+            continue
+        blobs[str(workingpath / path)] = blob
+    return blobs
+
+
+def findings_to_json(path, findings):
+    """
+    Convert the cached findings of a file to the misspelt words structure
+    """
+    words = {}
+    for word, category in findings:
+        words.setdefault(word, {}).setdefault("files", []).append(
+            {"category": category, "file": path}
+        )
+    return words
+
+
+def json_to_findings(words):
+    """
+    Split the misspelt words structure into the findings of each file
+    """
+    findings = {}
+    for word, entry in words.items():
+        for item in entry["files"]:
+            findings.setdefault(item["file"], []).append([word, item["category"]])
+    return findings
+
+
+def check_shard(settings, task, files, task_class=None):
+    """
+    Spell check the files with the task returning the misspelt words
+    """
+    task_class = task_class or pyspelling.SpellingTask
+    spelltask = task_class(SPELLING_CHECKER, settings, jobs=1, skip_dict_compile=True)
+    patterns = [glob.escape(path) for path in files]
+    all_results = []
+    for result in spelltask.run_task(task, source_patterns=patterns):
+        if result.error:
+            logging.warning("Spelling error in %s: %s", result.context, result.error)
+            continue
+        all_results.append(result)
+    return results_to_json(all_results)
+
+
+def get_pool_context():
+    """
+    Start pool processes from a forkserver where available, or spawn them,
+    as forking copies the locks and connections held by other threads
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def init_worker(settings, task_class):
+    """
+    Set up a pool process, which imports its own engine and storage state
+    rather than sharing those of the parent, to check with the settings of
+    the engine that started it
+    """
+    WORKER["settings"] = settings
+    WORKER["task_class"] = task_class
+
+
+def check_worker_shard(task, files):
+    """
+    Spell check the files with the task in a pool process
+    """
+    return check_shard(WORKER["settings"], task, files, WORKER["task_class"])
+
+
+def merge_results(shards):
+    """
+    Combine the misspelt words found by each shard
+    """
+    words = {}
+    for shard in shards:
+        for word, entry in shard.items():
+            words.setdefault(word, {}).setdefault("files", []).extend(entry["files"])
+    return words
+
+
+@dataclasses.dataclass
+class EngineOptions:
+    """
+    Settings of a spelling engine, by default with a process per CPU
+    """
+
+    config: str = None
+    use_unanimous: bool = True
+    processes: int = None
+    shard_size: int = SHARD_SIZE
+    shard_min_files: int = SHARD_MIN_FILES
+    use_cache: bool = True
+    task_class: type = None
+
+    def __post_init__(self):
+        self.processes = self.processes or os.cpu_count() or 1
+
+
+class Dictionaries:
+    """
+    The loaded spelling configuration and the non-word dictionary compiled
+    for it, keeping replaced dictionaries until removed as checks still
+    running may use them
+    """
+
+    def __init__(self):
+        self.tmppath = None
+        self.settings = None
+        self.extra_dicts = []
+        self.fingerprint = None
+        self.nonword_version = None
+        self.stale_paths = []
+
+    def load(self, config, use_unanimous):
+        """
+        Load the configuration and compile the non-word dictionary, compiling
+        it again if the stored non-words have changed since
+        """
+        version = get_cached_sha() if use_unanimous else None
+        if self.settings is not None:
+            if version == self.nonword_version:
+                return
+            # checks still running may use the previous dictionaries
+            MemoryCache.cache = None
+            self.stale_paths.append(self.tmppath)
+        ensure_dependencies()
+        settings = ConfigContext.load(config)
+        tmppath = pathlib.Path(tempfile.mkdtemp())
+        extra_dicts = []
+        nonwords = get_current_non_words() if use_unanimous else []
+        fingerprint = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+        for nonword in sorted(nonwords):
+            fingerprint.update(f"{nonword}\n".encode("utf-8"))
+        if nonwords:
+            extra_dicts.append(compile_nonwords(settings, nonwords, tmppath))
+        self.tmppath = tmppath
+        self.extra_dicts = extra_dicts
+        self.fingerprint = fingerprint.hexdigest()
+        self.nonword_version = version
+        self.settings = settings
+
+    def remove(self):
+        """
+        Remove the compiled dictionaries and forget the configuration
+        """
+        for path in self.stale_paths + [self.tmppath]:
+            if path is not None:
+                shutil.rmtree(path, ignore_errors=True)
+        self.stale_paths = []
+        self.tmppath = None
+        self.settings = None
+        self.extra_dicts = []
+
+
+class ShardPool:
+    """
+    Process pool shared by concurrent checks, started on first use
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get(self, settings, task_class):
+        """
+        Obtain the process pool, starting it with the settings to check with
+        """
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=get_pool_context(),
+                    initializer=init_worker,
+                    initargs=(settings, task_class),
+                )
+            return self.executor
+
+    def shutdown(self):
+        """
+        Stop the pool processes
+        """
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.executor = None
+
+
+class FindingsCache:
+    """
+    Findings of the files git tracks unmodified, stored by blob SHA for the
+    dictionaries they were checked with
+    """
+
+    def __init__(self, dictionary, blobs):
+        self.dictionary = dictionary
+        self.blobs = blobs
+
+    def split(self, task, files):
+        """
+        Separate the files with stored findings returning the misspelt words
+        of those and the files still to check
+        """
+        found = get_spelling_findings(
+            self.dictionary,
+            task["name"],
+            [self.blobs[path] for path in files if path in self.blobs],
+        )
+        cached = []
+        unchecked = []
+        for path in files:
+            blob = self.blobs.get(path)
+            if blob in found:
+                cached.append(findings_to_json(path, found[blob]))
+            else:
+                unchecked.append(path)
+        return cached, unchecked
+
+    def save(self, shards, results):
+        """
+        Save the findings of each checked file tracked by git
+        """
+        if not self.blobs:
+            return
+        with batch():
+            for (task, files), words in zip(shards, results):
+                findings = json_to_findings(words)
+                add_spelling_findings(
+                    self.dictionary,
+                    task["name"],
+                    {
+                        self.blobs[path]: findings.get(path, [])
+                        for path in files
+                        if path in self.blobs
+                    },
+                )
+
+
+class SpellingEngine:
+    """
+    Load the spelling configuration once and compile the non-word dictionary
+    once so each repository check only compiles its own custom wordlists and
+    runs the spell checker without starting a new interpreter. Repositories
+    with many files are split into shards checked across a process pool.
+    Findings are cached by git blob SHA so files seen before are not checked
+    again.
+    """
+
+    def __init__(self, **options):
+        self.options = EngineOptions(**options)
+        self.lock = threading.Lock()
+        self.dictionaries = Dictionaries()
+        self.pool = ShardPool(self.options.processes)
+
+    def start(self):
+        """
+        Load the configuration and compile the non-word dictionary if not
+        loaded or the stored non-words have changed
+        """
+        with self.lock:
+            self.dictionaries.load(self.options.config, self.options.use_unanimous)
+
+    def stop(self):
+        """
+        Shut down the process pool and remove the compiled dictionaries
+        """
+        with self.lock:
+            self.pool.shutdown()
+            self.dictionaries.remove()
+
+    def get_tasks(self, workingpath, dictpath):
+        """
+        Point a copy of each matrix entry at the working path sharing a
+        single compiled dictionary of the custom wordlists
+        """
+        tasks = copy.deepcopy(self.dictionaries.settings["matrix"])
+        custom_wordlists = None
+        for task in tasks:
+            dictionary = task.setdefault("dictionary", {})
+            if custom_wordlists is None:
+                custom_wordlists = get_custom_wordlists(
+                    dictionary.get("wordlists", []), workingpath
+                )
+            dictionary["wordlists"] = list(custom_wordlists)
+            dictionary["output"] = str(dictpath)
+            options = task.setdefault(SPELLING_CHECKER, {})
+            options["add-extra-dicts"] = list(self.dictionaries.extra_dicts)
+            task["sources"] = [
+                [
+                    source.replace("${DIR}", str(workingpath))
+                    for source in task["sources"][0]
+                ]
+            ]
+        return tasks
+
+    def get_dictionary(self, tasks):
+        """
+        Identify the settings and words a check accepts so cached findings
+        are only reused with the same dictionaries
+        """
+        digest = hashlib.sha256(self.dictionaries.fingerprint.encode("utf-8"))
+        wordlists = tasks[0]["dictionary"]["wordlists"] if tasks else []
+        contents = [pathlib.Path(wordlist).read_bytes() for wordlist in wordlists]
+        for content in sorted(contents):
+            digest.update(hashlib.sha256(content).digest())
+        return digest.hexdigest()
+
+    def get_shards(self, sources):
+        """
+        Split the files of each task into shards if worth checking in parallel
+        """
+        total = sum(len(files) for _, files in sources)
+        if self.options.processes < 2 or total < self.options.shard_min_files:
+            return [(task, files) for task, files in sources if files], False
+        shards = []
+        shard_size = self.options.shard_size
+        for task, files in sources:
+            for offset in range(0, len(files), shard_size):
+                end = offset + shard_size
+                shards.append((task, files[offset:end]))
+        return shards, True
+
+    def check_shards(self, shards, parallel):
+        """
+        Spell check each shard returning the misspelt words of each
+        """
+        if not shards:
+            return []
+        pyspelling.Aspell.setup_dictionary(shards[0][0], SPELLING_CHECKER, 0)
+        settings = self.dictionaries.settings
+        task_class = self.options.task_class
+        if not parallel:
+            return [
+                check_shard(settings, task, files, task_class) for task, files in shards
+            ]
+        executor = self.pool.get(settings, task_class)
+        futures = [
+            executor.submit(check_worker_shard, task, files) for task, files in shards
+        ]
+        return [future.result() for future in futures]
+
+    def check(self, workingpath):
+        """
+        Spell check the working path returning the misspelt words and the
+        files each was found in
+        """
+        self.start()
+        workingpath = pathlib.Path(workingpath).resolve()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tasks = self.get_tasks(workingpath, pathlib.Path(tmpdir) / "custom.dic")
+            cache = FindingsCache(
+                self.get_dictionary(tasks),
+                get_blobs(workingpath) if self.options.use_cache else {},
+            )
+            cached = []
+            sources = []
+            for task in tasks:
+                task_cached, unchecked = cache.split(task, list_sources(task))
+                cached.extend(task_cached)
+                sources.append((task, unchecked))
+            shards, parallel = self.get_shards(sources)
+            results = self.check_shards(shards, parallel)
+        cache.save(shards, results)
+        return merge_results(cached + results)
+
+
+def compile_nonwords(settings, nonwords, tmppath):
+    """
+    Compile the non-words into a dictionary under the temporary path
+    returning its location
+    """
+    wordlist = tmppath / "nonwords.txt"
+    with io.open(wordlist, "w", encoding="utf-8") as fobj:
+        for nonword in nonwords:
+            print(nonword, file=fobj)
+    output = tmppath / "nonwords.dic"
+    pyspelling.Aspell.compile_dictionary(
+        SPELLING_CHECKER,
+        get_language(settings),
+        [str(wordlist)],
+        SPELLING_ENCODING,
+        str(output),
+        0,
+    )
+    return str(output)
+
+
+def get_language(settings):
+    """
+    Obtain the dictionary language configured for the spell checker
+    """
+    for task in settings["matrix"]:
+        options = task.get(SPELLING_CHECKER, {})
+        return options.get("lang", options.get("l", "en"))
+    return "en"
+
+
+def bench_processes(workingpath, processes=BENCHMARK_PROCESSES):
+    """
+    Time a sharded check of the working path at each process count
+    """
+    results = []
+    for count in processes:
+        engine = SpellingEngine(processes=count, shard_min_files=0, use_cache=False)
+        try:
+            engine.start()
+            start = time.perf_counter()
+            words = engine.check(workingpath)
+            elapsed = time.perf_counter() - start
+        finally:
+            engine.stop()
+        results.append(
+            {"processes": count, "seconds": round(elapsed, 3), "words": len(words)}
+        )
+    for result in results:
+        result["speedup"] = round(results[0]["seconds"] / result["seconds"], 2)
+    return results
+
+
+SPELLING = SpellingEngine()
@@ -2,14 +2,89 @@
 Record current progress to avoid reprocessing
 """
 
+import contextlib
+import datetime
 import json
-import pathlib
-import sqlite3
+import logging
 import threading
+import time
 
-import psycopg2
-
+from meticulous._connection import ConnectionManager
 from meticulous._constants import MULTI_SAVE_KEY
+from meticulous._jsoncache import is_expired
+from meticulous._storagewriter import StorageWriter
+
+MAX_QUERY_PARAMS = 500
+SUGGESTION_PREFIX = "suggestion."
+COMPACT_INTERVAL = 24 * 60 * 60
+CANDIDATE_PENDING = "pending"
+CANDIDATE_READY = "ready"
+CANDIDATE_FORKED = "forked"
+CANDIDATE_ARCHIVED = "archived"
+CANDIDATE_REJECTED = "rejected"
+MISSING = object()
+WORKER = threading.local()
+
+
+MANAGER = ConnectionManager()
+
+
+def apply_operations(operations):
+    """
+    Apply write operations in a single transaction
+    """
+    con = get_db()
+    with get_transaction(con):
+        with get_cursor(con) as cur:
+            for operation in operations:
+                operation(con, cur)
+
+
+WRITER = StorageWriter(apply_operations)
+
+
+def mark_worker():
+    """
+    Flag the current thread as a pool worker whose writes are queued
+    """
+    WORKER.active = True
+
+
+def is_worker():
+    """
+    Check if the current thread is a pool worker
+    """
+    return getattr(WORKER, "active", False)
+
+
+def write(operation):
+    """
+    Apply a write operation, pool workers hand it to the storage writer and
+    wait for it to be committed.
+    """
+    if is_worker():
+        pending = getattr(WORKER, "pending", None)
+        if pending is not None:
+            pending.append(operation)
+            return
+        WRITER.submit([operation]).result()
+        return
+    apply_operations([operation])
+
+
+@contextlib.contextmanager
+def use_manager(manager):
+    """
+    Temporarily direct storage to a different connection manager
+    """
+    global MANAGER  # pylint: disable=global-statement
+    previous = MANAGER
+    MANAGER = manager
+    try:
+        yield manager
+    finally:
+        MANAGER = previous
+        manager.close()
 
 
 def prepare():
@@ -18,70 +93,446 @@ def prepare():
     """
     con = get_db()
     if not check_table_exists(con, "config"):
-        with con.cursor() as cur:
-            sql = "CREATE TABLE config ( key text, value text )"
-            cur.execute(sql)
-            con.commit()
+        with get_transaction(con):
+            with get_cursor(con) as cur:
+                sql = "CREATE TABLE config ( key text, value text )"
+                cur.execute(sql)
+    migrate(con)
+    MANAGER.cache.clear()
+
+
+def migrate(con):
+    """
+    Apply any schema migrations not yet recorded against the database
+    """
+    with get_transaction(con):
+        with get_cursor(con) as cur:
+            if not check_table_exists(con, "schema_version"):
+                cur.execute("CREATE TABLE schema_version ( version integer )")
+                cur.execute("INSERT INTO schema_version ( version ) VALUES (0)")
+            cur.execute("SELECT version FROM schema_version")
+            (version,) = cur.fetchone()
+            for index, migration in enumerate(MIGRATIONS[version:], version + 1):
+                migration(con, cur)
+                sql = "UPDATE schema_version SET version = %s"
+                cur.execute(get_sql(con, sql), (index,))
+
+
+def migrate_config_key_index(con, cur):
+    """
+    Remove any duplicated keys and index the config key
+    """
+    if is_postgres(con):
+        sql = (
+            "DELETE FROM config a USING config b"
+            " WHERE a.key = b.key AND a.ctid < b.ctid"
+        )
+    else:
+        sql = (
+            "DELETE FROM config WHERE rowid NOT IN"
+            " (SELECT MAX(rowid) FROM config GROUP BY key)"
+        )
+    cur.execute(sql)
+    cur.execute("CREATE UNIQUE INDEX config_key ON config ( key )")
+
+
+def migrate_multi_repo_table(con, cur):
+    """
+    Store one row per repository fix rather than a single json list
+    """
+    sql = (
+        f"CREATE TABLE {MULTI_SAVE_KEY}"
+        f" ( id {get_id_column(con)}, reponame text, save text )"
+    )
+    cur.execute(sql)
+    sql = f"CREATE INDEX {MULTI_SAVE_KEY}_reponame ON {MULTI_SAVE_KEY} ( reponame )"
+    cur.execute(sql)
+    cur.execute(
+        get_sql(con, "SELECT value FROM config WHERE key = %s"), (MULTI_SAVE_KEY,)
+    )
+    row = cur.fetchone()
+    if row is None:
+        return
+    sql = f"INSERT INTO {MULTI_SAVE_KEY} ( reponame, save ) VALUES (%s, %s)"
+    cur.executemany(
+        get_sql(con, sql),
+        [(item["reponame"], json.dumps(item)) for item in json.loads(row[0])],
+    )
+    cur.execute(get_sql(con, "DELETE FROM config WHERE key = %s"), (MULTI_SAVE_KEY,))
+
+
+def migrate_repository_tables(con, cur):
+    """
+    Move the forked repository set and repository map out of json values
+    """
+    cur.execute("CREATE TABLE repository_forked ( name text PRIMARY KEY )")
+    cur.execute(
+        "CREATE TABLE repository_map ( reponame text PRIMARY KEY, repodir text )"
+    )
+    for key, sql in [
+        ("repository_forked", "INSERT INTO repository_forked ( name ) VALUES (%s)"),
+        (
+            "repository_map",
+            "INSERT INTO repository_map ( reponame, repodir ) VALUES (%s, %s)",
+        ),
+    ]:
+        cur.execute(get_sql(con, "SELECT value FROM config WHERE key = %s"), (key,))
+        row = cur.fetchone()
+        if row is None:
+            continue
+        value = json.loads(row[0]) or {}
+        if key == "repository_forked":
+            rows = [(name,) for name in value]
+        else:
+            rows = list(value.items())
+        cur.executemany(get_sql(con, sql), rows)
+        cur.execute(get_sql(con, "DELETE FROM config WHERE key = %s"), (key,))
+
+
+def migrate_suggestions_table(con, cur):
+    """
+    Move cached word suggestions out of the config table
+    """
+    cur.execute(
+        "CREATE TABLE suggestions ( word text PRIMARY KEY, payload text,"
+        " fetched_at double precision, source text )"
+    )
+    sql = "SELECT key, value FROM config WHERE key LIKE %s"
+    cur.execute(get_sql(con, sql), (f"{SUGGESTION_PREFIX}%",))
+    now = time.time()
+    start = len(SUGGESTION_PREFIX)
+    rows = [(key[start:], value, now, "websearch") for key, value in cur.fetchall()]
+    sql = (
+        "INSERT INTO suggestions ( word, payload, fetched_at, source )"
+        " VALUES (%s, %s, %s, %s)"
+    )
+    cur.executemany(get_sql(con, sql), rows)
+    sql = "DELETE FROM config WHERE key LIKE %s"
+    cur.execute(get_sql(con, sql), (f"{SUGGESTION_PREFIX}%",))
+
+
+def migrate_expiry_columns(con, cur):
+    """
+    Add expiry times to cached values replacing the separate date keys kept
+    for the source link cache
+    """
+    cur.execute("ALTER TABLE config ADD COLUMN expires_at double precision")
+    cur.execute("ALTER TABLE suggestions ADD COLUMN expires_at double precision")
+    prefix = "github_links_datetxt|"
+    sql = "SELECT key, value FROM config WHERE key LIKE %s"
+    cur.execute(get_sql(con, sql), (f"{prefix}%",))
+    start = len(prefix)
+    rows = []
+    for key, datetxt in cur.fetchall():
+        dobj = datetime.datetime.strptime(datetxt, "%Y-%m-%d %H:%M:%S")
+        expires_at = (dobj + datetime.timedelta(days=7)).timestamp()
+        rows.append((expires_at, f"github_links|{key[start:]}"))
+    sql = "UPDATE config SET expires_at = %s WHERE key = %s"
+    cur.executemany(get_sql(con, sql), rows)
+    sql = "DELETE FROM config WHERE key LIKE %s"
+    cur.execute(get_sql(con, sql), (f"{prefix}%",))
+
+
+def migrate_user_repositories_table(con, cur):  # pylint: disable=unused-argument
+    """
+    Add the index of repositories owned by the authenticated user
+    """
+    cur.execute(
+        "CREATE TABLE user_repositories ( name text PRIMARY KEY, created_at text )"
+    )
+
+
+def migrate_pending_forks_table(con, cur):  # pylint: disable=unused-argument
+    """
+    Add the record of forks requested but not yet ready to clone
+    """
+    cur.execute(
+        "CREATE TABLE pending_forks ( reponame text PRIMARY KEY, orgrepo text,"
+        " forked_at double precision )"
+    )
+
+
+def migrate_candidates_table(con, cur):
+    """
+    Add the queue of candidate repositories built from the cached source
+    lists, marking those already forked or rejected
+    """
+    cur.execute(
+        "CREATE TABLE candidates ( orgrepo text PRIMARY KEY, position integer,"
+        " status text )"
+    )
+    cur.execute(
+        "CREATE INDEX candidates_status_position ON candidates ( status, position )"
+    )
+    sql = "SELECT value FROM config WHERE key LIKE %s ORDER BY key"
+    cur.execute(get_sql(con, sql), ("github_links|%",))
+    orgrepos = {}
+    for (value,) in cur.fetchall():
+        for orgrepo in value.splitlines():
+            orgrepos.setdefault(orgrepo, len(orgrepos))
+    cur.execute("SELECT name FROM repository_forked")
+    forked = {name for (name,) in cur.fetchall()}
+    rows = []
+    for orgrepo, position in orgrepos.items():
+        status = CANDIDATE_PENDING
+        if orgrepo.split("/", 1)[-1] in forked:
+            status = CANDIDATE_FORKED
+        rows.append((orgrepo, position, status))
+    sql = "INSERT INTO candidates ( orgrepo, position, status ) VALUES (%s, %s, %s)"
+    cur.executemany(get_sql(con, sql), rows)
+
+
+def migrate_spelling_blobs_table(con, cur):  # pylint: disable=unused-argument
+    """
+    Add the spelling findings cached by git blob SHA
+    """
+    cur.execute(
+        "CREATE TABLE spelling_blobs ( blob text, dictionary text, task text,"
+        " findings text, PRIMARY KEY ( blob, dictionary, task ) )"
+    )
+
+
+def migrate_source_links_expiry(con, cur):
+    """
+    Keep cached source links without an expiry now that they are refreshed
+    in the background rather than expired
+    """
+    sql = "UPDATE config SET expires_at = NULL WHERE key LIKE %s"
+    cur.execute(get_sql(con, sql), ("github_links|%",))
+
+
+MIGRATIONS = [
+    migrate_config_key_index,
+    migrate_multi_repo_table,
+    migrate_repository_tables,
+    migrate_suggestions_table,
+    migrate_expiry_columns,
+    migrate_user_repositories_table,
+    migrate_pending_forks_table,
+    migrate_candidates_table,
+    migrate_spelling_blobs_table,
+    migrate_source_links_expiry,
+]
 
 
 def get_value(key, deflt=None):
     """
     Retrieve a stored key value or return a default
     """
-    con = get_db()
-    with con.cursor() as cur:
-        sql = "SELECT value FROM config WHERE key = %s"
-        cur.execute(sql, (key,))
-        for (value,) in cur:
-            return value
-        return deflt
+    value, _ = get_value_expiry(key, deflt=deflt)
+    return value
 
 
-def set_value(key, value):
+def get_value_expiry(key, deflt=None):
     """
-    Remove any old key values and insert a new key/value
+    Retrieve a stored key value and its expiry time, expired values are
+    removed and the default returned
     """
     con = get_db()
-    with con.cursor() as cur:
+    with get_cursor(con) as cur:
+        sql = "SELECT value, expires_at FROM config WHERE key = %s"
+        cur.execute(get_sql(con, sql), (key,))
+        row = cur.fetchone()
+    if row is None:
+        return deflt, None
+    value, expires_at = row
+    if is_expired(expires_at):
+        expire_value(key)
+        return deflt, None
+    return value, expires_at
+
+
+def set_value(key, value, ttl=None):
+    """
+    Insert a new key/value replacing any old value, the value expires after
+    ttl seconds if provided
+    """
+    expires_at = get_expiry(ttl)
+
+    def operation(con, cur):
+        sql = (
+            "INSERT INTO config ( key, value, expires_at ) VALUES (%s, %s, %s)"
+            " ON CONFLICT ( key ) DO UPDATE SET value = excluded.value,"
+            " expires_at = excluded.expires_at"
+        )
+        cur.execute(get_sql(con, sql), (key, value, expires_at))
+        MANAGER.local.changed.add(key)
+
+    write(operation)
+
+
+def expire_value(key):
+    """
+    Remove a key if it has expired
+    """
+    now = time.time()
+
+    def operation(con, cur):
+        sql = "DELETE FROM config WHERE key = %s AND expires_at <= %s"
+        cur.execute(get_sql(con, sql), (key, now))
+        MANAGER.local.changed.add(key)
+
+    write(operation)
+
+
+def delete_value(key):
+    """
+    Remove a key
+    """
+
+    def operation(con, cur):
         sql = "DELETE FROM config WHERE key = %s"
-        cur.execute(sql, (key,))
-        sql = "INSERT INTO config ( key, value ) VALUES (%s, %s)"
-        cur.execute(sql, (key, value))
-    con.commit()
+        cur.execute(get_sql(con, sql), (key,))
+        MANAGER.local.changed.add(key)
 
+    write(operation)
 
-def get_json_value(key, deflt=None):
+
+def get_expiry(ttl):
     """
-    Load a Json value for the specified key
+    Work out the expiry time for a time to live in seconds
     """
-    deflt = json.dumps(deflt)
-    jsonval = get_value(key, deflt=deflt)
-    if jsonval is None:
+    if ttl is None:
         return None
-    return json.loads(jsonval)
+    return time.time() + ttl
+
+
+def get_json_value(key, deflt=None):
+    """
+    Load a Json value for the specified key, decoded values are cached until
+    the key is next written.
+    """
+    cache = MANAGER.cache
+    # Uncommitted values written inside a batch must not be shared
+    cacheable = not getattr(MANAGER.local, "depth", 0)
+    if cacheable:
+        found, value, version = cache.get(key)
+        if found:
+            return copy_json(deflt if value is MISSING else value)
+    jsonval, expires_at = get_value_expiry(key, deflt=MISSING)
+    if jsonval is MISSING or jsonval is None:
+        value = jsonval
+    else:
+        value = json.loads(jsonval)
+    if cacheable:
+        cache.put(key, version, value, expires_at)
+    return copy_json(deflt if value is MISSING else value)
 
 
-def set_json_value(key, value):
+def copy_json(value):
+    """
+    Copy a decoded json value so callers may modify it
+    """
+    if isinstance(value, dict):
+        return {key: copy_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_json(item) for item in value]
+    return value
+
+
+def set_json_value(key, value, ttl=None):
     """
     Serialize and save a Json value
     """
-    set_value(key, json.dumps(value))
+    set_value(key, json.dumps(value), ttl=ttl)
+
+
+def is_postgres(con):
+    """
+    Check if the connection is to postgres rather than sqlite
+    """
+    return hasattr(con, "info")
+
+
+def get_sql(con, sql):
+    """
+    Convert the postgres parameter style to the sqlite style when required
+    """
+    if is_postgres(con):
+        return sql
+    return sql.replace("%s", "?")
+
+
+def get_id_column(con):
+    """
+    Auto incrementing primary key column definition
+    """
+    if is_postgres(con):
+        return "SERIAL PRIMARY KEY"
+    return "INTEGER PRIMARY KEY AUTOINCREMENT"
+
+
+@contextlib.contextmanager
+def get_transaction(con):
+    """
+    Commit on completion unless already within a batch on this thread
+    """
+    manager = MANAGER
+    local = manager.local
+    if getattr(local, "depth", 0):
+        local.depth += 1
+        try:
+            yield
+        finally:
+            local.depth -= 1
+        return
+    local.depth = 1
+    local.changed = set()
+    try:
+        with con:
+            yield
+    finally:
+        local.depth = 0
+        manager.cache.invalidate(local.changed)
+
+
+@contextlib.contextmanager
+def batch():
+    """
+    Group several writes into a single transaction
+    """
+    if not is_worker():
+        con = get_db()
+        with get_transaction(con):
+            yield
+        return
+    if getattr(WORKER, "pending", None) is not None:
+        yield
+        return
+    WORKER.pending = []
+    try:
+        yield
+        operations = WORKER.pending
+    finally:
+        WORKER.pending = None
+    if operations:
+        WRITER.submit(operations).result()
+
+
+@contextlib.contextmanager
+def get_cursor(con):
+    """
+    Cursor that is closed after use for both postgres and sqlite
+    """
+    cur = con.cursor()
+    try:
+        yield cur
+    finally:
+        cur.close()
 
 
 def check_table_exists(con, table_name):
     """
     Look in the database to see if table exists
     """
-    if hasattr(con, "info"):
-        # postgres
+    if is_postgres(con):
         sql = (
             "SELECT t.table_name FROM information_schema.tables t"
-            " WHERE t.table_schema='public' AND t.table_name=%s"
+            " WHERE t.table_schema=current_schema() AND t.table_name=%s"
         )
     else:
-        # sqlite
         sql = "SELECT name FROM sqlite_master WHERE type='table' AND name=?"
-    with con.cursor() as cur:
+    with get_cursor(con) as cur:
         cur.execute(sql, (table_name,))
         for _ in cur:
             return True
@@ -90,50 +541,443 @@ def check_table_exists(con, table_name):
 
 def get_db():
     """
-    Connect to the database
+    Obtain the database connection for the current thread
     """
-    try:
-        return psycopg2.connect(dbname="meticulous")
-    except psycopg2.OperationalError:
-        pass
-    if getattr(threading.local(), "worker", False):
-        raise Exception("Workers prevented from DB access")
-    dbpath = get_store_dir() / "sqlite.db"
-    return sqlite3.connect(str(dbpath))
+    return MANAGER.get()
+
+
+def get_db_stats():
+    """
+    Report connection reuse counts
+    """
+    return MANAGER.stats()
 
 
-def get_store_dir():
+def get_writer_stats():
     """
-    Locate the storage directory of this project
+    Report storage writer batching
     """
-    apppath = pathlib.Path.home() / ".meticulous"
-    if not apppath.is_dir():
-        apppath.mkdir()
-    return apppath
+    return WRITER.stats()
+
+
+def get_cache_stats():
+    """
+    Report json value cache hits and misses
+    """
+    return MANAGER.cache.stats()
+
+
+def clear_cache():
+    """
+    Forget every cached json value
+    """
+    MANAGER.cache.clear()
 
 
 def get_multi_repo(reponame):
     """
     Load multiple repository updates
     """
-    return [
-        item
-        for item in get_json_value(MULTI_SAVE_KEY, [])
-        if item["reponame"] == reponame
-    ]
+    con = get_db()
+    with get_cursor(con) as cur:
+        sql = f"SELECT save FROM {MULTI_SAVE_KEY} WHERE reponame = %s ORDER BY id"
+        cur.execute(get_sql(con, sql), (reponame,))
+        return [json.loads(save) for (save,) in cur]
 
 
 def set_multi_repo(reponame, value):
     """
     Save multiple repository updates
     """
-    save = value + [
-        item
-        for item in get_json_value(MULTI_SAVE_KEY, [])
-        if item["reponame"] != reponame
+
+    def operation(con, cur):
+        sql = f"DELETE FROM {MULTI_SAVE_KEY} WHERE reponame = %s"
+        cur.execute(get_sql(con, sql), (reponame,))
+        sql = f"INSERT INTO {MULTI_SAVE_KEY} ( reponame, save ) VALUES (%s, %s)"
+        cur.executemany(
+            get_sql(con, sql), [(reponame, json.dumps(item)) for item in value]
+        )
+
+    write(operation)
+
+
+def add_multi_repo(reponame, item):
+    """
+    Save a single additional repository update
+    """
+
+    def operation(con, cur):
+        sql = f"INSERT INTO {MULTI_SAVE_KEY} ( reponame, save ) VALUES (%s, %s)"
+        cur.execute(get_sql(con, sql), (reponame, json.dumps(item)))
+
+    write(operation)
+
+
+def remove_multi_repo(reponame):
+    """
+    Discard all updates for a repository
+    """
+    set_multi_repo(reponame, [])
+
+
+def is_repository_forked(name):
+    """
+    Check if a repository name has already been forked or rejected
+    """
+    con = get_db()
+    with get_cursor(con) as cur:
+        sql = "SELECT name FROM repository_forked WHERE name = %s"
+        cur.execute(get_sql(con, sql), (name,))
+        return cur.fetchone() is not None
+
+
+def add_repository_forked(names):
+    """
+    Record repository names as forked or rejected
+    """
+
+    def operation(con, cur):
+        sql = (
+            "INSERT INTO repository_forked ( name ) VALUES (%s)"
+            " ON CONFLICT ( name ) DO NOTHING"
+        )
+        cur.executemany(get_sql(con, sql), [(name,) for name in set(names)])
+
+    write(operation)
+
+
+def get_repository_map():
+    """
+    Load the lookup of repository names to checkout directories
+    """
+    con = get_db()
+    with get_cursor(con) as cur:
+        cur.execute("SELECT reponame, repodir FROM repository_map ORDER BY reponame")
+        return dict(cur.fetchall())
+
+
+def get_repository_dir(reponame):
+    """
+    Locate the checkout directory of a repository if it is available
+    """
+    con = get_db()
+    with get_cursor(con) as cur:
+        sql = "SELECT repodir FROM repository_map WHERE reponame = %s"
+        cur.execute(get_sql(con, sql), (reponame,))
+        for (repodir,) in cur:
+            return repodir
+        return None
+
+
+def set_repository_dir(reponame, repodir):
+    """
+    Record the checkout directory of a repository
+    """
+
+    def operation(con, cur):
+        sql = (
+            "INSERT INTO repository_map ( reponame, repodir ) VALUES (%s, %s)"
+            " ON CONFLICT ( reponame ) DO UPDATE SET repodir = excluded.repodir"
+        )
+        cur.execute(get_sql(con, sql), (reponame, repodir))
+
+    write(operation)
+
+
+def remove_repository_dir(reponame):
+    """
+    Forget the checkout directory of a repository
+    """
+
+    def operation(con, cur):
+        sql = "DELETE FROM repository_map WHERE reponame = %s"
+        cur.execute(get_sql(con, sql), (reponame,))
+
+    write(operation)
+
+
+def has_user_repository(name):
+    """
+    Check the index for a repository of the authenticated user by name
+    """
+    con = get_db()
+    with get_cursor(con) as cur:
+        sql = "SELECT name FROM user_repositories WHERE name = %s"
+        cur.execute(get_sql(con, sql), (name,))
+        return cur.fetchone() is not None
+
+
+def get_user_repository_latest():
+    """
+    Obtain the creation time of the newest indexed user repository
+    """
+    con = get_db()
+    with get_cursor(con) as cur:
+        cur.execute("SELECT MAX(created_at) FROM user_repositories")
+        return cur.fetchone()[0]
+
+
+def add_user_repositories(rows, replace=False):
+    """
+    Index user repositories from name and creation time rows, a missing
+    creation time keeps any known one, replace drops the existing index
+    """
+
+    def operation(con, cur):
+        if replace:
+            cur.execute("DELETE FROM user_repositories")
+        sql = (
+            "INSERT INTO user_repositories ( name, created_at ) VALUES (%s, %s)"
+            " ON CONFLICT ( name ) DO UPDATE SET created_at ="
+            " COALESCE(excluded.created_at, user_repositories.created_at)"
+        )
+        cur.executemany(get_sql(con, sql), rows)
+
+    write(operation)
+
+
+def get_pending_forks():
+    """
+    Obtain the forks not yet ready to clone by repository name
+    """
+    con = get_db()
+    with get_cursor(con) as cur:
+        cur.execute("SELECT reponame, orgrepo, forked_at FROM pending_forks")
+        return {
+            reponame: {"orgrepo": orgrepo, "forked_at": forked_at}
+            for reponame, orgrepo, forked_at in cur.fetchall()
+        }
+
+
+def add_pending_fork(reponame, orgrepo):
+    """
+    Record a fork that has been requested
+    """
+    forked_at = time.time()
+
+    def operation(con, cur):
+        sql = (
+            "INSERT INTO pending_forks ( reponame, orgrepo, forked_at )"
+            " VALUES (%s, %s, %s) ON CONFLICT ( reponame ) DO UPDATE SET"
+            " orgrepo = excluded.orgrepo, forked_at = excluded.forked_at"
+        )
+        cur.execute(get_sql(con, sql), (reponame, orgrepo, forked_at))
+
+    write(operation)
+
+
+def remove_pending_fork(reponame):
+    """
+    Forget a fork once it is ready or abandoned
+    """
+
+    def operation(con, cur):
+        sql = "DELETE FROM pending_forks WHERE reponame = %s"
+        cur.execute(get_sql(con, sql), (reponame,))
+
+    write(operation)
+
+
+def add_candidates(orgrepos):
+    """
+    Merge repositories into the end of the candidate queue ignoring any
+    already queued
+    """
+    orgrepos = list(dict.fromkeys(orgrepos))
+
+    def operation(con, cur):
+        cur.execute("SELECT COALESCE(MAX(position), -1) FROM candidates")
+        start = cur.fetchone()[0] + 1
+        sql = (
+            "INSERT INTO candidates ( orgrepo, position, status )"
+            " VALUES (%s, %s, %s) ON CONFLICT ( orgrepo ) DO NOTHING"
+        )
+        rows = [
+            (orgrepo, start + index, CANDIDATE_PENDING)
+            for index, orgrepo in enumerate(orgrepos)
+        ]
+        cur.executemany(get_sql(con, sql), rows)
+
+    write(operation)
+
+
+def get_pending_candidates(count):
+    """
+    Obtain the next pending candidates in queue order
+    """
+    con = get_db()
+    with get_cursor(con) as cur:
+        sql = (
+            "SELECT orgrepo FROM candidates WHERE status = %s"
+            " ORDER BY position LIMIT %s"
+        )
+        cur.execute(get_sql(con, sql), (CANDIDATE_PENDING, count))
+        return [orgrepo for (orgrepo,) in cur.fetchall()]
+
+
+def set_candidate_status(statuses):
+    """
+    Record the status of candidates from a mapping of repository to status
+    """
+
+    def operation(con, cur):
+        sql = "UPDATE candidates SET status = %s WHERE orgrepo = %s"
+        rows = [(status, orgrepo) for orgrepo, status in statuses.items()]
+        cur.executemany(get_sql(con, sql), rows)
+
+    write(operation)
+
+
+def reset_ready_candidates():
+    """
+    Return candidates vetted by a previous run to pending so they are vetted
+    again with current information
+    """
+
+    def operation(con, cur):
+        sql = "UPDATE candidates SET status = %s WHERE status = %s"
+        cur.execute(get_sql(con, sql), (CANDIDATE_PENDING, CANDIDATE_READY))
+
+    write(operation)
+
+
+def get_candidate_counts():
+    """
+    Count the candidates by status
+    """
+    con = get_db()
+    with get_cursor(con) as cur:
+        cur.execute("SELECT status, COUNT(*) FROM candidates GROUP BY status")
+        return dict(cur.fetchall())
+
+
+def get_spelling_findings(dictionary, task, blobs):
+    """
+    Load the cached spelling findings of a spelling task for the blobs
+    checked with the dictionary
+    """
+    blobs = sorted(set(blobs))
+    result = {}
+    con = get_db()
+    with get_cursor(con) as cur:
+        for offset in range(0, len(blobs), MAX_QUERY_PARAMS):
+            end = offset + MAX_QUERY_PARAMS
+            chunk = blobs[offset:end]
+            params = ", ".join(["%s"] * len(chunk))
+            sql = (
+                "SELECT blob, findings FROM spelling_blobs"
+                f" WHERE dictionary = %s AND task = %s AND blob IN ({params})"
+            )
+            cur.execute(get_sql(con, sql), [dictionary, task] + chunk)
+            for blob, findings in cur:
+                result[blob] = json.loads(findings)
+    return result
+
+
+def add_spelling_findings(dictionary, task, findings):
+    """
+    Cache the spelling findings of a spelling task from a mapping of blob to
+    the misspelt words and their categories
+    """
+    rows = [
+        (blob, dictionary, task, json.dumps(value)) for blob, value in findings.items()
     ]
-    set_json_value(MULTI_SAVE_KEY, save)
+
+    def operation(con, cur):
+        sql = (
+            "INSERT INTO spelling_blobs ( blob, dictionary, task, findings )"
+            " VALUES (%s, %s, %s, %s) ON CONFLICT ( blob, dictionary, task )"
+            " DO UPDATE SET findings = excluded.findings"
+        )
+        cur.executemany(get_sql(con, sql), rows)
+
+    write(operation)
+
+
+def get_suggestions(words):
+    """
+    Load the saved suggestion payloads for a collection of words
+    """
+    words = sorted(set(words))
+    result = {}
+    con = get_db()
+    with get_cursor(con) as cur:
+        for offset in range(0, len(words), MAX_QUERY_PARAMS):
+            end = offset + MAX_QUERY_PARAMS
+            chunk = words[offset:end]
+            params = ", ".join(["%s"] * len(chunk))
+            sql = (
+                f"SELECT word, payload FROM suggestions WHERE word IN ({params})"
+                " AND ( expires_at IS NULL OR expires_at > %s )"
+            )
+            cur.execute(get_sql(con, sql), chunk + [time.time()])
+            for word, payload in cur:
+                result[word] = json.loads(payload)
+    return result
+
+
+def set_suggestion(word, payload, source, ttl=None):
+    """
+    Save the suggestion payload for a word, expiring after ttl seconds if
+    provided
+    """
+    fetched_at = time.time()
+    expires_at = get_expiry(ttl)
+
+    def operation(con, cur):
+        sql = (
+            "INSERT INTO suggestions"
+            " ( word, payload, fetched_at, source, expires_at )"
+            " VALUES (%s, %s, %s, %s, %s) ON CONFLICT ( word ) DO UPDATE SET"
+            " payload = excluded.payload, fetched_at = excluded.fetched_at,"
+            " source = excluded.source, expires_at = excluded.expires_at"
+        )
+        cur.execute(
+            get_sql(con, sql),
+            (word, json.dumps(payload), fetched_at, source, expires_at),
+        )
+
+    write(operation)
+
+
+def compact():
+    """
+    Remove expired values and reclaim the space they used
+    """
+    now = time.time()
+
+    def operation(con, cur):
+        for table in ("config", "suggestions"):
+            sql = f"DELETE FROM {table} WHERE expires_at <= %s"
+            cur.execute(get_sql(con, sql), (now,))
+
+    write(operation)
+    MANAGER.cache.clear()
+    con = get_db()
+    with get_cursor(con) as cur:
+        cur.execute("VACUUM")
+        if not is_postgres(con):
+            cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def start_compaction(interval=COMPACT_INTERVAL):
+    """
+    Periodically compact the database in a background thread
+    """
+
+    def run():
+        while True:
+            try:
+                compact()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to compact storage")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="storagecompaction", daemon=True)
+    thread.start()
+    return thread
 
 
 if __name__ == "__main__":
     prepare()
+    print(get_db_stats())
@@ -0,0 +1,115 @@
+"""
+Single writer thread that batches queued storage writes
+"""
+
+import concurrent.futures
+import logging
+import queue
+import threading
+
+MAX_WRITE_BATCH = 100
+
+
+class StorageWriter:
+    """
+    Single thread that applies writes queued by pool workers, writes queued
+    together are committed in one transaction so workers never contend for
+    the database write lock.
+    """
+
+    def __init__(self, execute, max_batch=MAX_WRITE_BATCH):
+        self.execute = execute
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.counts = {"batches": 0, "operations": 0}
+
+    def submit(self, operations):
+        """
+        Queue a unit of write operations returning a future for its completion
+        """
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="storagewriter", daemon=True
+                )
+                self.thread.start()
+            self.queue.put((operations, future))
+        return future
+
+    def run(self):
+        """
+        Apply queued writes until stopped. If the thread fails, the writes it
+        holds or has queued report the error and the next write starts a new
+        thread.
+        """
+        units = []
+        try:
+            while True:
+                units = [self.queue.get()]
+                while len(units) < self.max_batch:
+                    try:
+                        units.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = any(unit is None for unit in units)
+                self.apply([unit for unit in units if unit is not None])
+                units = []
+                if stop:
+                    return
+        except BaseException as exc:  # pylint: disable=broad-except
+            logging.exception("Storage writer stopped")
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+                while True:
+                    try:
+                        units.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+            for unit in units:
+                if unit is not None and not unit[1].done():
+                    unit[1].set_exception(exc)
+
+    def apply(self, units):
+        """
+        Commit units together, on failure retry each alone so that only the
+        failing unit reports an error
+        """
+        if not units:
+            return
+        operations = [operation for unit, _ in units for operation in unit]
+        try:
+            self.execute(operations)
+        except Exception as exc:  # pylint: disable=broad-except
+            if len(units) > 1:
+                for unit in units:
+                    self.apply([unit])
+                return
+            units[0][1].set_exception(exc)
+            return
+        with self.lock:
+            self.counts["batches"] += 1
+            self.counts["operations"] += len(operations)
+        for _, future in units:
+            future.set_result(None)
+
+    def stop(self):
+        """
+        Finish any queued writes and stop the writer thread
+        """
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+    def stats(self):
+        """
+        Report how many write operations were applied in how many batches
+        """
+        with self.lock:
+            return dict(self.counts)
@@ -15,9 +15,10 @@ from plumbum import FG, ProcessExecutionError, local
 
 from meticulous._constants import ALWAYS_ISSUE_AND_BRANCH, ALWAYS_PLAIN_PR
 from meticulous._exceptions import ProcessingFailed
-from meticulous._github import create_pr, get_api, get_parent_repo
+from meticulous._github import create_pr, get_login, get_parent_repo, github_call
 from meticulous._input import UserCancel, make_choice, make_simple_choice
 from meticulous._processrepo import add_repo_save
+from meticulous._ratelimit import PRIORITY_SUBMIT, prioritise
 from meticulous._storage import get_multi_repo
 from meticulous._summary import display_and_check_files
 from meticulous._util import get_editor
@@ -40,8 +41,7 @@ def get_note(kind, pr_url=None):
     )
     if kind != "issue" or pr_url is None:
         return header
-    api = get_api()
-    user_org = api.get_user().login
+    user_org = get_login()
     return f"""\
 {header}
 
@@ -239,8 +239,7 @@ def issue_and_branch_for(reponame, repository_saves_multi):
     _, _, from_branch, to_branch = non_interactive_prepare_commit_multi(
         repository_saves_multi
     )
-    api = get_api()
-    user_org = api.get_user().login
+    user_org = get_login()
     pr_url = f"https://github.com/{user_org}/{reponame}/pull/new/{from_branch}"
     make_issue_multi(reponame, repository_saves_multi, True, pr_url=pr_url)
     submit_issue_multi(reponame, repository_saves_multi, None)
@@ -522,8 +521,9 @@ def issue_via_api(reponame, title, body):
     """
     Create an issue via the API
     """
-    repo = get_parent_repo(reponame)
-    issue = repo.create_issue(title=title, body=body)
+    with prioritise(PRIORITY_SUBMIT):
+        repo = get_parent_repo(reponame)
+        issue = github_call(repo.create_issue, title=title, body=body)
     return issue.number
 
 
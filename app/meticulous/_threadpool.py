@@ -8,6 +8,7 @@ import logging
 import threading
 
 from meticulous._progress import add_progress, clear_progress
+from meticulous._storage import mark_worker
 
 Context = collections.namedtuple("Context", ["taskjson", "controller"])
 
@@ -41,7 +42,7 @@ class PoolManager:
         """
         Called by a thread in the pool to run the task
         """
-        threading.local().worker = True
+        mark_worker()
         try:
             if self._draining:
                 self._saved.append(taskjson)
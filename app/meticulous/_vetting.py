@@ -0,0 +1,211 @@
+"""
+Vet candidate repositories in the background ahead of forking
+"""
+
+import collections
+import concurrent.futures
+import dataclasses
+import logging
+import threading
+
+from meticulous._github import GRAPHQL_BATCH, refresh_fork_index, resolve_repos
+from meticulous._sources import download_missing_sources, is_blacklisted
+from meticulous._storage import (
+    CANDIDATE_ARCHIVED,
+    CANDIDATE_FORKED,
+    CANDIDATE_READY,
+    CANDIDATE_REJECTED,
+    add_repository_forked,
+    batch,
+    get_pending_candidates,
+    has_user_repository,
+    is_repository_forked,
+    reset_ready_candidates,
+    set_candidate_status,
+)
+
+VET_BUFFER = 10
+VET_CONCURRENCY = 2
+VET_IDLE_WAIT = 60
+VET_RETRY_WAIT = 30
+
+Candidate = collections.namedtuple(
+    "Candidate", ["source", "orgrepo", "origrepo", "repo"]
+)
+
+
+def vet_candidates(sources):
+    """
+    Resolve a batch of candidates returning those ready to fork and the
+    status of each candidate
+    """
+    statuses = {
+        source: CANDIDATE_REJECTED for source in sources if is_blacklisted(source)
+    }
+    ready = []
+    resolved = resolve_repos(source for source in sources if source not in statuses)
+    refresh_fork_index()
+    for source, metadata in resolved.items():
+        _, origrepo = source.split("/", 1)
+        if metadata is None:
+            statuses[source] = CANDIDATE_REJECTED
+            continue
+        orgrepo = metadata["full_name"]
+        _, repo = orgrepo.split("/", 1)
+        if is_repository_forked(origrepo) or is_repository_forked(repo):
+            statuses[source] = CANDIDATE_FORKED
+            continue
+        names = {origrepo, repo}
+        names.update(
+            parent["full_name"].split("/", 1)[-1] for parent in metadata["parents"]
+        )
+        if metadata["forked"] or any(has_user_repository(name) for name in names):
+            print(f"Already forked (github) {orgrepo}")
+            add_repository_forked([origrepo, repo])
+            statuses[source] = CANDIDATE_FORKED
+            continue
+        if metadata["archived"]:
+            print(f"Skip archived fork (github) {orgrepo}")
+            add_repository_forked([origrepo, repo])
+            statuses[source] = CANDIDATE_ARCHIVED
+            continue
+        ready.append(Candidate(source, orgrepo, origrepo, repo))
+        statuses[source] = CANDIDATE_READY
+    return ready, statuses
+
+
+@dataclasses.dataclass
+class VetterState:
+    """
+    Whether pending candidates ran out, the vetter was asked to stop or the
+    last fill failed
+    """
+
+    exhausted: bool = False
+    stopped: bool = False
+    error: Exception = None
+
+
+class CandidateVetter:
+    """
+    Keep a buffer of candidates ready to fork, filled by a background thread
+    resolving pending candidates in concurrent batches so taking one never
+    waits on the network while the buffer holds any.
+    """
+
+    def __init__(self, size=VET_BUFFER, concurrency=VET_CONCURRENCY):
+        self.size = size
+        self.concurrency = concurrency
+        self.cond = threading.Condition()
+        self.ready = collections.deque()
+        self.state = VetterState()
+        self.thread = None
+
+    def start(self):
+        """
+        Start the background thread if not already running
+        """
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="candidatevetter", daemon=True
+                )
+                self.thread.start()
+
+    def stop(self):
+        """
+        Signal the background thread to finish
+        """
+        with self.cond:
+            self.state.stopped = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def take(self):
+        """
+        Pop the next candidate ready to fork, waiting while the buffer is
+        filled and returning None once no candidates remain, raising the
+        error of the last fill if it failed with the buffer empty
+        """
+        self.start()
+        with self.cond:
+            while not self.ready and not self.state.exhausted:
+                if self.state.error is not None:
+                    raise self.state.error
+                self.cond.wait()
+            if not self.ready:
+                return None
+            candidate = self.ready.popleft()
+            self.cond.notify_all()
+            return candidate
+
+    def run(self):
+        """
+        Refill the buffer whenever it falls below its size
+        """
+        reset_ready_candidates()
+        while True:
+            with self.cond:
+                while len(self.ready) >= self.size and not self.state.stopped:
+                    self.cond.wait()
+                if self.state.stopped:
+                    return
+            wait = None
+            try:
+                if not self.fill():
+                    wait = VET_IDLE_WAIT
+            except Exception as error:  # pylint: disable=broad-except
+                logging.exception("Failed to vet candidates")
+                with self.cond:
+                    self.state.error = error
+                    self.cond.notify_all()
+                wait = VET_RETRY_WAIT
+            if wait is not None:
+                with self.cond:
+                    self.cond.wait(timeout=wait)
+
+    def fill(self):
+        """
+        Vet the next pending candidates with bounded concurrent lookups,
+        returning False if none were pending
+        """
+        download_missing_sources()
+        sources = get_pending_candidates(GRAPHQL_BATCH * self.concurrency)
+        if not sources:
+            with self.cond:
+                self.state.exhausted = True
+                self.state.error = None
+                self.cond.notify_all()
+            return False
+        chunks = []
+        for offset in range(0, len(sources), GRAPHQL_BATCH):
+            end = offset + GRAPHQL_BATCH
+            chunks.append(sources[offset:end])
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency
+        ) as executor:
+            results = list(executor.map(vet_candidates, chunks))
+        ready = []
+        statuses = {}
+        with self.cond:
+            repos = {candidate.repo for candidate in self.ready}
+        for chunk_ready, chunk_statuses in results:
+            statuses.update(chunk_statuses)
+            for candidate in chunk_ready:
+                if candidate.repo in repos:
+                    statuses[candidate.source] = CANDIDATE_FORKED
+                    continue
+                repos.add(candidate.repo)
+                ready.append(candidate)
+        with batch():
+            set_candidate_status(statuses)
+        with self.cond:
+            self.ready.extend(ready)
+            self.state.exhausted = False
+            self.state.error = None
+            self.cond.notify_all()
+        return True
+
+
+VETTER = CandidateVetter()
@@ -12,7 +12,7 @@ from urllib.parse import quote, unquote
 import requests
 from bs4 import BeautifulSoup
 
-from meticulous._storage import get_json_value, set_json_value
+from meticulous._storage import get_suggestions, set_suggestion
 from meticulous._suggestion import Suggestion
 from meticulous._suggestion import get_suggestion as codespell
 
@@ -28,6 +28,7 @@ DICTIONARIES = [
     "https://www.thesaurus.com/browse/",
     "https://www.yourdictionary.com/",
 ]
+NO_SUGGESTION_TTL = 30 * 24 * 60 * 60
 MISSPELLINGS = [
     "https://www.spellchecker.net/misspellings/",
     "https://www.spellcheck.net/misspelled-words/",
@@ -63,16 +64,18 @@ class GoogleLock:
             self.update = datetime.datetime.now()
 
 
-def get_suggestion(word):
+def get_suggestion(word, saved=None):
     """
     Use the internet to determine if the provided word is a nonword or a typo
-    if a suggestion is not found in codespell
+    if a suggestion is not found in codespell, saved suggestions may be
+    provided from an earlier bulk lookup.
     """
     suggestion = codespell(word)
     if suggestion is not None:
         return suggestion
-    key = f"suggestion.{word}"
-    existing = get_json_value(key)
+    if saved is None:
+        saved = get_suggestions([word])
+    existing = saved.get(word)
     if existing is not None:
         if existing.get("no_suggestion"):
             return None
@@ -80,9 +83,11 @@ def get_suggestion(word):
     suggestion = search_suggestion(word)
     suggestion = validate_suggestion(suggestion, word)
     if suggestion is None:
-        set_json_value(key, {"no_suggestion": True})
+        set_suggestion(
+            word, {"no_suggestion": True}, "websearch", ttl=NO_SUGGESTION_TTL
+        )
         return None
-    set_json_value(key, suggestion.save())
+    set_suggestion(word, suggestion.save(), "websearch")
     return suggestion
 
 
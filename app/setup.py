@@ -64,7 +64,7 @@ setup(
     .strip(),
     long_description=load_include("README.md", transform=True),
     long_description_content_type="text/markdown",
-    python_requires=">=3.6",
+    python_requires=">=3.8",
     test_suite="tests",
     test_requires=[
         elem.strip()
@@ -83,9 +83,8 @@ setup(
             "Development Status :: 4 - Beta",
             "Programming Language :: Python",
             "Programming Language :: Python :: 3",
-            "Programming Language :: Python :: 3.6",
-            "Programming Language :: Python :: 3.7",
             "Programming Language :: Python :: 3.8",
+            "Programming Language :: Python :: 3.9",
             "Programming Language :: Python :: Implementation :: CPython",
             "Programming Language :: Python :: Implementation :: PyPy",
             "Operating System :: OS Independent",
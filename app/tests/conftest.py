@@ -0,0 +1,22 @@
+"""
+Shared test fixtures
+"""
+
+from unittest import mock
+
+import pytest
+
+from meticulous import _storage
+
+
+@pytest.fixture(name="manager")
+def fixture_manager(tmp_path):
+    """
+    Use a temporary sqlite database in place of the real store
+    """
+    path = tmp_path / "sqlite.db"
+    manager = _storage.ConnectionManager(dsn=None, sqlite_path=path)
+    with mock.patch("meticulous._storage.MANAGER", manager):
+        _storage.prepare()
+        yield manager
+    manager.close()
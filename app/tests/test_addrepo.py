@@ -0,0 +1,142 @@
+"""
+Test adding repositories
+"""
+
+import threading
+from unittest import mock
+
+import pytest
+from github import GithubException
+
+from meticulous import _addrepo, _storage, _vetting
+
+
+class FakeController:  # pylint: disable=too-few-public-methods
+    """
+    Collect the tasks added by a handler
+    """
+
+    def __init__(self):
+        self.tasks = []
+        self.added = threading.Event()
+
+    def add(self, task):
+        """
+        Record a task
+        """
+        self.tasks.append(task)
+        self.added.set()
+
+
+@mock.patch("meticulous._addrepo.FORK_WAIT_DELAY", 0.01)
+@mock.patch("meticulous._addrepo.is_fork_ready")
+def test_fork_wait(ready_mock, manager):  # pylint: disable=unused-argument
+    """
+    Ensure a pending fork is polled again later and only handed to checkout
+    once ready
+    """
+    # Setup
+    ready_mock.side_effect = [False, True]
+    _storage.add_pending_fork("repo", "org/repo")
+    controller = FakeController()
+    task = {"name": "repository_fork_wait", "interactive": False, "reponame": "repo"}
+    # Exercise
+    _addrepo.repository_fork_wait(mock.Mock(controller=controller, taskjson=task))()
+    controller.added.wait(timeout=5)
+    retry = controller.tasks.pop()
+    pending = _storage.get_pending_forks()
+    _addrepo.repository_fork_wait(mock.Mock(controller=controller, taskjson=retry))()
+    # Verify
+    assert retry == dict(task, attempt=1)  # noqa=S101 # nosec
+    assert list(pending) == ["repo"]  # noqa=S101 # nosec
+    assert controller.tasks == [  # noqa=S101 # nosec
+        {"name": "repository_checkout", "interactive": False, "reponame": "repo"}
+    ]
+    assert _storage.get_pending_forks() == {}  # noqa=S101 # nosec
+
+
+def test_fork_wait_delay():
+    """
+    Ensure polling backs off up to the maximum delay
+    """
+    # Exercise
+    delays = [_addrepo.get_fork_wait_delay(attempt) for attempt in range(7)]
+    # Verify
+    assert delays == [2, 4, 8, 16, 32, 60, 60]  # noqa=S101 # nosec
+
+
+@mock.patch("meticulous._addrepo.fork")
+@mock.patch("meticulous._addrepo.VETTER")
+def test_fork_failure(
+    vetter_mock, fork_mock, manager
+):  # pylint: disable=unused-argument
+    """
+    Ensure a failed fork rejects the candidate and queues another load
+    """
+    # Setup
+    _storage.add_candidates(["org/repo"])
+    vetter_mock.take.return_value = _vetting.Candidate(
+        "org/repo", "org/repo", "repo", "repo"
+    )
+    fork_mock.side_effect = GithubException(403, "Forbidden", None)
+    controller = FakeController()
+    task = {"name": "repository_load", "interactive": False, "priority": 5}
+    # Exercise
+    _addrepo.repository_load(mock.Mock(controller=controller, taskjson=task))()
+    # Verify
+    assert controller.tasks == [task]  # noqa=S101 # nosec
+    assert _storage.get_candidate_counts() == {"rejected": 1}  # noqa=S101 # nosec
+    assert _storage.is_repository_forked("repo")  # noqa=S101 # nosec
+    assert _storage.get_pending_forks() == {}  # noqa=S101 # nosec
+
+
+@mock.patch("meticulous._vetting.reset_ready_candidates")
+@mock.patch("meticulous._vetting.download_missing_sources")
+def test_vetter_fill_failure(
+    download_mock, reset_mock
+):  # pylint: disable=unused-argument
+    """
+    Ensure taking a candidate raises the error of a failed fill rather than
+    waiting for the buffer forever
+    """
+    # Setup
+    download_mock.side_effect = RuntimeError("offline")
+    vetter = _vetting.CandidateVetter()
+    # Exercise
+    with pytest.raises(RuntimeError, match="offline"):
+        vetter.take()
+    vetter.stop()
+    # Verify
+    assert str(vetter.state.error) == "offline"  # noqa=S101 # nosec
+
+
+@mock.patch("meticulous._vetting.refresh_fork_index")
+@mock.patch("meticulous._vetting.resolve_repos")
+def test_vet_indexed_fork(
+    resolve_mock, refresh_mock, manager
+):  # pylint: disable=unused-argument
+    """
+    Ensure a candidate is skipped when the index of the user's repositories
+    holds the name of one of its ancestors
+    """
+    # Setup
+    _storage.add_user_repositories([("lib", "2020-01-01T00:00:00")])
+    metadata = {
+        "full_name": "org/repo",
+        "archived": False,
+        "forked": False,
+        "parents": [{"full_name": "upstream/lib", "has_issues": True}],
+    }
+    resolve_mock.return_value = {
+        "org/repo": metadata,
+        "org/other": dict(metadata, full_name="org/other", parents=[]),
+    }
+    # Exercise
+    ready, statuses = _vetting.vet_candidates(["org/repo", "org/other"])
+    # Verify
+    assert refresh_mock.call_count == 1  # noqa=S101 # nosec
+    assert [candidate.repo for candidate in ready] == ["other"]  # noqa=S101 # nosec
+    assert statuses == {  # noqa=S101 # nosec
+        "org/repo": _storage.CANDIDATE_FORKED,
+        "org/other": _storage.CANDIDATE_READY,
+    }
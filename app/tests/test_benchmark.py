@@ -0,0 +1,57 @@
+"""
+Test the storage benchmark suite
+"""
+
+from unittest import mock
+
+from meticulous import _benchmark
+from meticulous._benchmark import bench_sqlite
+from meticulous._storage import get_json_value
+
+
+def test_bench_sqlite():
+    """
+    Ensure each storage call is timed for each size
+    """
+    # Setup
+    sizes = [100, 200]
+    # Exercise
+    results = bench_sqlite(sizes)
+    # Verify
+    assert {  # noqa=S101 # nosec
+        (result["size"], result["operation"]) for result in results
+    } == {
+        (size, operation)
+        for size in sizes
+        for operation in (
+            "get_value",
+            "set_value",
+            "get_json_value",
+            "get_json_value_cached",
+            "get_multi_repo",
+        )
+    }
+    assert all(result["ops_per_second"] > 0 for result in results)  # noqa=S101 # nosec
+
+
+def test_cold_json_lookups(manager):
+    """
+    Ensure the uncached json measurement never hits the cache
+    """
+    # Setup
+    hits = []
+    original = _benchmark.time_operations
+
+    def record(operation, args):
+        before = manager.cache.stats()["hits"]
+        result = original(operation, args)
+        hits.append((operation, manager.cache.stats()["hits"] - before))
+        return result
+
+    # Exercise
+    with mock.patch("meticulous._benchmark.time_operations", record):
+        _benchmark.bench_size(500, operations=1000)
+    # Verify
+    json_hits = [count for operation, count in hits if operation is get_json_value]
+    assert json_hits[0] == 0  # noqa=S101 # nosec
+    assert json_hits[1] == 1000  # noqa=S101 # nosec
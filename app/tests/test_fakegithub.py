@@ -0,0 +1,278 @@
+"""
+Test the offline GitHub stand in through the real API client
+"""
+
+import os
+import tempfile
+from unittest import mock
+
+import pytest
+from plumbum import local
+
+from meticulous import (
+    _addrepo,
+    _fakegithub,
+    _github,
+    _nonword,
+    _ratelimit,
+    _reference,
+    _sources,
+    _storage,
+    _submit,
+    _vetting,
+)
+
+
+@pytest.fixture(name="fake_github")
+def fixture_fake_github(manager):  # pylint: disable=unused-argument
+    """
+    Serve sample repositories selected through the environment with a fresh
+    API client
+    """
+    state = _fakegithub.FakeGithub(
+        tempfile.mkdtemp(), _fakegithub.FakeOptions(fork_delay=60)
+    )
+    state.seed(3)
+    server = _fakegithub.start_server(state)
+    environ = _fakegithub.get_environment(state)
+    with mock.patch.dict(os.environ, environ), mock.patch(
+        "meticulous._github.CLIENT", _github.GithubClient()
+    ), mock.patch("meticulous._github.SCHEDULER", _ratelimit.RateLimitScheduler()):
+        yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_pipeline(fake_github):
+    """
+    Ensure a candidate can be vetted, forked, cloned, pushed and submitted
+    without reaching GitHub
+    """
+    # Setup
+    target = local.path(tempfile.mkdtemp())
+    git = local["git"]
+    # Exercise
+    sources = list(_sources.obtain_sources())
+    resolved = _github.resolve_repos(sources)
+    _github.fork("fakeorg/project0")
+    pending = _github.is_fork_ready("project0")
+    fake_github.records.repos["fakeuser/project0"]["ready_at"] = 0
+    ready = _github.is_fork_ready("project0")
+    _github.checkout("project0", target)
+    repodir = target / "project0"
+    with local.cwd(repodir):
+        git("checkout", "-q", "-b", "typos")
+        (repodir / "README.md").write("Fixed\n")
+        git(
+            "-c",
+            "user.name=test",
+            "-c",
+            "user.email=test@localhost",
+            "commit",
+            "-q",
+            "-am",
+            "Fix typos",
+        )
+        git("push", "-q", "origin", "typos")
+    pullreq = _github.create_pr("project0", "Fix typos", "Body", "typos", "main")
+    issue = _submit.issue_via_api("project0", "Typos", "Body")
+    # Verify
+    assert sources == [  # noqa=S101 # nosec
+        "demoorg/project2",
+        "fakeorg/project0",
+        "sampleorg/project1",
+    ]
+    assert not any(meta["forked"] for meta in resolved.values())  # noqa=S101 # nosec
+    assert not pending  # noqa=S101 # nosec
+    assert ready  # noqa=S101 # nosec
+    assert _github.check_forked("fakeorg/project0")  # noqa=S101 # nosec
+    assert pullreq.number == 1  # noqa=S101 # nosec
+    assert issue == 2  # noqa=S101 # nosec
+    assert fake_github.records.pulls[0]["head"] == "fakeuser:typos"  # noqa=S101 # nosec
+    assert (  # noqa=S101 # nosec
+        fake_github.records.issues[0]["repository"] == "fakeorg/project0"
+    )
+    stats = _github.SCHEDULER.stats()
+    assert 0 < stats["remaining"] < _fakegithub.FAKE_RATE_LIMIT  # noqa=S101 # nosec
+
+
+def test_rate_limit():
+    """
+    Ensure requests beyond the rate limit are refused with its headers and
+    the rate limit is reported without counting against it
+    """
+    # Setup
+    state = _fakegithub.FakeGithub(tempfile.mkdtemp(), _fakegithub.FakeOptions(limit=1))
+    # Exercise
+    first = state.handle("GET", "/user", {}, None)
+    second = state.handle("GET", "/user", {}, None)
+    status, limits, _ = state.handle("GET", "/rate_limit", {}, None)
+    # Verify
+    assert first[0] == 200  # noqa=S101 # nosec
+    assert second[0] == 403  # noqa=S101 # nosec
+    assert second[2]["X-RateLimit-Remaining"] == "0"  # noqa=S101 # nosec
+    assert status == 200  # noqa=S101 # nosec
+    assert limits["rate"] == {  # noqa=S101 # nosec
+        "limit": 1,
+        "remaining": 0,
+        "reset": state.quota.reset,
+        "used": 1,
+    }
+    assert limits["resources"]["graphql"]["remaining"] == 1  # noqa=S101 # nosec
+
+
+def test_pickrepo(fake_github):
+    """
+    Ensure candidates are vetted together in the background and taken in
+    order, skipping those already forked
+    """
+    # Setup
+    fake_github.add_repo("fakeuser/project2", parent="demoorg/project2")
+    vetter = _vetting.CandidateVetter()
+    # Exercise
+    with mock.patch("meticulous._addrepo.VETTER", vetter):
+        first = _addrepo.non_interactive_pickrepo()
+        second = _addrepo.non_interactive_pickrepo()
+        third = _addrepo.non_interactive_pickrepo()
+    vetter.stop()
+    # Verify
+    assert [first, second, third] == ["project0", "project1", None]  # noqa=S101 # nosec
+    assert fake_github.quota.served["graphql"] == 1  # noqa=S101 # nosec
+    assert fake_github.quota.served["create_fork"] == 2  # noqa=S101 # nosec
+    assert _storage.get_candidate_counts() == {"forked": 3}  # noqa=S101 # nosec
+    assert sorted(_storage.get_pending_forks()) == [  # noqa=S101 # nosec
+        "project0",
+        "project1",
+    ]
+
+
+@pytest.mark.parametrize(
+    "clone_filter, fetched",
+    [("blob:none", False), ("blob:limit=1k", False), ("", True)],
+)
+def test_checkout_filter(fake_github, clone_filter, fetched):
+    """
+    Ensure partial clones over file:// only fetch the text and documentation
+    files the spelling check reads, in any case, unless partial clones are
+    disabled
+    """
+    # Setup
+    files = {
+        "README.md": "Readme\n",
+        "CONTRIBUTING": "Contributing\n",
+        "docs/guide.rst": "Guide\n",
+        "docs/INDEX.RST": "Index\n",
+        "assets/image.bin": "0123456789" * 1000,
+    }
+    fake_github.add_repo("fakeuser/assets", files=files)
+    target = local.path(tempfile.mkdtemp())
+    git = local["git"]
+    # Exercise
+    environ = {"METICULOUS_CLONE_FILTER": clone_filter}
+    with mock.patch.dict(os.environ, environ):
+        _github.checkout("assets", target, partial=True)
+    repodir = target / "assets"
+    missing = git("-C", repodir, "rev-list", "--objects", "--all", "--missing=print")
+    tracked = git("-C", repodir, "ls-files").split()
+    # Verify
+    assert (repodir / "README.md").exists()  # noqa=S101 # nosec
+    assert (repodir / "CONTRIBUTING").exists()  # noqa=S101 # nosec
+    assert (repodir / "docs" / "guide.rst").exists()  # noqa=S101 # nosec
+    assert (repodir / "docs" / "INDEX.RST").exists()  # noqa=S101 # nosec
+    image = repodir / "assets" / "image.bin"
+    assert image.exists() == fetched  # noqa=S101 # nosec
+    assert ("?" in missing) != fetched  # noqa=S101 # nosec
+    assert sorted(tracked) == sorted(files)  # noqa=S101 # nosec
+
+
+def test_unanimous_full_clone(fake_github):
+    """
+    Ensure the unanimous checkout that non-words are committed from is a full
+    clone with every file checked out
+    """
+    # Setup
+    files = {
+        "nonwords.txt": "nonword\n",
+        "unanimous/__main__.py": "print()\n",
+    }
+    fake_github.add_repo("resplendent-dev/unanimous", files=files)
+    target = local.path(tempfile.mkdtemp())
+    git = local["git"]
+    # Exercise
+    nonwordpath = _nonword.get_unanimous(target)
+    repodir = target / "unanimous"
+    missing = git("-C", repodir, "rev-list", "--objects", "--all", "--missing=print")
+    sparse = git("-C", repodir, "config", "--get", "core.sparseCheckout", retcode=None)
+    # Verify
+    assert nonwordpath.exists()  # noqa=S101 # nosec
+    assert (repodir / "unanimous" / "__main__.py").exists()  # noqa=S101 # nosec
+    assert "?" not in missing  # noqa=S101 # nosec
+    assert not sparse.strip()  # noqa=S101 # nosec
+
+
+def test_checkout_reference(fake_github):
+    """
+    Ensure forks of the same repository share a reference filled from the
+    finished clones so a related clone adds no objects already held and
+    stands alone once cloned
+    """
+    # Setup
+    fake_github.add_repo("demoorg/mirror0", parent="fakeorg/project0")
+    _github.resolve_repos(["demoorg/mirror0"])
+    target = local.path(tempfile.mkdtemp())
+    reference = target / _reference.REFERENCE_DIR / "fakeorg" / "project0.git"
+    git = local["git"]
+    environ = {"METICULOUS_REFERENCE_BYTES": str(2**30)}
+    # Exercise
+    with mock.patch.dict(os.environ, environ):
+        for orgrepo in ("fakeorg/project0", "demoorg/mirror0"):
+            _github.fork(orgrepo)
+        _github.checkout("project0", target)
+        first = git("--git-dir", reference, "count-objects", "-v").split("\n")
+        _github.checkout("mirror0", target)
+        second = git("--git-dir", reference, "count-objects", "-v").split("\n")
+    refs = git("--git-dir", reference, "for-each-ref", "--format=%(refname)")
+    # Verify
+    assert "in-pack: 0" not in first  # noqa=S101 # nosec
+    assert [line for line in second if "in-pack" in line] == [  # noqa=S101 # nosec
+        line for line in first if "in-pack" in line
+    ]
+    assert refs.split() == [  # noqa=S101 # nosec
+        "refs/remotes/fakeuser/mirror0/HEAD",
+        "refs/remotes/fakeuser/project0/HEAD",
+    ]
+    for repo in ("project0", "mirror0"):
+        repodir = target / repo
+        assert (repodir / "README.md").exists()  # noqa=S101 # nosec
+        assert not (  # noqa=S101 # nosec
+            repodir / ".git" / "objects" / "info" / "alternates"
+        ).exists()
+        git("-C", repodir, "fsck", "--connectivity-only")
+
+
+def test_checkout_reference_partial(fake_github):
+    """
+    Ensure a partial clone does not fill the reference with packs missing
+    blobs that a later full clone of the family would borrow
+    """
+    # Setup
+    fake_github.add_repo("demoorg/mirror0", parent="fakeorg/project0")
+    _github.resolve_repos(["demoorg/mirror0"])
+    target = local.path(tempfile.mkdtemp())
+    reference = target / _reference.REFERENCE_DIR / "fakeorg" / "project0.git"
+    git = local["git"]
+    environ = {"METICULOUS_REFERENCE_BYTES": str(2**30)}
+    # Exercise
+    with mock.patch.dict(os.environ, environ):
+        for orgrepo in ("fakeorg/project0", "demoorg/mirror0"):
+            _github.fork(orgrepo)
+        _github.checkout("project0", target, partial=True)
+        promisors = list((reference / "objects" / "pack").glob("*.promisor"))
+        _github.checkout("mirror0", target)
+    repodir = target / "mirror0"
+    missing = git("-C", repodir, "rev-list", "--objects", "--all", "--missing=print")
+    # Verify
+    assert not promisors  # noqa=S101 # nosec
+    assert "?" not in missing  # noqa=S101 # nosec
+    assert (repodir / "README.md").exists()  # noqa=S101 # nosec
+    git("-C", repodir, "fsck", "--connectivity-only")
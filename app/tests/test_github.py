@@ -0,0 +1,286 @@
+"""
+Test GitHub API handling
+"""
+
+import datetime
+import tempfile
+import threading
+from unittest import mock
+
+import github
+import pytest
+
+from meticulous import _fakegithub, _github, _ratelimit, _storage
+
+FAKE_REPOS = {
+    "old/lib": {"archived": True, "parent": None, "forks": 0, "issues": True},
+    "upstream/lib": {
+        "archived": False,
+        "parent": "old/lib",
+        "forks": 1,
+        "issues": False,
+    },
+    "neworg/repo": {
+        "archived": False,
+        "parent": "upstream/lib",
+        "forks": 0,
+        "issues": True,
+    },
+    "user/lib": {
+        "archived": False,
+        "parent": "upstream/lib",
+        "forks": 0,
+        "issues": True,
+    },
+    "org/archived": {"archived": True, "parent": None, "forks": 0, "issues": True},
+    "org/fresh": {"archived": False, "parent": None, "forks": 0, "issues": True},
+    "org/taken": {"archived": False, "parent": None, "forks": 0, "issues": True},
+    "user/taken": {"archived": False, "parent": None, "forks": 0, "issues": True},
+}
+FAKE_MOVED = {"org/repo": "neworg/repo"}
+
+
+def fake_rest_json(orgrepo, nested=False):
+    """
+    Build a REST repository response, nested repositories omit their parent
+    """
+    repo = FAKE_REPOS[orgrepo]
+    result = {
+        "full_name": orgrepo,
+        "archived": repo["archived"],
+        "has_issues": repo["issues"],
+        "fork": repo["parent"] is not None,
+    }
+    if not nested and repo["parent"] is not None:
+        result["parent"] = fake_rest_json(repo["parent"], nested=True)
+        source = repo["parent"]
+        while FAKE_REPOS[source]["parent"] is not None:
+            source = FAKE_REPOS[source]["parent"]
+        result["source"] = fake_rest_json(source, nested=True)
+    return result
+
+
+class FakeRequester:  # pylint: disable=too-few-public-methods
+    """
+    Answer REST repository requests from the fake repositories honouring
+    If-None-Match
+    """
+
+    rate_limiting = (4000, 5000)
+    rate_limiting_resettime = 0
+
+    def __init__(self):
+        self.calls = []
+
+    def requestJsonAndCheck(  # noqa=N802 pylint: disable=invalid-name
+        self, verb, url, headers=None
+    ):
+        """
+        Respond to a GET of a repository
+        """
+        self.calls.append((verb, url, headers))
+        orgrepo = url.split("/", 2)[-1]
+        orgrepo = FAKE_MOVED.get(orgrepo, orgrepo)
+        if orgrepo not in FAKE_REPOS:
+            raise github.GithubException(404, "Not Found", None)
+        etag = f'"{orgrepo}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            return {"etag": etag}, None
+        return {"etag": etag}, fake_rest_json(orgrepo)
+
+
+def fake_user_repo(name, day):
+    """
+    Build a stand in for a repository of the authenticated user
+    """
+    repo = mock.Mock(created_at=datetime.datetime(2020, 1, day))
+    repo.name = name
+    return repo
+
+
+@pytest.fixture(name="fake_github")
+def fixture_fake_github():
+    """
+    Serve the fake repositories from the offline GitHub stand in
+    """
+    state = _fakegithub.FakeGithub(
+        tempfile.mkdtemp(), _fakegithub.FakeOptions(login="user")
+    )
+    for full_name, repo in FAKE_REPOS.items():
+        state.add_repo(
+            full_name,
+            archived=repo["archived"],
+            has_issues=repo["issues"],
+            parent=repo["parent"],
+        )
+    for old_name, new_name in FAKE_MOVED.items():
+        state.move_repo(old_name, new_name)
+    server = _fakegithub.start_server(state)
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+@mock.patch("meticulous._github.load_api_key")
+@mock.patch("meticulous._github.github.Github")
+def test_client_reused(github_mock, key_mock):
+    """
+    Ensure the token, API object and login are only obtained once
+    """
+    # Setup
+    client = _github.GithubClient()
+    github_mock.return_value.get_user.return_value.login = "user"
+    github_mock.return_value.requester.rate_limiting = (-1, -1)
+    results = []
+
+    def run():
+        for _ in range(5):
+            results.append(client.get_login())
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    # Exercise
+    with mock.patch("meticulous._github.CLIENT", client):
+        run()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        _github.get_api()
+    # Verify
+    assert results == ["user"] * 25  # noqa=S101 # nosec
+    assert key_mock.call_count == 1  # noqa=S101 # nosec
+    assert github_mock.call_count == 1  # noqa=S101 # nosec
+    assert github_mock.return_value.get_user.call_count == 1  # noqa=S101 # nosec
+    assert client.stats() == {"api": 25, "login": 24}  # noqa=S101 # nosec
+
+
+def test_repo_metadata(manager):  # pylint: disable=unused-argument
+    """
+    Ensure vetting a candidate fetches the repository once and reuses the
+    stored metadata for the moved name, archived flag and parent chain,
+    revalidating stored responses with their ETag
+    """
+    # Setup
+    client = _github.GithubClient()
+    client.api = mock.Mock(requester=FakeRequester())
+    client.login = "user"
+    repos = client.api.get_user.return_value.get_repos.return_value
+    repos.get_page.return_value = [fake_user_repo("lib", 1)]
+    scheduler = _ratelimit.RateLimitScheduler()
+    # Exercise
+    with mock.patch("meticulous._github.CLIENT", client), mock.patch(
+        "meticulous._github.SCHEDULER", scheduler
+    ):
+        orgrepo = _github.get_true_orgrepo("org/repo")
+        forked = _github._check_forked(orgrepo)  # pylint: disable=protected-access
+        archived = _github.is_archived(orgrepo)
+        calls = len(client.api.requester.calls)
+        allowed = _github.issues_allowed("lib")
+        again = _github.issues_allowed("lib")
+        parents = _github.get_repo_metadata("user/lib")["parents"]
+    # Verify
+    assert orgrepo == "neworg/repo"  # noqa=S101 # nosec
+    assert forked  # noqa=S101 # nosec
+    assert not archived  # noqa=S101 # nosec
+    assert calls == 2  # noqa=S101 # nosec
+    assert not allowed  # noqa=S101 # nosec
+    assert not again  # noqa=S101 # nosec
+    assert parents == [  # noqa=S101 # nosec
+        {"full_name": "upstream/lib", "has_issues": False},
+    ]
+    assert client.api.requester.calls[-1] == (  # noqa=S101 # nosec
+        "GET",
+        "/repos/upstream/lib",
+        {"If-None-Match": '"upstream/lib"'},
+    )
+    assert len(client.api.requester.calls) == 4  # noqa=S101 # nosec
+    assert scheduler.stats() == {  # noqa=S101 # nosec
+        "remaining": 4000,
+        "reset": 0,
+        "counts": {"priority2": 5, "not_modified": 1},
+    }
+
+
+@mock.patch("meticulous._github.get_api")
+def test_resolve_repos(
+    api_mock, fake_github, manager
+):  # pylint: disable=unused-argument
+    """
+    Ensure a batch of candidates is resolved with one query and the results
+    are stored for later lookups without the REST API, treating a name
+    already taken by the user as forked
+    """
+    # Setup
+    client = _github.GithubClient()
+    client.token = "token"  # nosec
+    client.login = "user"
+    client.api = mock.Mock()
+    orgrepos = ["org/repo", "org/archived", "org/missing", "org/fresh", "org/taken"]
+    # Exercise
+    with mock.patch("meticulous._github.CLIENT", client):
+        results = _github.resolve_repos(orgrepos, url=f"{fake_github.base_url}/graphql")
+    true_name = _github.get_true_orgrepo("org/repo")
+    archived = _github.is_archived("org/archived")
+    # Verify
+    assert fake_github.quota.served == {"graphql": 1}  # noqa=S101 # nosec
+    assert results["org/repo"] == {  # noqa=S101 # nosec
+        "full_name": "neworg/repo",
+        "archived": False,
+        "has_issues": True,
+        "fork": True,
+        "parents": [{"full_name": "upstream/lib", "has_issues": False}],
+        "forked": True,
+    }
+    assert results["org/missing"] is None  # noqa=S101 # nosec
+    assert not results["org/fresh"]["forked"]  # noqa=S101 # nosec
+    assert results["org/taken"]["forked"]  # noqa=S101 # nosec
+    assert _storage.get_value("forked|taken") == "Y"  # noqa=S101 # nosec
+    assert true_name == "neworg/repo"  # noqa=S101 # nosec
+    assert archived  # noqa=S101 # nosec
+    assert _storage.get_value("forked|repo") == "Y"  # noqa=S101 # nosec
+    assert api_mock.call_count == 0  # noqa=S101 # nosec
+
+
+@mock.patch("meticulous._github.GITHUB_PAGE_SIZE", 2)
+def test_fork_index(manager):  # pylint: disable=unused-argument
+    """
+    Ensure fork checks are answered from an index of the user's repositories
+    that is refreshed incrementally and updated when forking
+    """
+    # Setup
+    client = _github.GithubClient()
+    client.api = mock.Mock(requester=FakeRequester())
+    client.login = "user"
+    repos = client.api.get_user.return_value.get_repos.return_value
+    pages = [
+        [fake_user_repo("c", 3), fake_user_repo("b", 2)],
+        [fake_user_repo("a", 1)],
+    ]
+    repos.get_page.side_effect = lambda page: pages[page]
+    # Exercise
+    with mock.patch("meticulous._github.CLIENT", client):
+        initial = [
+            _github._check_forked_direct(name)  # pylint: disable=protected-access
+            for name in ("a", "b", "c", "d")
+        ]
+        initial_pages = repos.get_page.call_count
+        pages[0] = [fake_user_repo("d", 4), fake_user_repo("c", 3)]
+        _storage.delete_value(_github.FORK_INDEX_KEY)
+        refreshed = _github._check_forked_direct(  # pylint: disable=protected-access
+            "d"
+        )
+        refresh_pages = repos.get_page.call_count - initial_pages
+        _github.fork("org/e")
+        forked = _github._check_forked_direct("e")  # pylint: disable=protected-access
+        cached = _github.check_forked("org/e")
+    # Verify
+    assert initial == [True, True, True, False]  # noqa=S101 # nosec
+    assert initial_pages == 2  # noqa=S101 # nosec
+    assert refreshed  # noqa=S101 # nosec
+    assert refresh_pages == 1  # noqa=S101 # nosec
+    assert forked  # noqa=S101 # nosec
+    assert cached  # noqa=S101 # nosec
+    assert repos.get_page.call_count == 4  # noqa=S101 # nosec
+    assert (  # noqa=S101 # nosec
+        _storage.get_user_repository_latest() == "2020-01-04T00:00:00"
+    )
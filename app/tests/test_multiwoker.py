@@ -7,8 +7,9 @@ from unittest import mock
 from meticulous._multiworker import main, update_workload
 
 
+@mock.patch("meticulous._multiworker.get_pending_forks", return_value={})
 @mock.patch("meticulous._multiworker.get_json_value")
-def test_empty_load(get_mock):
+def test_empty_load(get_mock, _):
     """
     Check updating an empty task list adds 3 repository load tasks
     """
@@ -22,11 +23,35 @@ def test_empty_load(get_mock):
     assert len(check) == 10  # noqa=S101 # nosec
 
 
+@mock.patch("meticulous._multiworker.get_pending_forks")
+def test_restore_pending_forks(pending_mock):
+    """
+    Check forks still pending from a previous run are waited on again
+    without duplicating tasks already saved
+    """
+    # Setup
+    initial = [
+        {"interactive": False, "name": "repository_fork_wait", "reponame": "a"},
+    ]
+    pending_mock.return_value = {
+        "a": {"orgrepo": "org/a", "forked_at": 0},
+        "b": {"orgrepo": "org/b", "forked_at": 0},
+    }
+    # Exercise
+    result = update_workload(initial)
+    # Verify
+    waits = [elem["reponame"] for elem in result if "reponame" in elem]
+    loads = [1 for elem in result if elem["name"] == "repository_load"]
+    assert waits == ["a", "b"]  # noqa=S101 # nosec
+    assert len(loads) == 8  # noqa=S101 # nosec
+
+
+@mock.patch("meticulous._multiworker.get_pending_forks", return_value={})
 @mock.patch("meticulous._multiworker.get_json_value")
 @mock.patch("meticulous._multiworker.set_json_value")
 @mock.patch("meticulous._controller.Controller.run")
 @mock.patch("meticulous._multiworker.get_pool")
-def test_main(_, run_mock, set_mock, get_mock):
+def test_main(_, run_mock, set_mock, get_mock, __):
     """
     Main task should load from storage, update the workload and pass off
     handling to the controller and on termination save the result
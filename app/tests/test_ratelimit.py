@@ -0,0 +1,77 @@
+"""
+Test sharing the GitHub rate limit between workers
+"""
+
+import threading
+
+from meticulous import _ratelimit
+
+
+def test_reserve_holds_back_vetting():
+    """
+    Ensure vetting waits once the quota reaches its reserve while pull
+    request creation continues, resuming after the quota resets
+    """
+    # Setup
+    now = [1000]
+    scheduler = _ratelimit.RateLimitScheduler(clock=lambda: now[0])
+    scheduler.update(_ratelimit.RATE_LIMIT_RESERVE[_ratelimit.PRIORITY_VET], 2000)
+    order = []
+
+    def vet():
+        with scheduler.slot(_ratelimit.PRIORITY_VET):
+            order.append("vet")
+
+    thread = threading.Thread(target=vet)
+    # Exercise
+    thread.start()
+    with _ratelimit.prioritise(_ratelimit.PRIORITY_SUBMIT):
+        with scheduler.slot():
+            order.append("submit")
+    thread.join(timeout=0.2)
+    blocked = thread.is_alive()
+    scheduler.update_from_headers(
+        {"X-RateLimit-Remaining": "5000", "X-RateLimit-Reset": "5600"}
+    )
+    thread.join()
+    # Verify
+    assert blocked  # noqa=S101 # nosec
+    assert order == ["submit", "vet"]  # noqa=S101 # nosec
+    assert scheduler.stats()["remaining"] == 4999  # noqa=S101 # nosec
+    assert _ratelimit.get_priority() == _ratelimit.PRIORITY_VET  # noqa=S101 # nosec
+
+
+def test_priority_order_after_reset():
+    """
+    Ensure waiting callers are admitted highest priority first once the
+    quota resets
+    """
+    # Setup
+    now = [1000]
+    scheduler = _ratelimit.RateLimitScheduler(clock=lambda: now[0])
+    scheduler.update(0, 2000)
+    order = []
+    started = threading.Barrier(4)
+
+    def call(priority):
+        started.wait()
+        with scheduler.slot(priority):
+            order.append(priority)
+
+    priorities = [
+        _ratelimit.PRIORITY_VET,
+        _ratelimit.PRIORITY_FORK,
+        _ratelimit.PRIORITY_SUBMIT,
+    ]
+    threads = [threading.Thread(target=call, args=(prio,)) for prio in priorities]
+    # Exercise
+    for thread in threads:
+        thread.start()
+    started.wait()
+    while len(scheduler.waiting) < len(priorities):
+        threading.Event().wait(0.01)
+    scheduler.update(5000, 5600)
+    for thread in threads:
+        thread.join()
+    # Verify
+    assert order == sorted(priorities)  # noqa=S101 # nosec
@@ -0,0 +1,31 @@
+"""
+Test sharing git objects between clones
+"""
+
+import os
+
+from meticulous import _reference
+
+
+def test_collect_references(tmp_path):
+    """
+    Ensure the least recently used references are removed until the rest
+    fit unless in use
+    """
+    # Setup
+    root = tmp_path / _reference.REFERENCE_DIR
+    paths = []
+    for index, name in enumerate(("old", "busy", "new")):
+        path = root / "org" / f"{name}.git"
+        path.mkdir(parents=True)
+        (path / "pack").write_bytes(b"x" * 100)
+        os.utime(path, (index, index))
+        paths.append(path)
+    old, busy, new = paths[0], paths[1], paths[2]
+    # Exercise
+    with _reference.get_reference_lock(busy):
+        removed = _reference.collect_references(tmp_path, 150)
+    # Verify
+    assert removed == [old]  # noqa=S101 # nosec
+    assert busy.exists()  # noqa=S101 # nosec
+    assert new.exists()  # noqa=S101 # nosec
@@ -0,0 +1,89 @@
+"""
+Test obtaining source repositories
+"""
+
+import http.server
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+from meticulous import _sources
+
+SOURCE_LISTS = {
+    "/one.md": "- [a](https://github.com/org/a)\n- [b](https://github.com/org/b/)\n",
+    "/two.md": "- [c](https://github.com/angvp/c)\n- [d](https://example.com/d)\n",
+}
+
+
+class SourceHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve the source lists with validators, requiring the lists to be
+    requested together
+    """
+
+    barrier = threading.Barrier(len(SOURCE_LISTS), timeout=5)
+    statuses = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Respond with a source list or not modified
+        """
+        self.barrier.wait()
+        etag = f'"{self.path}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        payload = SOURCE_LISTS[self.path].encode("utf-8")
+        self.statuses.append(200)
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", "Wed, 01 Jan 2020 00:00:00 GMT")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """
+        Keep test output quiet
+        """
+
+
+@pytest.fixture(name="source_urls")
+def fixture_source_urls():
+    """
+    Serve the source lists on a local port
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SourceHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    SourceHandler.statuses = []
+    base = f"http://127.0.0.1:{server.server_port}"
+    yield [f"{base}{path}" for path in SOURCE_LISTS]
+    server.shutdown()
+    server.server_close()
+
+
+def test_conditional_refresh(source_urls, manager):  # pylint: disable=unused-argument
+    """
+    Ensure the lists are downloaded concurrently, revalidated with a not
+    modified response and stale lists are still answered from the cache
+    """
+    # Setup
+    environ = {"METICULOUS_SOURCE_URLS": " ".join(source_urls)}
+    # Exercise
+    with mock.patch.dict(os.environ, environ):
+        first = list(_sources.obtain_sources())
+        changed = _sources.refresh_sources(force=True)
+        with mock.patch("meticulous._sources.CACHE_TIME_DAYS", -1):
+            stale = list(_sources.obtain_sources())
+            stale_flags = [_sources.is_stale(url) for url in source_urls]
+    # Verify
+    assert first == ["org/a", "org/b"]  # noqa=S101 # nosec
+    assert changed == {url: False for url in source_urls}  # noqa=S101 # nosec
+    assert stale == first  # noqa=S101 # nosec
+    assert stale_flags == [True, True]  # noqa=S101 # nosec
+    assert SourceHandler.statuses == [200, 200, 304, 304]  # noqa=S101 # nosec
@@ -0,0 +1,228 @@
+"""
+Test the in-process spelling engine
+"""
+
+from unittest import mock
+
+import pyspelling
+from plumbum import local
+
+from meticulous import _spelling
+
+
+class FakeSpellingTask(pyspelling.SpellingTask):
+    """
+    Report a misspelt word in each markdown file the task sources match
+    """
+
+    tasks = []
+    checked = []
+
+    def __init__(
+        self, checker, config, **kwargs
+    ):  # pylint: disable=super-init-not-called
+        self.checker = checker
+        self.config = config
+        self.kwargs = kwargs
+
+    def run_task(self, task, source_patterns=None):
+        """
+        Record the task and yield results for the markdown files
+        """
+        self.tasks.append(task)
+        if task["name"] != "markdown":
+            return
+        for path in self.walk_src(source_patterns, 0, 1000):
+            self.checked.append(path)
+            yield pyspelling.Results(["teh"], path, task["name"])
+
+
+@mock.patch("meticulous._spelling.pyspelling.SpellingTask", FakeSpellingTask)
+@mock.patch("meticulous._spelling.pyspelling.Aspell.compile_dictionary")
+@mock.patch("meticulous._spelling.get_cached_sha")
+@mock.patch("meticulous._spelling.get_current_non_words")
+@mock.patch("meticulous._spelling.ensure_dependencies")
+def test_engine_reused(
+    dependencies_mock, nonwords_mock, sha_mock, compile_mock, tmp_path
+):
+    """
+    Ensure the dictionaries are loaded once across repositories and each
+    check returns the words found in that repository
+    """
+    # Setup
+    nonwords_mock.return_value = ["nonword"]
+    sha_mock.return_value = "sha"
+    repos = []
+    for name in ("one", "two"):
+        repodir = tmp_path / name
+        repodir.mkdir()
+        (repodir / "README.md").write_text("teh", encoding="utf-8")
+        (repodir / "wordlist.txt").write_text("word", encoding="utf-8")
+        repos.append(repodir)
+    engine = _spelling.SpellingEngine()
+    FakeSpellingTask.tasks = []
+    # Exercise
+    try:
+        results = [engine.check(repodir) for repodir in repos]
+        extra_dicts = list(engine.dictionaries.extra_dicts)
+    finally:
+        engine.stop()
+    # Verify
+    assert dependencies_mock.call_count == 1  # noqa=S101 # nosec
+    assert nonwords_mock.call_count == 1  # noqa=S101 # nosec
+    # non-words once then the custom wordlist of each repository
+    assert compile_mock.call_count == 3  # noqa=S101 # nosec
+    assert results == [  # noqa=S101 # nosec
+        {
+            "teh": {
+                "files": [{"category": "markdown", "file": str(repodir / "README.md")}]
+            }
+        }
+        for repodir in repos
+    ]
+    task = FakeSpellingTask.tasks[-1]
+    assert task["sources"][0][0].startswith(str(repos[1]))  # noqa=S101 # nosec
+    assert task["dictionary"]["wordlists"] == [  # noqa=S101 # nosec
+        str(repos[1] / "wordlist.txt")
+    ]
+    assert task["aspell"]["add-extra-dicts"] == extra_dicts  # noqa=S101 # nosec
+    assert engine.dictionaries.settings is None  # noqa=S101 # nosec
+
+
+@mock.patch("meticulous._spelling.pyspelling.SpellingTask", FakeSpellingTask)
+@mock.patch("meticulous._spelling.pyspelling.Aspell.compile_dictionary")
+@mock.patch("meticulous._spelling.get_cached_sha")
+@mock.patch("meticulous._spelling.get_current_non_words")
+@mock.patch("meticulous._spelling.ensure_dependencies")
+def test_nonwords_reloaded(
+    dependencies_mock, nonwords_mock, sha_mock, compile_mock, tmp_path
+):  # pylint: disable=unused-argument
+    """
+    Ensure the non-word dictionary is compiled again once the stored
+    non-words change
+    """
+    # Setup
+    (tmp_path / "README.md").write_text("teh", encoding="utf-8")
+    nonwords_mock.side_effect = [["old"], ["old", "new"]]
+    sha_mock.side_effect = ["one", "one", "two"]
+    engine = _spelling.SpellingEngine(use_cache=False)
+    # Exercise
+    try:
+        engine.check(tmp_path)
+        first = engine.dictionaries.fingerprint
+        engine.check(tmp_path)
+        unchanged = engine.dictionaries.fingerprint
+        engine.check(tmp_path)
+        changed = engine.dictionaries.fingerprint
+        stale_paths = list(engine.dictionaries.stale_paths)
+    finally:
+        engine.stop()
+    # Verify
+    assert nonwords_mock.call_count == 2  # noqa=S101 # nosec
+    assert compile_mock.call_count == 2  # noqa=S101 # nosec
+    assert unchanged == first  # noqa=S101 # nosec
+    assert changed != first  # noqa=S101 # nosec
+    assert len(stale_paths) == 1  # noqa=S101 # nosec
+    assert not stale_paths[0].exists()  # noqa=S101 # nosec
+
+
+@mock.patch("meticulous._spelling.ensure_dependencies")
+def test_sharded_check(dependencies_mock, tmp_path):  # pylint: disable=unused-argument
+    """
+    Ensure a check split across processes finds the same words as one
+    checked in a single process
+    """
+    # Setup
+    for index in range(6):
+        (tmp_path / f"doc{index}.md").write_text("teh", encoding="utf-8")
+    sequential = _spelling.SpellingEngine(
+        use_unanimous=False, processes=1, task_class=FakeSpellingTask
+    )
+    sharded = _spelling.SpellingEngine(
+        use_unanimous=False,
+        processes=2,
+        shard_size=2,
+        shard_min_files=0,
+        task_class=FakeSpellingTask,
+    )
+    # Exercise
+    try:
+        expected = sequential.check(tmp_path)
+        result = sharded.check(tmp_path)
+        tasks = sharded.get_tasks(tmp_path, "x.dic")
+        sources = [(task, _spelling.list_sources(task)) for task in tasks]
+        shards, parallel = sharded.get_shards(sources)
+    finally:
+        sequential.stop()
+        sharded.stop()
+    # Verify
+    assert parallel  # noqa=S101 # nosec
+    assert [len(files) for _, files in shards] == [2, 2, 2]  # noqa=S101 # nosec
+    assert len(expected["teh"]["files"]) == 6  # noqa=S101 # nosec
+    assert result == expected  # noqa=S101 # nosec
+
+
+@mock.patch("meticulous._spelling.pyspelling.SpellingTask", FakeSpellingTask)
+@mock.patch("meticulous._spelling.ensure_dependencies")
+def test_cached_check(
+    dependencies_mock, manager, tmp_path
+):  # pylint: disable=unused-argument
+    """
+    Ensure files already checked are found by git blob SHA while modified,
+    untracked and copied repositories reuse what they can
+    """
+    # Setup
+    repodir = tmp_path / "repo"
+    repodir.mkdir()
+    for name in ("one.md", "two.md"):
+        (repodir / name).write_text(name, encoding="utf-8")
+    git = local["git"]
+    git("-C", str(repodir), "init", "-q")
+    git("-C", str(repodir), "add", "-A")
+    git(
+        "-C",
+        str(repodir),
+        "-c",
+        "user.name=test",
+        "-c",
+        "user.email=test@example.com",
+        "commit",
+        "-q",
+        "-m",
+        "init",
+    )
+    copydir = tmp_path / "copy"
+    git("clone", "-q", str(repodir), str(copydir))
+    engine = _spelling.SpellingEngine(use_unanimous=False, processes=1)
+    FakeSpellingTask.checked = []
+    # Exercise
+    try:
+        first = engine.check(repodir)
+        first_checked = list(FakeSpellingTask.checked)
+        (repodir / "two.md").write_text("changed", encoding="utf-8")
+        (repodir / "three.md").write_text("new", encoding="utf-8")
+        FakeSpellingTask.checked = []
+        second = engine.check(repodir)
+        second_checked = list(FakeSpellingTask.checked)
+        FakeSpellingTask.checked = []
+        copied = engine.check(copydir)
+        copied_checked = list(FakeSpellingTask.checked)
+    finally:
+        engine.stop()
+    # Verify
+    assert sorted(first_checked) == [  # noqa=S101 # nosec
+        str(repodir / "one.md"),
+        str(repodir / "two.md"),
+    ]
+    assert sorted(second_checked) == [  # noqa=S101 # nosec
+        str(repodir / "three.md"),
+        str(repodir / "two.md"),
+    ]
+    assert not copied_checked  # noqa=S101 # nosec
+    assert sorted(  # noqa=S101 # nosec
+        item["file"] for item in second["teh"]["files"]
+    ) == sorted([str(repodir / name) for name in ("one.md", "three.md", "two.md")])
+    assert sorted(  # noqa=S101 # nosec
+        item["file"] for item in copied["teh"]["files"]
+    ) == [str(copydir / name) for name in ("one.md", "two.md")]
+    assert len(first["teh"]["files"]) == 2  # noqa=S101 # nosec
@@ -0,0 +1,610 @@
+"""
+Test storage of key values
+"""
+
+import concurrent.futures
+import datetime
+import gc
+import json
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from meticulous import _connection, _storage
+from meticulous._constants import MULTI_SAVE_KEY
+from meticulous._exceptions import PoolExhausted
+
+
+def test_set_and_get(manager):  # pylint: disable=unused-argument
+    """
+    Ensure a saved value can be read back and replaced
+    """
+    # Setup
+    _storage.set_value("key", "first")
+    # Exercise
+    _storage.set_value("key", "second")
+    # Verify
+    assert _storage.get_value("key") == "second"  # noqa=S101 # nosec
+    assert _storage.get_value("missing", "deflt") == "deflt"  # noqa=S101 # nosec
+
+
+def test_json_value(manager):  # pylint: disable=unused-argument
+    """
+    Ensure json values round trip
+    """
+    # Setup
+    _storage.set_json_value("key", {"a": [1, 2]})
+    # Exercise
+    result = _storage.get_json_value("key")
+    # Verify
+    assert result == {"a": [1, 2]}  # noqa=S101 # nosec
+
+
+def test_connection_reuse(manager):
+    """
+    Ensure repeated lookups share one connection per thread
+    """
+    # Setup
+    before = manager.stats()
+    # Exercise
+    for _ in range(10):
+        _storage.get_value("key")
+    thread = threading.Thread(target=_storage.get_value, args=("key",))
+    thread.start()
+    thread.join()
+    # Verify
+    after = manager.stats()
+    assert after["backend"] == "sqlite"  # noqa=S101 # nosec
+    assert after["opened"] - before["opened"] == 1  # noqa=S101 # nosec
+    assert after["reused"] - before["reused"] == 10  # noqa=S101 # nosec
+
+
+def test_connection_released(manager):
+    """
+    Ensure connections opened by short lived threads are closed once the
+    threads finish
+    """
+    # Setup
+    before = manager.stats()
+    # Exercise
+    for _ in range(5):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(
+                executor.map(_storage.get_value, [f"key{index}" for index in range(32)])
+            )
+    del executor
+    gc.collect()
+    # Verify
+    after = manager.stats()
+    assert after["opened"] > before["opened"]  # noqa=S101 # nosec
+    assert after["open"] == before["open"]  # noqa=S101 # nosec
+    assert (  # noqa=S101 # nosec
+        after["released"] - before["released"] == after["opened"] - before["opened"]
+    )
+
+
+@mock.patch("meticulous._connection.psycopg2.pool.ThreadedConnectionPool")
+def test_postgres_pool_bounded(pool_mock):
+    """
+    Ensure postgres threads share a bounded pool, waiting for the connection
+    of a finished thread once it is exhausted
+    """
+    # Setup
+    manager = _storage.ConnectionManager(pool_size=1)
+    manager.pool = _connection.PostgresPool("dsn", 1)
+    pool_mock.return_value.getconn.side_effect = mock.Mock
+    first_done = threading.Event()
+    second_done = threading.Event()
+
+    def first():
+        manager.get()
+        first_done.set()
+
+    # Exercise
+    thread = threading.Thread(target=first)
+    thread.start()
+    first_done.wait(timeout=5)
+    waiter = threading.Thread(target=lambda: (manager.get(), second_done.set()))
+    waiter.start()
+    blocked = not second_done.wait(timeout=0.2)
+    thread.join()
+    del thread
+    gc.collect()
+    second_done.wait(timeout=5)
+    waiter.join()
+    # Verify
+    assert blocked  # noqa=S101 # nosec
+    assert second_done.is_set()  # noqa=S101 # nosec
+    assert pool_mock.call_args[0][1] == 1  # noqa=S101 # nosec
+    assert pool_mock.return_value.putconn.call_count >= 1  # noqa=S101 # nosec
+
+
+@mock.patch("meticulous._connection.POSTGRES_POOL_TIMEOUT", 0.1)
+@mock.patch("meticulous._connection.psycopg2.pool.ThreadedConnectionPool")
+def test_postgres_pool_timeout(pool_mock):
+    """
+    Ensure a thread gives up with a clear error rather than waiting forever
+    for a postgres connection that is never returned
+    """
+    # Setup
+    manager = _storage.ConnectionManager(pool_size=1)
+    manager.pool = _connection.PostgresPool("dsn", 1)
+    pool_mock.return_value.getconn.side_effect = mock.Mock
+    manager.get()
+    errors = []
+
+    def waiter():
+        try:
+            manager.get()
+        except PoolExhausted as exc:
+            errors.append(exc)
+
+    # Exercise
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    thread.join(timeout=5)
+    # Verify
+    assert len(errors) == 1  # noqa=S101 # nosec
+    assert "No postgres connection was free" in str(errors[0])  # noqa=S101 # nosec
+
+
+def test_migrate_duplicate_keys(tmp_path):
+    """
+    Ensure an existing config table with duplicated keys is migrated in place
+    keeping the most recently inserted value
+    """
+    # Setup
+    path = tmp_path / "sqlite.db"
+    manager = _storage.ConnectionManager(dsn=None, sqlite_path=path)
+    con = manager.get()
+    with con:
+        con.execute("CREATE TABLE config ( key text, value text )")
+        con.executemany(
+            "INSERT INTO config ( key, value ) VALUES (?, ?)",
+            [("key", "old"), ("key", "new"), ("other", "value")],
+        )
+    with mock.patch("meticulous._storage.MANAGER", manager):
+        # Exercise
+        _storage.prepare()
+        _storage.prepare()
+        _storage.set_value("key", "newer")
+        # Verify
+        assert _storage.get_value("key") == "newer"  # noqa=S101 # nosec
+        assert _storage.get_value("other") == "value"  # noqa=S101 # nosec
+        count = con.execute("SELECT COUNT(*) FROM config").fetchone()[0]
+        assert count == 2  # noqa=S101 # nosec
+    manager.close()
+
+
+def test_multi_repo(manager):  # pylint: disable=unused-argument
+    """
+    Ensure fixes are saved and removed per repository
+    """
+    # Setup
+    _storage.add_multi_repo("one", {"reponame": "one", "add_word": "a"})
+    _storage.add_multi_repo("two", {"reponame": "two", "add_word": "b"})
+    _storage.add_multi_repo("one", {"reponame": "one", "add_word": "c"})
+    # Exercise
+    _storage.remove_multi_repo("two")
+    # Verify
+    assert [  # noqa=S101 # nosec
+        item["add_word"] for item in _storage.get_multi_repo("one")
+    ] == ["a", "c"]
+    assert _storage.get_multi_repo("two") == []  # noqa=S101 # nosec
+
+
+def test_migrate_multi_repo(tmp_path):
+    """
+    Ensure the old json list of fixes is moved to rows
+    """
+    # Setup
+    path = tmp_path / "sqlite.db"
+    manager = _storage.ConnectionManager(dsn=None, sqlite_path=path)
+    con = manager.get()
+    saves = [{"reponame": "one", "add_word": "a"}, {"reponame": "two"}]
+    with con:
+        con.execute("CREATE TABLE config ( key text, value text )")
+        con.execute(
+            "INSERT INTO config ( key, value ) VALUES (?, ?)",
+            (MULTI_SAVE_KEY, json.dumps(saves)),
+        )
+    with mock.patch("meticulous._storage.MANAGER", manager):
+        # Exercise
+        _storage.prepare()
+        # Verify
+        assert _storage.get_multi_repo("one") == saves[:1]  # noqa=S101 # nosec
+        assert _storage.get_multi_repo("two") == saves[1:]  # noqa=S101 # nosec
+        assert _storage.get_value(MULTI_SAVE_KEY) is None  # noqa=S101 # nosec
+    manager.close()
+
+
+def test_repository_forked(manager):  # pylint: disable=unused-argument
+    """
+    Ensure forked repositories are recorded as a set
+    """
+    # Setup
+    _storage.add_repository_forked(["one", "two"])
+    # Exercise
+    _storage.add_repository_forked(["two", "three"])
+    # Verify
+    assert _storage.is_repository_forked("three")  # noqa=S101 # nosec
+    assert not _storage.is_repository_forked("four")  # noqa=S101 # nosec
+
+
+def test_repository_map(manager):  # pylint: disable=unused-argument
+    """
+    Ensure repository directories are recorded and removed
+    """
+    # Setup
+    _storage.set_repository_dir("one", "/tmp/one")
+    _storage.set_repository_dir("two", "/tmp/two")
+    # Exercise
+    _storage.set_repository_dir("one", "/data/one")
+    _storage.remove_repository_dir("two")
+    # Verify
+    assert _storage.get_repository_map() == {"one": "/data/one"}  # noqa=S101 # nosec
+    assert _storage.get_repository_dir("two") is None  # noqa=S101 # nosec
+
+
+def test_migrate_repository_tables(tmp_path):
+    """
+    Ensure the old json values are imported into the repository tables
+    """
+    # Setup
+    path = tmp_path / "sqlite.db"
+    manager = _storage.ConnectionManager(dsn=None, sqlite_path=path)
+    con = manager.get()
+    with con:
+        con.execute("CREATE TABLE config ( key text, value text )")
+        con.executemany(
+            "INSERT INTO config ( key, value ) VALUES (?, ?)",
+            [
+                ("repository_forked", json.dumps({"one": True, "two": True})),
+                ("repository_map", json.dumps({"one": "/tmp/one"})),
+            ],
+        )
+    with mock.patch("meticulous._storage.MANAGER", manager):
+        # Exercise
+        _storage.prepare()
+        # Verify
+        assert _storage.is_repository_forked("two")  # noqa=S101 # nosec
+        assert _storage.get_repository_map() == {"one": "/tmp/one"}  # noqa=S101 # nosec
+        assert _storage.get_value("repository_map") is None  # noqa=S101 # nosec
+    manager.close()
+
+
+def test_batch_rollback(manager):  # pylint: disable=unused-argument
+    """
+    Ensure writes in a failed batch are all discarded
+    """
+    # Setup
+    _storage.set_value("key", "before")
+    # Exercise
+    with pytest.raises(ValueError):
+        with _storage.batch():
+            _storage.set_value("key", "after")
+            _storage.set_value("other", "after")
+            raise ValueError()
+    # Verify
+    assert _storage.get_value("key") == "before"  # noqa=S101 # nosec
+    assert _storage.get_value("other") is None  # noqa=S101 # nosec
+
+
+def test_batch_commit(manager):
+    """
+    Ensure writes in a batch are visible to other connections once complete
+    """
+    # Setup
+    results = []
+
+    def read():
+        results.append(_storage.get_value("key"))
+
+    # Exercise
+    with _storage.batch():
+        _storage.set_value("key", "value")
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+    read()
+    # Verify
+    assert results == [None, "value"]  # noqa=S101 # nosec
+    (mode,) = manager.get().execute("PRAGMA journal_mode").fetchone()
+    assert mode == "wal"  # noqa=S101 # nosec
+
+
+def test_json_cache(manager):
+    """
+    Ensure json values are served from the cache until written
+    """
+    # Setup
+    _storage.set_json_value("key", {"a": 1})
+    before = manager.cache.stats()
+    # Exercise
+    first = _storage.get_json_value("key")
+    first["a"] = 2
+    second = _storage.get_json_value("key")
+    _storage.set_json_value("key", {"a": 3})
+    third = _storage.get_json_value("key")
+    missing = _storage.get_json_value("missing", {})
+    missing["a"] = 4
+    missing_again = _storage.get_json_value("missing", {})
+    # Verify
+    after = manager.cache.stats()
+    assert second == {"a": 1}  # noqa=S101 # nosec
+    assert third == {"a": 3}  # noqa=S101 # nosec
+    assert missing_again == {}  # noqa=S101 # nosec
+    assert after["hits"] - before["hits"] == 2  # noqa=S101 # nosec
+    assert after["misses"] - before["misses"] == 3  # noqa=S101 # nosec
+
+
+def test_json_cache_batch(manager):  # pylint: disable=unused-argument
+    """
+    Ensure values read within a rolled back batch are not cached
+    """
+    # Setup
+    _storage.set_json_value("key", "before")
+    # Exercise
+    with pytest.raises(ValueError):
+        with _storage.batch():
+            _storage.set_json_value("key", "after")
+            assert _storage.get_json_value("key") == "after"  # noqa=S101 # nosec
+            raise ValueError()
+    # Verify
+    assert _storage.get_json_value("key") == "before"  # noqa=S101 # nosec
+
+
+def test_worker_writes(manager):  # pylint: disable=unused-argument
+    """
+    Ensure writes from pool workers are applied by the storage writer
+    """
+    # Setup
+    writer = _storage.StorageWriter(_storage.apply_operations)
+    errors = []
+
+    def work(index):
+        _storage.mark_worker()
+        _storage.set_value(f"key{index}", "value")
+        with _storage.batch():
+            _storage.set_value(f"batch{index}", "value")
+            _storage.add_repository_forked([f"repo{index}"])
+        try:
+            _storage.set_multi_repo(f"repo{index}", [object()])
+        except TypeError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=work, args=(index,)) for index in range(5)]
+    with mock.patch("meticulous._storage.WRITER", writer):
+        # Exercise
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.stop()
+    # Verify
+    for index in range(5):
+        assert _storage.get_value(f"key{index}") == "value"  # noqa=S101 # nosec
+        assert _storage.get_value(f"batch{index}") == "value"  # noqa=S101 # nosec
+        assert _storage.is_repository_forked(f"repo{index}")  # noqa=S101 # nosec
+    assert len(errors) == 5  # noqa=S101 # nosec
+    assert writer.stats()["operations"] == 15  # noqa=S101 # nosec
+
+
+def test_writer_failure(manager):  # pylint: disable=unused-argument
+    """
+    Ensure writes report a failed connection and a writer thread that dies
+    fails the writes it holds and is replaced by the next write
+    """
+    # Setup
+    writer = _storage.StorageWriter(_storage.apply_operations)
+
+    def store(con, cur):
+        sql = "INSERT INTO config ( key, value ) VALUES (%s, %s)"
+        cur.execute(_storage.get_sql(con, sql), ("key", "value"))
+
+    def interrupt(con, cur):  # pylint: disable=unused-argument
+        raise KeyboardInterrupt()
+
+    # Exercise
+    with mock.patch("meticulous._storage.get_db", side_effect=OSError("down")):
+        failed = writer.submit([store])
+        with pytest.raises(OSError, match="down"):
+            failed.result(timeout=10)
+    interrupted = writer.submit([interrupt])
+    with pytest.raises(KeyboardInterrupt):
+        interrupted.result(timeout=10)
+    stored = writer.submit([store])
+    stored.result(timeout=10)
+    writer.stop()
+    # Verify
+    assert _storage.get_value("key") == "value"  # noqa=S101 # nosec
+    assert writer.stats()["operations"] == 1  # noqa=S101 # nosec
+
+
+def test_suggestions(manager):  # pylint: disable=unused-argument
+    """
+    Ensure suggestions for many words are found together
+    """
+    # Setup
+    words = [f"word{index}" for index in range(1200)]
+    for word in words[::2]:
+        _storage.set_suggestion(word, {"is_typo": True}, "websearch")
+    # Exercise
+    result = _storage.get_suggestions(words)
+    # Verify
+    assert sorted(result) == sorted(words[::2])  # noqa=S101 # nosec
+    assert result["word0"] == {"is_typo": True}  # noqa=S101 # nosec
+
+
+def test_migrate_suggestions(tmp_path):
+    """
+    Ensure suggestions saved as config keys move to the suggestions table
+    """
+    # Setup
+    path = tmp_path / "sqlite.db"
+    manager = _storage.ConnectionManager(dsn=None, sqlite_path=path)
+    con = manager.get()
+    with con:
+        con.execute("CREATE TABLE config ( key text, value text )")
+        con.executemany(
+            "INSERT INTO config ( key, value ) VALUES (?, ?)",
+            [
+                ("suggestion.thier", json.dumps({"replacement_list": ["their"]})),
+                ("suggestion.nonword", json.dumps({"no_suggestion": True})),
+                ("other", "value"),
+            ],
+        )
+    with mock.patch("meticulous._storage.MANAGER", manager):
+        # Exercise
+        _storage.prepare()
+        # Verify
+        assert _storage.get_suggestions(  # noqa=S101 # nosec
+            ["thier", "nonword", "other"]
+        ) == {
+            "thier": {"replacement_list": ["their"]},
+            "nonword": {"no_suggestion": True},
+        }
+        assert _storage.get_value("suggestion.thier") is None  # noqa=S101 # nosec
+        assert _storage.get_value("other") == "value"  # noqa=S101 # nosec
+    manager.close()
+
+
+def test_expiry(manager):  # pylint: disable=unused-argument
+    """
+    Ensure values expire lazily on read and are compacted away
+    """
+    # Setup
+    _storage.set_json_value("short", "value", ttl=60)
+    _storage.set_json_value("long", "value", ttl=120)
+    _storage.set_suggestion("word", {"no_suggestion": True}, "websearch", ttl=60)
+    assert _storage.get_json_value("short") == "value"  # noqa=S101 # nosec
+    now = time.time()
+    with mock.patch("time.time", return_value=now + 90):
+        # Exercise
+        short = _storage.get_json_value("short", "expired")
+        long = _storage.get_json_value("long", "expired")
+        suggestions = _storage.get_suggestions(["word"])
+        _storage.compact()
+    # Verify
+    assert short == "expired"  # noqa=S101 # nosec
+    assert long == "value"  # noqa=S101 # nosec
+    assert not suggestions  # noqa=S101 # nosec
+    con = manager.get()
+    (count,) = con.execute("SELECT COUNT(*) FROM suggestions").fetchone()
+    assert count == 0  # noqa=S101 # nosec
+
+
+def test_migrate_source_dates(tmp_path):
+    """
+    Ensure the dates of cached source links are dropped leaving the links
+    to be refreshed in the background rather than expired
+    """
+    # Setup
+    path = tmp_path / "sqlite.db"
+    manager = _storage.ConnectionManager(dsn=None, sqlite_path=path)
+    con = manager.get()
+    recent = datetime.datetime.now() - datetime.timedelta(days=1)
+    with con:
+        con.execute("CREATE TABLE config ( key text, value text )")
+        con.executemany(
+            "INSERT INTO config ( key, value ) VALUES (?, ?)",
+            [
+                ("github_links|old", "a/b"),
+                ("github_links_datetxt|old", "2020-01-01 00:00:00"),
+                ("github_links|new", "c/d"),
+                (
+                    "github_links_datetxt|new",
+                    recent.strftime("%Y-%m-%d %H:%M:%S"),
+                ),
+            ],
+        )
+    with mock.patch("meticulous._storage.MANAGER", manager):
+        # Exercise
+        _storage.prepare()
+        # Verify
+        assert _storage.get_value("github_links|old") == "a/b"  # noqa=S101 # nosec
+        assert _storage.get_value("github_links|new") == "c/d"  # noqa=S101 # nosec
+        assert _storage.get_value_expiry("github_links|old") == (  # noqa=S101 # nosec
+            "a/b",
+            None,
+        )
+        assert (  # noqa=S101 # nosec
+            _storage.get_value("github_links_datetxt|new") is None
+        )
+    manager.close()
+
+
+def test_migrate_candidates(tmp_path):
+    """
+    Ensure the cached source lists become a deduplicated candidate queue with
+    forked repositories marked
+    """
+    # Setup
+    path = tmp_path / "sqlite.db"
+    manager = _storage.ConnectionManager(dsn=None, sqlite_path=path)
+    con = manager.get()
+    with con:
+        con.execute("CREATE TABLE config ( key text, value text )")
+        con.executemany(
+            "INSERT INTO config ( key, value ) VALUES (?, ?)",
+            [
+                ("github_links|a", "org/one\norg/two"),
+                ("github_links|b", "org/two\norg/three"),
+                ("repository_forked", json.dumps({"one": True})),
+            ],
+        )
+    with mock.patch("meticulous._storage.MANAGER", manager):
+        # Exercise
+        _storage.prepare()
+        # Verify
+        assert _storage.get_pending_candidates(10) == [  # noqa=S101 # nosec
+            "org/two",
+            "org/three",
+        ]
+        assert _storage.get_candidate_counts() == {  # noqa=S101 # nosec
+            "forked": 1,
+            "pending": 2,
+        }
+    manager.close()
+
+
+def test_candidate_queue(manager):  # pylint: disable=unused-argument
+    """
+    Ensure candidates are merged without duplicates and popped in order of
+    arrival until their status changes
+    """
+    # Setup
+    _storage.add_candidates(["org/a", "org/b", "org/a"])
+    # Exercise
+    first = _storage.get_pending_candidates(1)
+    _storage.set_candidate_status({"org/a": _storage.CANDIDATE_ARCHIVED})
+    _storage.add_candidates(["org/c", "org/b"])
+    second = _storage.get_pending_candidates(10)
+    # Verify
+    assert first == ["org/a"]  # noqa=S101 # nosec
+    assert second == ["org/b", "org/c"]  # noqa=S101 # nosec
+    assert _storage.get_candidate_counts() == {  # noqa=S101 # nosec
+        "archived": 1,
+        "pending": 2,
+    }
+
+
+def test_spelling_findings(manager):  # pylint: disable=unused-argument
+    """
+    Ensure cached spelling findings are kept apart by dictionary and task
+    """
+    # Setup
+    blobs = [f"{index:040x}" for index in range(600)]
+    _storage.add_spelling_findings(
+        "dict", "markdown", {blob: [["teh", "markdown"]] for blob in blobs[::2]}
+    )
+    _storage.add_spelling_findings("other", "markdown", {blobs[1]: []})
+    # Exercise
+    result = _storage.get_spelling_findings("dict", "markdown", blobs)
+    # Verify
+    assert sorted(result) == sorted(blobs[::2])  # noqa=S101 # nosec
+    assert result[blobs[0]] == [["teh", "markdown"]]  # noqa=S101 # nosec
+    other = _storage.get_spelling_findings("dict", "python", blobs)
+    assert not other  # noqa=S101 # nosec
@@ -5,6 +5,7 @@ serializing user input
 
 import threading
 
+from meticulous._storage import is_worker
 from meticulous._threadpool import get_pool
 
 
@@ -64,3 +65,26 @@ def test_shutdown():
         result = pool.save()
     # Verify
     assert result == ([taskjson] * 8)  # noqa=S101 # nosec
+
+
+def test_worker_marked():
+    """
+    Check tasks run in the pool are flagged as workers for storage writes
+    """
+    # Setup
+    result = []
+
+    def run():
+        result.append(is_worker())
+
+    def load_run(_):
+        return run
+
+    pool = get_pool({"run": load_run})
+    with pool:
+        # Exercise
+        pool.add({"name": "run"}, None)
+        pool.stop()
+    # Verify
+    assert result == [True]  # noqa=S101 # nosec
+    assert not is_worker()  # noqa=S101 # nosec